@@ -0,0 +1,191 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+from telemetry import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# Controle de admissão das execuções de fluxo (api.py), em duas etapas:
+#
+# 1. Sessão: uma execução por `thread_id` de cada vez. Duas requisições do mesmo usuário
+#    fariam `aget_state` + `astream` no mesmo checkpoint ao mesmo tempo; a segunda espera
+#    a primeira terminar (fila FIFO do lock). Fila cheia ou espera longa demais -> 429.
+# 2. Global: no máximo `max_in_flight` execuções no processo; as demais esperam numa fila
+#    de até `max_queue` posições por no máximo `queue_timeout` segundos. Fila cheia ou
+#    espera esgotada -> 503.
+#
+# As duas respostas levam `Retry-After`, estimado pelo tempo médio de uma execução.
+# A sessão é admitida antes do global: requisições enfileiradas atrás da mesma sessão
+# não ocupam vagas de execução.
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pela admissão; `status_code` 429 (sessão) ou 503 (processo)."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class _SessionSlot:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Quem está com o lock + quem espera por ele
+        self.users = 0
+
+
+class AdmissionTicket:
+    """Vaga obtida em `AdmissionController.acquire`; `release()` pode ser chamado mais de uma vez."""
+
+    __slots__ = ("_controller", "_thread_id", "_slot", "_started_at", "_released")
+
+    def __init__(self, controller: "AdmissionController", thread_id: str, slot: _SessionSlot):
+        self._controller = controller
+        self._thread_id = thread_id
+        self._slot = slot
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._thread_id, self._slot, time.monotonic() - self._started_at)
+
+
+class AdmissionController:
+    """
+    Serializa as execuções de cada sessão e limita as execuções simultâneas do processo.
+    `max_in_flight` <= 0 desliga o limite global (a serialização por sessão continua).
+    """
+
+    def __init__(self, max_in_flight: int = 64, max_queue: int = 256, queue_timeout: float = 10.0,
+                 max_session_queue: int = 4, session_timeout: float = 30.0):
+        self.max_in_flight = int(max_in_flight)
+        self.max_queue = int(max_queue)
+        self.queue_timeout = float(queue_timeout)
+        self.max_session_queue = int(max_session_queue)
+        self.session_timeout = float(session_timeout)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight > 0 else None
+        self._sessions: Dict[str, _SessionSlot] = {}
+
+        self.in_flight = 0
+        self.queued = 0
+        self.session_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Média móvel (EWMA) da duração de uma execução, para o Retry-After
+        self._avg_seconds = 1.0
+
+    def _retry_after(self, waiting: int, slots: int) -> int:
+        return max(1, math.ceil(self._avg_seconds * (waiting + 1) / max(1, slots)))
+
+    def _reject(self, status_code: int, reason: str, retry_after: int, detail: str):
+        self.rejected += 1
+        ADMISSION_REJECTED.inc(reason)
+        raise AdmissionRejected(status_code, reason, retry_after, detail)
+
+    def _leave_session(self, thread_id: str, slot: _SessionSlot):
+        slot.users -= 1
+        if slot.users == 0 and self._sessions.get(thread_id) is slot:
+            del self._sessions[thread_id]
+
+    async def _enter_session(self, thread_id: str) -> _SessionSlot:
+        slot = self._sessions.get(thread_id)
+        if slot is None:
+            slot = self._sessions[thread_id] = _SessionSlot()
+        if slot.users > self.max_session_queue:
+            self._reject(429, "session_queue_full", self._retry_after(slot.users, 1),
+                         f"Session '{thread_id}' already has {slot.users} executions pending.")
+        slot.users += 1
+        if not slot.lock.locked():
+            await slot.lock.acquire()
+            return slot
+
+        self.session_waiting += 1
+        inicio = time.perf_counter()
+        try:
+            await asyncio.wait_for(slot.lock.acquire(), self.session_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - inicio, "session", "rejected")
+            self._leave_session(thread_id, slot)
+            self._reject(429, "session_timeout", self._retry_after(slot.users, 1),
+                         f"Session '{thread_id}' is busy with a previous execution.")
+        except BaseException:
+            self._leave_session(thread_id, slot)
+            raise
+        finally:
+            self.session_waiting -= 1
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - inicio, "session", "admitted")
+        return slot
+
+    async def _enter_global(self):
+        semaphore = self._semaphore
+        if semaphore is None:
+            return
+        if not semaphore.locked():
+            await semaphore.acquire()
+            return
+        if self.queued >= self.max_queue:
+            self._reject(503, "queue_full", self._retry_after(self.queued, self.max_in_flight),
+                         "Server is at capacity, try again later.")
+
+        self.queued += 1
+        inicio = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - inicio, "global", "rejected")
+            self._reject(503, "queue_timeout", self._retry_after(self.queued, self.max_in_flight),
+                         "Server is at capacity, try again later.")
+        finally:
+            self.queued -= 1
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - inicio, "global", "admitted")
+
+    async def acquire(self, thread_id: str) -> AdmissionTicket:
+        """Espera a vez da sessão e uma vaga global; levanta `AdmissionRejected` se não der."""
+        slot = await self._enter_session(thread_id)
+        try:
+            await self._enter_global()
+        except BaseException:
+            slot.lock.release()
+            self._leave_session(thread_id, slot)
+            raise
+        self.in_flight += 1
+        self.admitted += 1
+        return AdmissionTicket(self, thread_id, slot)
+
+    def _release(self, thread_id: str, slot: _SessionSlot, elapsed: float):
+        self._avg_seconds += 0.1 * (elapsed - self._avg_seconds)
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+        slot.lock.release()
+        self._leave_session(thread_id, slot)
+
+    @asynccontextmanager
+    async def admit(self, thread_id: str):
+        ticket = await self.acquire(thread_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "session_waiting": self.session_waiting,
+            "sessions": len(self._sessions),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_execution_s": self._avg_seconds,
+        }
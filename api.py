@@ -1,50 +1,241 @@
+import asyncio
 import json
 import os
 import time
-import aiofiles
-from contextlib import asynccontextmanager
-from async_lru import alru_cache # Versão async do lru_cache
+# Início do carregamento do processo, para o relatório de startup
+_PROCESS_STARTED = time.perf_counter()
+from contextlib import asynccontextmanager, nullcontext
 from typing import Dict, Any, List, Optional
-from fastapi import FastAPI, HTTPException, Header, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Header, Body, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 import httpx
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
-from py_expression_eval import Parser
 from engine import FlowEngine
+from graph_cache import CompiledGraphCache
+from flow_registry import FlowRegistry, FlowNotFound, FlowDefinitionError
+from checkpointers import BoundedMemorySaver, CompactSerializer, SqliteSaver, checkpoint_batch, checkpointer_stats
+from http_cache import http_cache_stats
+from llm_cache import LLMResultCache
+from layered_context import delta_updates
+from resilience import DeadlineExceeded, UpstreamRegistry
+from admission import AdmissionController, AdmissionRejected
+from batch import DEFAULT_BATCH_CONCURRENCY, BatchItemError, ItemRunner, iter_lines, run_batch
+from node_registry import REGISTRY as node_executors, LazyResources, peak_rss_mb, register_plugins
+import telemetry
+from telemetry import logger, REQUEST_SECONDS
 # from storage import InMemoryStore
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import Command
 
 # Load environment variables
 load_dotenv()
+telemetry.configure_logging()
+# Tipos de nó de plugins (FLOW_NODE_PLUGINS), registrados antes de qualquer fluxo ser validado
+register_plugins()
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+def _create_checkpointer():
+    """
+    Escolhe o checkpointer via FLOW_CHECKPOINTER:
+    - "memory" (padrão): BoundedMemorySaver, com TTL por sessão e teto de sessões, para
+      que sessões abandonadas (a maioria do tráfego de chat) não acumulem memória para sempre.
+    - "sqlite": SqliteSaver em FLOW_SQLITE_PATH; sessões sobrevivem a restarts e podem ser
+      retomadas por qualquer worker que use o mesmo arquivo.
+    Os dois gravam com o `checkpoint_serde` (msgpack + zlib acima de
+    FLOW_CHECKPOINT_COMPRESS_BYTES; 0 desliga a compressão).
+    FLOW_CHECKPOINT_KEEP_LATEST=true guarda só o último checkpoint de cada sessão (menos
+    memória/disco, mas sem `get_state_history` nem time travel); desligado por padrão.
+    """
+    ttl = float(os.getenv("FLOW_SESSION_TTL_SECONDS", "3600"))
+    keep_latest = _env_flag("FLOW_CHECKPOINT_KEEP_LATEST", "false")
+    if os.getenv("FLOW_CHECKPOINTER", "memory").lower() == "sqlite":
+        return SqliteSaver(
+            os.getenv("FLOW_SQLITE_PATH", "flow_checkpoints.db"),
+            pool_size=int(os.getenv("FLOW_SQLITE_POOL_SIZE", "4")),
+            keep_latest_only=keep_latest,
+            ttl_seconds=ttl,
+            serde=checkpoint_serde,
+        )
+    return BoundedMemorySaver(
+        ttl_seconds=ttl,
+        max_sessions=int(os.getenv("FLOW_MAX_SESSIONS", "10000")),
+        keep_latest_only=keep_latest,
+        serde=checkpoint_serde,
+    )
+
+checkpoint_serde = CompactSerializer(compress_threshold=int(os.getenv("FLOW_CHECKPOINT_COMPRESS_BYTES", "512")))
+memory = _create_checkpointer()
+# Grafos compilados por (fluxo, hash do conteúdo). Compilar o StateGraph é um
+# custo fixo alto; só o primeiro request de cada versão do fluxo paga por ele.
+graph_cache = CompiledGraphCache(maxsize=int(os.getenv("FLOW_GRAPH_CACHE_SIZE", "32")))
+
+def _create_llm_cache():
+    """
+    Cache de respostas do LLM (FLOW_LLM_CACHE, ligado por padrão). O modelo roda com
+    temperature=0, então prompts idênticos têm respostas intercambiáveis.
+    FLOW_LLM_CACHE_PATH habilita o nível em disco (SQLite), compartilhado entre workers.
+    """
+    if not _env_flag("FLOW_LLM_CACHE", "true"):
+        return None
+    return LLMResultCache(
+        max_entries=int(os.getenv("FLOW_LLM_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("FLOW_LLM_CACHE_TTL_SECONDS", "0")) or None,
+        disk_path=os.getenv("FLOW_LLM_CACHE_PATH") or None,
+        normalize=_env_flag("FLOW_LLM_CACHE_NORMALIZE", "true"),
+    )
+
+llm_cache = _create_llm_cache()
+
+def _create_upstreams():
+    """
+    Proteções por upstream (resilience.py), compartilhadas por todos os fluxos.
+    FLOW_UPSTREAMS é um JSON opcional: {"default": {...}, "<host ou llm:<Classe>:<modelo>>": {...}},
+    com os parâmetros de `UpstreamPolicy` (ex: max_concurrency, retries, max_timeout).
+    """
+    config = json.loads(os.getenv("FLOW_UPSTREAMS") or "{}")
+    default = config.pop("default", None)
+    return UpstreamRegistry(default=default, overrides=config)
+
+upstreams = _create_upstreams()
+
+# Uma execução por sessão de cada vez e no máximo FLOW_MAX_IN_FLIGHT no processo (0 desliga
+# o limite global); o excedente espera em fila e, quando ela enche, recebe 429/503 + Retry-After
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("FLOW_MAX_IN_FLIGHT", "64")),
+    max_queue=int(os.getenv("FLOW_MAX_QUEUE", "256")),
+    queue_timeout=float(os.getenv("FLOW_QUEUE_TIMEOUT_SECONDS", "10")),
+    max_session_queue=int(os.getenv("FLOW_SESSION_QUEUE", "4")),
+    session_timeout=float(os.getenv("FLOW_SESSION_WAIT_SECONDS", "30")),
+)
+
+def _admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+# Folga além do deadline antes de cancelar a execução à força (os nós já param sozinhos
+# no deadline; isto cobre o que não coopera, ex: espera por uma ação especulada)
+DEADLINE_GRACE_SECONDS = float(os.getenv("FLOW_DEADLINE_GRACE_SECONDS", "1"))
+
+def _http_limits() -> httpx.Limits:
+    """Limites do pool de conexões (FLOW_HTTP_*), usados pelo cliente dos nós api e pelo do LLM."""
+    return httpx.Limits(
+        max_connections=int(os.getenv("FLOW_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("FLOW_HTTP_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("FLOW_HTTP_KEEPALIVE_EXPIRY", "30")),
+    )
+
+def _create_cassette():
+    """
+    Record/replay das chamadas dos nós api e llm (cassette.py), para testes de carga sem rede.
+    FLOW_CASSETTE_MODE: "off" (padrão), "record" ou "replay"; FLOW_CASSETTE_PATH: arquivo
+    (`.gz` comprime); FLOW_CASSETTE_LATENCY: no replay, fator sobre as latências gravadas
+    (0 = responde na hora, 1 = como gravado).
+    """
+    mode = os.getenv("FLOW_CASSETTE_MODE", "off").lower()
+    if mode in ("", "off", "0", "false"):
+        return None
+    from cassette import Cassette
+    return Cassette(
+        os.getenv("FLOW_CASSETTE_PATH", "flow_cassette.jsonl"),
+        mode,
+        latency=float(os.getenv("FLOW_CASSETTE_LATENCY", "0")),
+    )
+
+@asynccontextmanager
+async def _http_client_resource():
+    """Cliente dos nós api (pool de conexões compartilhado por todos os fluxos)."""
+    if cassette is None:
+        client = httpx.AsyncClient(limits=_http_limits())
+    else:
+        # No record o transporte real fica por baixo (com os limites do pool); no replay nada sai
+        inner = None if cassette.replaying else httpx.AsyncHTTPTransport(limits=_http_limits())
+        client = httpx.AsyncClient(transport=cassette.transport(inner))
+    async with client:
+        yield client
+
+@asynccontextmanager
+async def _llm_resource():
+    """Modelo dos nós llm; langchain_openai só é importado aqui."""
+    from langchain_openai import ChatOpenAI
+
+    # Retries e timeouts do LLM ficam com o `upstreams` (bulkhead + circuit breaker);
+    # o SDK não repete por conta própria, senão um brown-out multiplicaria as chamadas
+    async with httpx.AsyncClient(limits=_http_limits()) as llm_http_client:
+        # No replay o modelo nunca é chamado: a chave só é exigida pelo construtor
+        api_key = "replay" if cassette is not None and cassette.replaying and not os.getenv("OPENAI_API_KEY") else None
+        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, max_retries=0,
+                         http_async_client=llm_http_client, api_key=api_key)
+        yield cassette.chat_model(llm) if cassette is not None else llm
+
+# Recursos dos executores de nó (node_registry), criados quando o primeiro fluxo que
+# precisa deles é compilado: um worker sem nós llm não importa nem cria o cliente da OpenAI
+resources = LazyResources()
+resources.register("http_client", _http_client_resource)
+resources.register("llm", _llm_resource)
+
+async def _preload_flows():
+    """
+    Carrega (e compila) os fluxos de FLOW_PRELOAD ("a,b") no boot, em vez de no primeiro
+    request: executores e recursos que eles usam entram no relatório de startup.
+    """
+    for name in filter(None, (part.strip() for part in os.getenv("FLOW_PRELOAD", "").split(","))):
+        try:
+            await flow_registry.get(name)
+        except (FlowNotFound, FlowDefinitionError) as e:
+            logger.error("FLOW_PRELOAD: fluxo '%s' não carregado: %s", name, e)
+
+def _startup_stats() -> Dict[str, Any]:
+    return {
+        "startup_ms": round((time.perf_counter() - _PROCESS_STARTED) * 1000, 1),
+        "max_rss_mb": round(peak_rss_mb(), 1),
+        "executors": node_executors.stats(),
+        "resources": resources.stats(),
+    }
 
-memory = MemorySaver()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- INICIALIZAÇÃO (Roda 1 vez no boot) ---
-    global global_llm, global_http_client, global_parser
+    global cassette, startup_report
     
-    print("Criando recursos compartilhados...")
-    global_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    global_http_client = httpx.AsyncClient() # Cria o pool de conexão
-    global_parser = Parser()
+    cassette = _create_cassette()
+    if cassette is not None:
+        await asyncio.to_thread(cassette.load)
+        logger.info("Cassete em modo %s: %s", cassette.mode, cassette.path)
     # global memory = MemorySaver()
+    # Spans em JSON lines, se FLOW_TRACE_FILE estiver definido
+    telemetry.configure_tracing()
+    # Recarga a quente das definições de fluxo
+    flow_registry.start()
+    await _preload_flows()
+    startup_report = _startup_stats()
+    logger.info("Startup em %.0f ms (RSS máx. %.0f MB); executores: %s; recursos: %s",
+                startup_report["startup_ms"], startup_report["max_rss_mb"],
+                startup_report["executors"]["import_ms"] or "nenhum",
+                startup_report["resources"]["init_ms"] or "nenhum")
     
     yield # A aplicação roda aqui
     
     # --- LIMPEZA (Roda ao desligar) ---
-    print("Fechando recursos...")
-    await global_http_client.aclose()
+    logger.info("Fechando recursos...")
+    await flow_registry.stop()
+    await resources.aclose()
+    if cassette is not None:
+        await asyncio.to_thread(cassette.save)
+    telemetry.configure_tracing("")
+    if hasattr(memory, "close"):
+        memory.close()
+    if llm_cache is not None:
+        llm_cache.close()
 
 app = FastAPI(title="Flow Execution API", lifespan=lifespan)
 # store = InMemoryStore() 
 
 # Variáveis globais ou Estado da Aplicação
-global_llm = None
-global_http_client = None
-global_parser = None
+cassette = None
+startup_report = None
 class Message(BaseModel):
     type: str
     content: Dict[str, Any]
@@ -53,116 +244,139 @@ class Message(BaseModel):
 class FlowExecutionRequest(BaseModel):
     messages: Optional[List[Message]] = {}
 
-# CONFIGURAÇÃO DO CACHE
-# maxsize=32: Guarda os últimos 32 arquivos na memória.
-# ttl=60: (Opcional no async-lru) Se quiser que o cache expire a cada 60s para pegar atualizações.
-@alru_cache(maxsize=32)
-async def get_flow_definition(flow_name_input: str):
-    # 1. Normalização do nome
-    filename = flow_name_input if flow_name_input.endswith(".json") else f"{flow_name_input}.json"
-    
-    # 2. Estratégia EAFP (Tenta abrir direto, trata erro se falhar)
+async def _build_flow_graph(flow_name: str, flow_config: dict, subflows=None):
+    """Compila uma versão do fluxo (chamado pelo registro só no miss do graph_cache)."""
+    # O grafo não carrega dados da requisição: o x_user_id vai no config (thread_id),
+    # então o mesmo objeto atende todos os usuários do fluxo.
+    engine = FlowEngine(
+        flow_config=flow_config, 
+        # store=store,
+        memory=memory,
+        # llm e http_client vêm do `resources`, só se o fluxo tiver nós que usam
+        resources=resources,
+        llm_cache=llm_cache,
+        flow_name=flow_name,
+        upstreams=upstreams,
+        subflows=subflows,
+    )
+    flow_app = await engine.build_graph()
+    # Defensive checks: assegura que build_graph retornou um objeto utilizável
+    if flow_app is None:
+        raise ValueError("Flow engine returned None when building the graph.")
+    if not hasattr(flow_app, "astream") or not callable(getattr(flow_app, "astream")):
+        raise ValueError("Built flow app does not expose an async 'astream' method.")
+    return flow_app
+
+# Definições de fluxo do diretório FLOW_DIR, recarregadas a quente (polling a cada
+# FLOW_RELOAD_INTERVAL_SECONDS; 0 desliga). Guarda FLOW_KEEP_VERSIONS versões por fluxo
+# para as sessões pausadas retomarem na versão em que começaram.
+flow_registry = FlowRegistry(
+    os.getenv("FLOW_DIR", "."),
+    graph_cache,
+    _build_flow_graph,
+    poll_interval=float(os.getenv("FLOW_RELOAD_INTERVAL_SECONDS", "2")),
+    keep_versions=int(os.getenv("FLOW_KEEP_VERSIONS", "5")),
+)
+
+# Canal das escritas pendentes de um `interrupt()` no checkpoint do LangGraph
+INTERRUPT_CHANNEL = "__interrupt__"
+
+async def _session_pin(config: dict):
+    """
+    (versão fixada, esperando o usuário) da sessão, lidos do último checkpoint dela e
+    não do snapshot de um grafo: se a versão atual renomeou ou removeu o nó em que a
+    sessão parou, o grafo atual não enxerga nada pendente.
+    """
+    checkpoint = await memory.aget_tuple(config)
+    if checkpoint is None:
+        return None, False
+    pinned = checkpoint.checkpoint.get("channel_values", {}).get("flow_version")
+    waiting = any(write[1] == INTERRUPT_CHANNEL for write in checkpoint.pending_writes or ())
+    return pinned, waiting
+
+async def _load_flow_app(flow_name: str, config: dict):
+    """
+    Resolve a versão do fluxo para a sessão do config e devolve (versão, grafo, snapshot).
+    Sessão pausada (num interrupt ou no deadline) usa a versão em que começou, mesmo que o
+    arquivo tenha sido alterado ou removido depois; as demais usam a versão atual.
+    """
     try:
-        # Leitura não bloqueante (libera a CPU para outras requests enquanto lê o disco)
-        async with aiofiles.open(filename, mode='r') as f:
-            content = await f.read()
-            # O parse do JSON ainda é CPU-bound, mas para arquivos < 1MB é irrelevante
-            return json.loads(content)
-            
-    except FileNotFoundError:
-        # Cacheia o erro? Depende. Aqui optei por lançar direto, 
-        # mas cuidado: se o arquivo for criado depois, o cache pode lembrar que "não existe".
-        # Para evitar cachear erros, limpamos o cache dessa entrada específica (avançado).
-        raise HTTPException(status_code=404, detail=f"Flow definition '{filename}' not found.")
-        
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail=f"Invalid JSON format in '{filename}'.")
-        
+        pinned, waiting = await _session_pin(config)
+        previous = flow_registry.version(flow_name, pinned) if pinned else None
+        if previous is not None:
+            flow_app = await flow_registry.compiled(previous)
+            snapshot = await flow_app.aget_state(config)
+            if snapshot.next:
+                return previous, flow_app, snapshot
+        # Sessão nova ou terminada: só aqui um fluxo removido vira 404
+        version = await flow_registry.get(flow_name)
+        if version is not previous:
+            if pinned and previous is None and waiting:
+                # Versão já descartada do histórico (ou de antes de um restart): segue na atual
+                logger.warning("Versão %s do fluxo '%s' não está mais disponível; retomando na atual",
+                               pinned[:12], version.name)
+            flow_app = await flow_registry.compiled(version)
+            snapshot = await flow_app.aget_state(config)
+    except FlowNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FlowDefinitionError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+    return version, flow_app, snapshot
 
-
-@app.post("/execute/{flow_name}")
-async def execute_flow(
-    flow_name: str,
-    request: FlowExecutionRequest,
-    x_user_id: str = Header(..., description="Unique User ID for context isolation")
-):
+def _execution_deadline(started: float, version, x_deadline_ms: Optional[int]) -> Optional[float]:
     """
-    Executes a flow defined in a JSON file.
-    
-    - **flow_name**: The name of the flow file (e.g., flow_definition.json)
-    - **inputs**: Optional dictionary of inputs to pass to the flow (mapped by node ID)
-    - **x-user-id**: Header to identify the user/session
+    Deadline (`time.monotonic()`) da requisição: o menor entre `X-Deadline-Ms` e o
+    `deadline_ms` do fluxo, contado a partir da chegada da requisição. None = sem limite.
     """
-    config = {"configurable": {"thread_id": x_user_id}}
-    
-    # --- No seu endpoint/bloco principal ---
-    inicio = time.perf_counter()
+    budgets = [ms for ms in (x_deadline_ms, version.config.get("deadline_ms")) if ms]
+    return started + min(budgets) / 1000 if budgets else None
 
-    # Na primeira vez: lê do disco (lento). 
-    # Nas próximas: lê da RAM (instantâneo, < 0.00001s).
-    flow_config = await get_flow_definition(flow_name) 
+def _deadline_guard(deadline: Optional[float]):
+    """Cancela a execução à força se ela passar do deadline + folga."""
+    if deadline is None:
+        return nullcontext()
+    return asyncio.timeout_at(deadline + DEADLINE_GRACE_SECONDS)
 
-    fim = time.perf_counter()
+def _stopped_early(snapshot) -> bool:
+    """
+    Sessão parada no deadline: há nó pendente (`next`) mas nenhum interrupt esperando o
+    usuário. O checkpoint fica como está (sem `aupdate_state`): um checkpoint novo mudaria
+    o id da tarefa pendente e um subflow parado no meio recomeçaria do início.
+    """
+    return bool(snapshot.next) and not any(task.interrupts for task in snapshot.tasks)
 
-    tempo_execucao = fim - inicio
-    print(f"O código levou {tempo_execucao:.5f} segundos para carregar json.")
-    
-    # 2. Initialize Engine with Context Isolation (using User ID)
-    # Note: In a real persistent store, we would use x_user_id to fetch/save state.
-    # For InMemoryStore, we create a fresh instance per request or could map it.
-    # Given the requirement "separate context of concurrent calls", a fresh store per request 
-    # or a store keyed by user_id is needed. Here we instantiate a fresh engine/store for the run.
-    
-    # Initialize Engine
-    inicio = time.perf_counter()
-    engine = FlowEngine(
-        flow_config=flow_config, 
-        user_id=x_user_id, 
-        # store=store,
-        memory=memory,
-        llm=global_llm,              # Já está pronto na memória
-        http_client=global_http_client, # Pool de conexão aberto
-        parser=global_parser
-    )
-    
-    fim = time.perf_counter()
-    tempo_execucao = fim - inicio
-    print(f"O código levou {tempo_execucao:.5f} segundos para inicializar o engine.")
-    
-    # 3. Build the Graph
-    try:
-        inicio = time.perf_counter()
-        flow_app = await engine.build_graph()
-        fim = time.perf_counter()
-        tempo_execucao = fim - inicio
-        print(f"O código levou {tempo_execucao:.5f} segundos para construir o grafo.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error building flow graph: {str(e)}")
-     
-    # Defensive checks: assegura que build_graph retornou um objeto utilizável
-    if flow_app is None:
-        raise HTTPException(status_code=500, detail="Flow engine returned None when building the graph.")
-    if not hasattr(flow_app, "astream") or not callable(getattr(flow_app, "astream")):
-        raise HTTPException(status_code=500, detail="Built flow app does not expose an async 'astream' method.")
-    
+def _timed_out(error: BaseException, guard) -> bool:
+    """Se a exceção da execução veio do deadline (nó cooperativo ou cancelamento forçado)."""
+    if isinstance(error, DeadlineExceeded):
+        return True
+    return isinstance(error, TimeoutError) and getattr(guard, "expired", lambda: False)()
+
+def _prepare_input(version, snapshot, request: FlowExecutionRequest, x_user_id: str):
+    """Decide entre retomar a sessão pausada (Command resume) ou iniciar uma nova."""
     # 4. Prepare Initial State
-    snapshot = await flow_app.aget_state(config)
-    
     state = None
     initial_state = {
         "context": {
             "user_id": x_user_id # Inject user_id into context if needed by nodes
         },
-        "current_node": flow_config["nodes"][0]["id"]
+        "current_node": version.config["nodes"][0]["id"],
+        # Fixa a sessão nesta versão da definição até terminar
+        "flow_version": version.digest,
     }
     
-    if snapshot.next:
-        print(f"🔄 Retomando sessão {x_user_id}...")
-        # Criamos o comando de resume com a mensagem do usuário
-        state = Command(resume=request.messages)
+    if _stopped_early(snapshot):
+        # Execução anterior parou no deadline: continua do nó pendente (não há interrupt
+        # esperando resposta, então as mensagens desta requisição não são usadas)
+        logger.info("Continuando sessão %s após timeout", x_user_id)
+        state = None
+    elif snapshot.next:
+        logger.info("Retomando sessão %s", x_user_id)
+        # Criamos o comando de resume com a mensagem do usuário (dicts simples: entram no
+        # contexto e no checkpoint sem o envelope de classe do modelo pydantic)
+        state = Command(resume=[message.model_dump() for message in request.messages or []])
         # valor_resume = None
         # if request.messages and len(request.messages) > 0:
         #     # Assume que quer o texto da primeira mensagem enviada
@@ -182,99 +396,357 @@ async def execute_flow(
     
     # Cenário B: O workflow não existe ou já terminou
     else:
-        print(f"▶️ Iniciando nova sessão {x_user_id}...")
+        logger.info("Iniciando nova sessão %s", x_user_id)
         # Criamos o input inicial padrão
         state = initial_state
+    return state
+
+async def _final_payload(flow_app, config: dict, status: str, final_message):
+    """Resposta final da execução: `waiting_input` (parado num interrupt) ou o status do fluxo."""
+    snapshot_final = await flow_app.aget_state(config)
+    
+    if _stopped_early(snapshot_final):
+        # Parou no deadline, fora de um interrupt: o próximo POST continua de onde parou
+        return {
+            "status": "timed_out",
+            "message": "Execution deadline exceeded; send the request again to continue.",
+        }
+
+    if snapshot_final.next:
+        # Acessamos a informação do interrupt
+        # Geralmente é a primeira tarefa da lista
+        tarefa_atual = snapshot_final.tasks[0]
+        
+        # O valor passado dentro da função interrupt("Mensagem") está aqui:
+        mensagem_interrupt = tarefa_atual.interrupts[0].value
+        
+        return {
+            "status": "waiting_input",
+            "message": mensagem_interrupt,
+        }
+        
+    # CENÁRIO B: O grafo terminou todo o processo
+    else:
+        # A mensagem pode ter sido gravada numa chamada anterior da sessão (os passos só trazem deltas)
+        if final_message is None:
+            final_message = ((snapshot_final.values or {}).get("context") or {}).get("final_message")
+        # Aqui você pega o resultado final do state, se houver
+        # resposta_api["status_workflow"] = "finalizado"
+        # Ex: resposta_api["resultado"] = snapshot_final.values.get("context")
+    
+        return {
+            "status": status,
+            "message": final_message,
+        }
+
+@app.post("/execute/{flow_name}")
+async def execute_flow(
+    flow_name: str,
+    request: FlowExecutionRequest,
+    x_user_id: str = Header(..., description="Unique User ID for context isolation"),
+    x_deadline_ms: Optional[int] = Header(None, gt=0, description="Time budget for this execution, in milliseconds"),
+):
+    """
+    Executes a flow defined in a JSON file.
+    
+    - **flow_name**: The name of the flow file (e.g., flow_definition.json)
+    - **inputs**: Optional dictionary of inputs to pass to the flow (mapped by node ID)
+    - **x-user-id**: Header to identify the user/session
+    - **x-deadline-ms**: Optional time budget; when it runs out the session stops at the last
+      finished node with status `timed_out`, and the next request continues from there
+    """
+    try:
+        payload = await _run_execution(flow_name, request, x_user_id, "execute", x_deadline_ms)
+    except AdmissionRejected as e:
+        raise _admission_error(e)
+    return JSONResponse(content=payload, media_type="application/json; charset=utf-8")
+
+async def _run_execution(flow_name: str, request: FlowExecutionRequest, x_user_id: str, endpoint: str,
+                         x_deadline_ms: Optional[int] = None) -> dict:
+    """Uma execução completa: admissão, `_execute`, span e métricas (usado pelo /execute e pelo lote)."""
+    started = time.monotonic()
+    inicio = time.perf_counter()
+    outcome = "error"
+    with telemetry.span("execute", x_user_id, flow=flow_name, endpoint=endpoint) as request_span:
+        try:
+            # Serializa com outras execuções da mesma sessão e respeita o limite global
+            async with admission.admit(x_user_id):
+                payload = await _execute(flow_name, request, x_user_id, request_span, started, x_deadline_ms)
+            outcome = payload["status"]
+        except AdmissionRejected:
+            outcome = "rejected"
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - inicio, flow_name, endpoint, outcome)
+            telemetry.flush_spans()
+    return payload
+
+async def _execute(flow_name: str, request: FlowExecutionRequest, x_user_id: str, request_span=None,
+                   started: Optional[float] = None, x_deadline_ms: Optional[int] = None) -> dict:
+    config = {"configurable": {"thread_id": x_user_id}}
+    version, flow_app, snapshot = await _load_flow_app(flow_name, config)
+    state = _prepare_input(version, snapshot, request, x_user_id)
+    # Orçamento de tempo repassado aos nós pelo config (limita timeouts de api/llm)
+    deadline = _execution_deadline(started or time.monotonic(), version, x_deadline_ms)
+    config["configurable"]["deadline"] = deadline
+    if request_span is not None:
+        request_span.set(resume=isinstance(state, Command), flow_version=version.digest[:12])
     # state = store.get_state(x_user_id) or initial_state
     # Ensure context dict exists and inject inputs into context
     # state.setdefault("context", {})
     # state["context"]["user_inputs"] = request.messages
     
     
-    print(f"[{x_user_id}] Starting flow '{flow_name}' with inputs: {request.messages}")
+    logger.debug("[%s] Starting flow '%s' with inputs: %s", x_user_id, flow_name, request.messages)
 
     # 5. Execute Flow
     try:
         # We use ainvoke to run until completion and get the final state
         # final_state = await flow_app.ainvoke(initial_state)
         status = "running"
-        final_context = {}
         final_message = None
 
-        async for output in flow_app.astream(state, config):
-            print(f"[{x_user_id}] Flow step output: {output}, flow app: {flow_app}")
-
-            # Normalize output shape. Some nodes emit: {"node_id": { ... }}
-            # while others may emit the inner dict directly.
-            inner = None
-            if isinstance(output, dict) and len(output) == 1:
-                key = next(iter(output))
-                val = output[key]
-                if isinstance(val, dict):
-                    inner = val
-                    inner["_node_id"] = key
-
-            if inner is None:
-                inner = output if isinstance(output, dict) else {}
-
-            # store.save_state(x_user_id, inner)
-            # Extract fields with fallbacks to previous values
-            status = inner.get("status", status)
-            final_context = inner.get("context", final_context)
-            final_message = final_context.get("final_message", final_message)
-
-            # Some flows put status inside the context dict (e.g., context['status'])
-            if isinstance(final_context, dict) and final_context.get("status"):
-                status = final_context.get("status", status)
-
-            # If the flow is waiting for input, return current state to caller
-            # if status == "waiting_input":
-            #     return JSONResponse(
-            #         content={
-            #             "status": status,
-            #             "message": final_message,
-            #         },
-            #         media_type="application/json; charset=utf-8"
-            #     )
-    
+        # Agrupa os checkpoints desta execução numa única escrita (no SqliteSaver)
+        guard = _deadline_guard(deadline)
+        try:
+            async with checkpoint_batch(memory, x_user_id), guard:
+                async for output in flow_app.astream(state, config):
+                    logger.debug("[%s] Flow step output: %s", x_user_id, output)
+
+                    # Normalize output shape. Some nodes emit: {"node_id": { ... }}
+                    # while others may emit the inner dict directly.
+                    inner = None
+                    if isinstance(output, dict) and len(output) == 1:
+                        key = next(iter(output))
+                        val = output[key]
+                        if isinstance(val, dict):
+                            inner = val
+                            inner["_node_id"] = key
+
+                    if inner is None:
+                        inner = output if isinstance(output, dict) else {}
+
+                    # store.save_state(x_user_id, inner)
+                    # Extract fields with fallbacks to previous values
+                    status = inner.get("status", status)
+                    # Os nós emitem só as chaves alteradas do contexto (delta)
+                    changed = delta_updates(inner.get("context"))
+                    final_message = changed.get("final_message", final_message)
+
+                    # Some flows put status inside the context dict (e.g., context['status'])
+                    if changed.get("status"):
+                        status = changed.get("status", status)
+
+                    # If the flow is waiting for input, return current state to caller
+                    # if status == "waiting_input":
+                    #     return JSONResponse(
+                    #         content={
+                    #             "status": status,
+                    #             "message": final_message,
+                    #         },
+                    #         media_type="application/json; charset=utf-8"
+                    #     )
+        except Exception as e:
+            if not _timed_out(e, guard):
+                raise
+            logger.warning("[%s] Deadline da execução esgotado", x_user_id)
+
         # Extract relevant results
-        
-        snapshot_final = await flow_app.aget_state(config)
-        
-        if snapshot_final.next:
-            # Acessamos a informação do interrupt
-            # Geralmente é a primeira tarefa da lista
-            tarefa_atual = snapshot_final.tasks[0]
-            
-            # O valor passado dentro da função interrupt("Mensagem") está aqui:
-            mensagem_interrupt = tarefa_atual.interrupts[0].value
-            
-            return JSONResponse(
-                content={
-                    "status": "waiting_input",
-                    "message": mensagem_interrupt,
-                },
-                media_type="application/json; charset=utf-8"
-            )
-            
-        # CENÁRIO B: O grafo terminou todo o processo
-        else:
-            # Aqui você pega o resultado final do state, se houver
-            # resposta_api["status_workflow"] = "finalizado"
-            # Ex: resposta_api["resultado"] = snapshot_final.values.get("context")
-        
-            return JSONResponse(
-                content={
-                    "status": status,
-                    "message": final_message,
-                },
-                media_type="application/json; charset=utf-8"
-            )
+        return await _final_payload(flow_app, config, status, final_message)
         
     except Exception as e:
-        print(f"[{x_user_id}] Error executing flow: {e}")
+        logger.exception("[%s] Error executing flow", x_user_id)
         raise HTTPException(status_code=500, detail=f"Error executing flow: {str(e)}")
 
+def _sse(event: str, data: dict) -> str:
+    """Formata um evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/execute/{flow_name}/stream")
+async def execute_flow_stream(
+    flow_name: str,
+    request: FlowExecutionRequest,
+    x_user_id: str = Header(..., description="Unique User ID for context isolation"),
+    x_deadline_ms: Optional[int] = Header(None, gt=0, description="Time budget for this execution, in milliseconds"),
+):
+    """
+    Same as `/execute/{flow_name}`, but answers with Server-Sent Events as the flow runs:
+
+    - **node**: emitted when each node finishes (`node`, `next`, `status`)
+    - **token**: LLM tokens from `llm` nodes, as they are generated
+    - **end**: the same final payload as `/execute` (`waiting_input` or `completed`)
+    - **error**: emitted instead of `end` if the execution fails
+    - **x-deadline-ms**: same as `/execute` (`end` carries status `timed_out`)
+    """
+    started = time.monotonic()
+    # stream_tokens faz o nó llm usar streaming em vez de ainvoke
+    config = {"configurable": {"thread_id": x_user_id, "stream_tokens": True}}
+    # A vaga é obtida antes do stream (a recusa ainda sai como 429/503) e liberada quando ele termina
+    try:
+        ticket = await admission.acquire(x_user_id)
+    except AdmissionRejected as e:
+        REQUEST_SECONDS.observe(0.0, flow_name, "stream", "rejected")
+        raise _admission_error(e)
+    try:
+        version, flow_app, snapshot = await _load_flow_app(flow_name, config)
+        state = _prepare_input(version, snapshot, request, x_user_id)
+    except BaseException:
+        ticket.release()
+        raise
+    deadline = _execution_deadline(started, version, x_deadline_ms)
+    config["configurable"]["deadline"] = deadline
+
+    async def events():
+        status = "running"
+        final_message = None
+        inicio = time.perf_counter()
+        outcome = "error"
+        # O span acompanha o gerador: as tasks do LangGraph criadas dentro dele herdam o contextvar
+        with telemetry.span("execute", x_user_id, flow=flow_name, endpoint="stream",
+                            resume=isinstance(state, Command), flow_version=version.digest[:12]):
+            try:
+                guard = _deadline_guard(deadline)
+                try:
+                    async with checkpoint_batch(memory, x_user_id), guard:
+                        async for mode, chunk in flow_app.astream(state, config, stream_mode=["updates", "custom"]):
+                            if mode == "custom":
+                                data = {k: v for k, v in chunk.items() if k != "event"}
+                                yield _sse(chunk.get("event", "custom"), data)
+                                continue
+
+                            for node_id, update in chunk.items():
+                                # O interrupt é reportado no evento final (waiting_input)
+                                if not isinstance(update, dict):
+                                    continue
+                                status = update.get("status", status)
+                                context = delta_updates(update.get("context"))
+                                final_message = context.get("final_message", final_message)
+                                if context.get("status"):
+                                    status = context["status"]
+                                yield _sse("node", {
+                                    "node": node_id,
+                                    "next": update.get("current_node"),
+                                    "status": update.get("status"),
+                                })
+                except Exception as e:
+                    if not _timed_out(e, guard):
+                        raise
+                    logger.warning("[%s] Deadline da execução esgotado", x_user_id)
+
+                payload = await _final_payload(flow_app, config, status, final_message)
+                outcome = payload["status"]
+                yield _sse("end", payload)
+            except Exception as e:
+                logger.exception("[%s] Error executing flow", x_user_id)
+                yield _sse("error", {"detail": f"Error executing flow: {str(e)}"})
+            finally:
+                ticket.release()
+                REQUEST_SECONDS.observe(time.perf_counter() - inicio, flow_name, "stream", outcome)
+        telemetry.flush_spans()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Sem cache e sem buffering em proxies (nginx), para os eventos saírem na hora
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Garante a liberação se o stream nem chegar a começar (release é idempotente)
+        background=BackgroundTask(ticket.release),
+    )
+
+def batch_item_runner(flow_name: str, deadline_ms: Optional[int] = None) -> ItemRunner:
+    """Executor de um item de lote (`batch.run_batch`): o mesmo caminho do /execute, com erros por item."""
+    async def run_item(user_id: str, messages: list, item: dict) -> dict:
+        item_deadline = item.get("deadline_ms", deadline_ms)
+        if item_deadline is not None and (isinstance(item_deadline, bool)
+                                          or not isinstance(item_deadline, (int, float)) or item_deadline <= 0):
+            raise BatchItemError("invalid", "'deadline_ms' must be a positive number.")
+        try:
+            request = FlowExecutionRequest(messages=messages)
+        except ValidationError as e:
+            raise BatchItemError("invalid", str(e))
+        try:
+            return await _run_execution(flow_name, request, user_id, "batch", item_deadline)
+        except AdmissionRejected as e:
+            raise BatchItemError("rejected", e.detail, retry_after=e.retry_after)
+        except HTTPException as e:
+            raise BatchItemError("error", str(e.detail), code=e.status_code)
+    return run_item
+
+@app.post("/execute/{flow_name}/batch")
+async def execute_flow_batch(
+    flow_name: str,
+    http_request: Request,
+    concurrency: int = Query(DEFAULT_BATCH_CONCURRENCY, ge=1, le=int(os.getenv("FLOW_BATCH_MAX_CONCURRENCY", "256")),
+                             description="Items executed at the same time"),
+    x_deadline_ms: Optional[int] = Header(None, gt=0, description="Time budget for each item, in milliseconds"),
+):
+    """
+    Runs many sessions of a flow in one call.
+
+    - **body**: JSON lines (`application/x-ndjson`), one `{"user_id": ..., "messages": [...]}` per line
+      (optional `deadline_ms` per item). Items of the same `user_id` run in input order.
+    - **response**: JSON lines, one result per item in completion order: `index`, `user_id`,
+      `status` (as in `/execute`, or `invalid`/`error`/`rejected`), `message` or `error`, `elapsed_ms`
+    """
+    # Fluxo inexistente ou inválido falha antes de começar o lote
+    try:
+        await flow_registry.get(flow_name)
+    except FlowNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FlowDefinitionError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # O corpo é lido antes de a resposta começar: com a resposta em andamento o Starlette
+    # (ASGI < 2.4) consome `receive()` para detectar desconexão e o corpo nunca chegaria.
+    # A saída continua em streaming, um resultado por vez.
+    body = await http_request.body()
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8 JSON lines.")
+
+    async def results():
+        items = run_batch(iter_lines([text]), batch_item_runner(flow_name, x_deadline_ms), concurrency)
+        async for result in items:
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def _node_stats() -> Dict[str, Any]:
+    executors, created = node_executors.stats(), resources.stats()
+    return {
+        "executors_registered": executors["registered"],
+        "executors_loaded": executors["loaded"],
+        "executor_import_ms": executors["import_ms"],
+        "resources_created": created["created"],
+        "resource_init_ms": created["init_ms"],
+        "startup": startup_report,
+    }
+
+@app.get("/stats")
+async def get_stats():
+    """Contadores internos do processo (caches e checkpointer)."""
+    return {
+        "graph_cache": graph_cache.stats(),
+        "flow_registry": flow_registry.stats(),
+        "checkpointer": await checkpointer_stats(memory),
+        "checkpoint_serde": checkpoint_serde.stats(),
+        "http_cache": http_cache_stats(),
+        "llm_cache": llm_cache.stats() if llm_cache is not None else None,
+        "upstreams": upstreams.stats(),
+        "admission": admission.stats(),
+        "cassette": cassette.stats() if cassette is not None else None,
+        "nodes": _node_stats(),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas no formato texto do Prometheus: latência por fase de cada nó, status HTTP, chamadas de LLM e os contadores do /stats."""
+    return PlainTextResponse(
+        telemetry.render_metrics(await get_stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple, Union
+
+# Execução em lote de muitas sessões (endpoint `/execute/{flow}/batch` e `main.py`).
+#
+# Entrada: JSON lines, um item por linha: {"user_id": "...", "messages": [...]}
+# (opcional: "deadline_ms"). Saída: um resultado por item, na ordem em que terminam:
+# {"index", "user_id", "status", "message", "elapsed_ms"} ou, em caso de falha,
+# "status": "invalid" | "error" | "rejected" com "error".
+#
+# Os itens são decodificados conforme as execuções avançam (fila limitada) e os resultados
+# saem assim que prontos, então milhares de linhas não viram milhares de tarefas de uma vez.
+# No CLI a entrada é lida do arquivo sob demanda; no endpoint o corpo (texto) é lido antes.
+
+DEFAULT_BATCH_CONCURRENCY = 16
+
+# run_item(user_id, messages, item) -> payload do /execute ({"status", "message"})
+ItemRunner = Callable[[str, List[Any], Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+async def _aiter(chunks: Union[AsyncIterable, Iterable]) -> AsyncIterator:
+    if isinstance(chunks, AsyncIterable):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+async def iter_lines(chunks: Union[AsyncIterable[Union[bytes, str]], Iterable[Union[bytes, str]]]) -> AsyncIterator[str]:
+    """Junta pedaços de bytes/texto (ex: resposta em streaming ou corpo já lido) em linhas."""
+    buffer = ""
+    async for chunk in _aiter(chunks):
+        buffer += chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class BatchItemError(Exception):
+    """Falha de um item com status próprio (ex: `rejected` pela admissão)."""
+
+    def __init__(self, status: str, error: str, **extra: Any):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.extra = extra
+
+
+def _parse(index: int, line: str) -> Union[Dict[str, Any], Tuple[str, List[Any], Dict[str, Any]]]:
+    """(user_id, messages, item) de uma linha, ou o resultado `invalid` do item."""
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"index": index, "status": "invalid", "error": f"Invalid JSON: {e}"}
+    user_id = item.get("user_id") if isinstance(item, dict) else None
+    if not isinstance(user_id, str) or not user_id:
+        return {"index": index, "status": "invalid", "error": "Each item needs a non-empty 'user_id'."}
+    messages = item.get("messages") or []
+    if not isinstance(messages, list):
+        return {"index": index, "user_id": user_id, "status": "invalid", "error": "'messages' must be a list."}
+    return user_id, messages, item
+
+
+async def _run_one(index: int, user_id: str, messages: List[Any], item: Dict[str, Any],
+                   run_item: ItemRunner) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    try:
+        payload = await run_item(user_id, messages, item)
+        result = {"index": index, "user_id": user_id, **payload}
+    except BatchItemError as e:
+        result = {"index": index, "user_id": user_id, "status": e.status, "error": e.error, **e.extra}
+    except Exception as e:
+        result = {"index": index, "user_id": user_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    result["elapsed_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return result
+
+
+async def run_batch(lines: AsyncIterable[str], run_item: ItemRunner,
+                    concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Executa os itens com no máximo `concurrency` simultâneos e devolve os resultados
+    na ordem de conclusão. Itens do mesmo `user_id` rodam um depois do outro, na ordem
+    da entrada: o próximo só chega à admissão quando o anterior termina, então a fila da
+    sessão não recusa itens do próprio lote. Se o consumidor parar (cliente desconectou),
+    os itens em andamento são cancelados.
+    """
+    concurrency = max(1, int(concurrency))
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    done = object()
+    # user_id -> término do último item da sessão já enfileirado
+    tails: Dict[str, asyncio.Future] = {}
+
+    async def feed():
+        index = 0
+        try:
+            async for line in lines:
+                if not line.strip():
+                    continue
+                # A ordem por sessão é decidida aqui, que lê a entrada em sequência
+                parsed = _parse(index, line)
+                previous = turn = None
+                if not isinstance(parsed, dict):
+                    previous = tails.get(parsed[0])
+                    turn = tails[parsed[0]] = asyncio.get_running_loop().create_future()
+                await pending.put((index, parsed, previous, turn))
+                index += 1
+        except Exception as e:
+            # Entrada interrompida (ex: corpo truncado): o que já foi lido ainda roda
+            results.put_nowait({"index": None, "status": "error", "error": f"Input error: {e}"})
+        finally:
+            for _ in range(concurrency):
+                await pending.put(None)
+
+    async def run_entry(index, parsed, previous, turn):
+        if isinstance(parsed, dict):
+            return parsed
+        user_id, messages, item = parsed
+        try:
+            if previous is not None:
+                await previous
+            return await _run_one(index, user_id, messages, item, run_item)
+        finally:
+            turn.set_result(None)
+            if tails.get(user_id) is turn:
+                del tails[user_id]
+
+    async def worker():
+        try:
+            while True:
+                entry = await pending.get()
+                if entry is None:
+                    break
+                results.put_nowait(await run_entry(*entry))
+        finally:
+            results.put_nowait(done)
+
+    tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            result = await results.get()
+            if result is done:
+                running -= 1
+                continue
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
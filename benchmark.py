@@ -0,0 +1,426 @@
+"""
+Benchmarks do Flow Engine, sem rede externa nem chave da OpenAI.
+
+- Upstream HTTP: servidor stub local (asyncio) no lugar da pokeapi.co; o cliente
+  httpx compartilhado é redirecionado para ele, então o caminho de rede é real.
+- LLM: `BenchChatModel`, um chat model determinístico com latência configurável.
+- A API (`api.app`) roda no mesmo processo, via `httpx.ASGITransport`.
+
+Micro: `render_data` (string e nativo), `build_graph` e `_execute_node` por tipo de nó.
+Macro: sessões concorrentes em `flow_definition.json`, com ida e volta do interrupt
+(início -> waiting_input -> resume -> completed).
+
+A saída é JSON (p50/p95/p99 em ms, req/s, pico de RSS). Com `--compare base.json`
+o processo termina com código 1 se algum p95 piorar mais que `--tolerance`.
+
+    python benchmark.py --sessions 200 --concurrency 50 --output bench.json
+    python benchmark.py --compare bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+# FLOW_FILE e o registro de fluxos do api.py (FLOW_DIR, padrão ".") usam caminhos relativos
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FLOW_FILE = "flow_definition.json"
+# Nomes usados nas sessões: pesos acima e abaixo de 100 cobrem os dois ramos do if-else
+POKEMONS = {"pikachu": 60, "bulbasaur": 69, "snorlax": 4600, "onix": 2100, "eevee": 65, "lapras": 2200}
+
+
+# --- Métricas ---
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    """Percentil por posição mais próxima (lista já ordenada)."""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float], wall_time: Optional[float] = None) -> Dict[str, Any]:
+    """Resumo de latências (em segundos na entrada, ms na saída)."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    wall_time = wall_time if wall_time is not None else sum(ordered)
+    return {
+        "count": count,
+        "mean_ms": (sum(ordered) / count * 1000) if count else 0.0,
+        "min_ms": ordered[0] * 1000 if count else 0.0,
+        "p50_ms": _percentile(ordered, 50) * 1000,
+        "p95_ms": _percentile(ordered, 95) * 1000,
+        "p99_ms": _percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000 if count else 0.0,
+        "ops_per_s": (count / wall_time) if wall_time else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta em KB, macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextlib.contextmanager
+def quiet():
+    """stdout é do relatório JSON: qualquer print de dependências ou plugins vai para /dev/null."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# --- Dublês: upstream HTTP e LLM ---
+
+class StubUpstream:
+    """Servidor HTTP/1.1 mínimo (keep-alive) que imita `GET /api/v2/pokemon/{nome}`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self._server = None
+        self.base_url = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        self.base_url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0) or 0):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                path = request_line.split()[1].decode("latin-1")
+                name = path.rstrip("/").rsplit("/", 1)[-1].lower()
+                body = json.dumps({
+                    "id": int(hashlib.sha1(name.encode()).hexdigest()[:4], 16),
+                    "name": name,
+                    "weight": POKEMONS.get(name, 100),
+                    # Payload com algum volume, como a API real
+                    "moves": [{"move": {"name": f"move-{i}", "url": f"{self.base_url}/move/{i}"}} for i in range(50)],
+                }).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class RedirectTransport(httpx.AsyncBaseTransport):
+    """Reescreve esquema/host/porta de toda requisição para o stub, mantendo o path."""
+
+    def __init__(self, base_url: str):
+        target = urlsplit(base_url)
+        self._scheme, self._host, self._port = target.scheme, target.hostname, target.port
+        self._transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self._scheme, host=self._host, port=self._port)
+        request.headers["host"] = f"{self._host}:{self._port}"
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class BenchChatModel(BaseChatModel):
+    """Chat model determinístico: a resposta depende só do prompt; `latency` simula o modelo."""
+
+    latency: float = 0.0
+    temperature: float = 0.0
+    model_name: str = "bench-fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def _answer(self, messages) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"Resposta {digest}: um Pokémon tão pesado que a balança pediu férias."
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self._answer(messages).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            token = word if i == 0 else " " + word
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+# --- Microbenchmarks ---
+
+async def _timed(fn, iterations: int) -> Dict[str, Any]:
+    samples = []
+    inicio = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - inicio)
+
+
+def _context_for(node_id: str) -> dict:
+    """Contexto típico no momento em que cada nó do fluxo de exemplo executa."""
+    context = {
+        "user_id": "bench",
+        "initial": {"api_base": "https://pokeapi.co/api/v2/pokemon"},
+        "user_inputs": [{"type": "text", "content": {"text": "snorlax"}}],
+        "pokemon_id": "snorlax",
+    }
+    if node_id not in ("setup", "get_pokemon"):
+        context["poke_data"] = {"name": "snorlax", "weight": "4600"}
+    return context
+
+
+async def run_micro(args, http_client: httpx.AsyncClient, llm: BenchChatModel) -> Dict[str, Any]:
+    from langgraph.checkpoint.memory import InMemorySaver
+    from engine import FlowEngine
+    from templates import render_data
+
+    with open(FLOW_FILE) as f:
+        flow_config = json.load(f)
+
+    results: Dict[str, Any] = {}
+    template = {
+        "url": "{{ context.initial.api_base }}/{{ context.pokemon_id }}",
+        "poke_data": {"name": "{{ context.poke_data.name }}", "weight": "{{ context.poke_data.weight }}"},
+        "literal": "sem template",
+    }
+    context = _context_for("joke_node")
+    results["render_data"] = await _timed(lambda: render_data(template, context), args.iterations)
+    results["render_data_native"] = await _timed(lambda: render_data(template, context, native=True), args.iterations)
+
+    def new_engine():
+        return FlowEngine(flow_config, InMemorySaver(), llm, http_client)
+
+    async def build():
+        await new_engine().build_graph()
+    results["build_graph"] = await _timed(build, max(1, args.iterations // 10))
+
+    engine = new_engine()
+    config = {"configurable": {"thread_id": "bench"}}
+    for node in flow_config["nodes"]:
+        node_id, node_type = node["id"], node["type"]
+        # `output` depende do runtime do grafo (interrupt); é medido no macro
+        if node_type in ("output", "input") or f"execute_node.{node_type}" in results:
+            continue
+
+        def execute(node_id=node_id):
+            state = {"context": _context_for(node_id), "current_node": node_id, "status": "running"}
+            return engine._execute_node(state, config, node_id)
+        results[f"execute_node.{node_type}"] = await _timed(execute, args.iterations)
+
+    return results
+
+
+# --- Macrobenchmarks ---
+
+async def _post(client: httpx.AsyncClient, path: str, user: str, messages: list, samples: list) -> dict:
+    t0 = time.perf_counter()
+    response = await client.post(path, json={"messages": messages}, headers={"x-user-id": user})
+    samples.append(time.perf_counter() - t0)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} [{user}] -> {response.status_code}: {response.text[:200]}")
+    return response.json() if not path.endswith("/stream") else {"status": "streamed", "body": response.text}
+
+
+async def run_macro(args, api) -> Dict[str, Any]:
+    transport = httpx.ASGITransport(app=api.app)
+    names = list(POKEMONS)
+    path = f"/execute/{FLOW_FILE}"
+    starts, resumes, sessions, streams = [], [], [], []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+        # Aquecimento: lê o JSON do fluxo e compila o grafo fora da medição
+        await _post(client, path, "warmup", [], [])
+        await _post(client, path, "warmup", [{"type": "text", "content": {"text": "pikachu"}}], [])
+
+        async def session(i: int):
+            user = f"bench-{args.run_id}-{i}"
+            name = names[i % len(names)]
+            async with semaphore:
+                t0 = time.perf_counter()
+                try:
+                    first = await _post(client, path, user, [], starts)
+                    if first.get("status") != "waiting_input":
+                        raise RuntimeError(f"[{user}] esperado waiting_input, recebido {first.get('status')}")
+                    resume_path = f"{path}/stream" if args.stream and i % 2 else path
+                    await _post(client, resume_path, user, [{"type": "text", "content": {"text": name}}],
+                                streams if resume_path.endswith("/stream") else resumes)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+                    return
+                sessions.append(time.perf_counter() - t0)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(args.sessions)))
+        wall_time = time.perf_counter() - inicio
+        stats = (await client.get("/stats")).json()
+
+    total_requests = len(starts) + len(resumes) + len(streams)
+    result = {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "wall_time_s": wall_time,
+        "requests": total_requests,
+        "requests_per_s": (total_requests / wall_time) if wall_time else 0.0,
+        "sessions_per_s": (len(sessions) / wall_time) if wall_time else 0.0,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "start": summarize(starts, wall_time),
+        "resume": summarize(resumes, wall_time),
+        "session": summarize(sessions, wall_time),
+        "server_stats": stats,
+    }
+    if streams:
+        result["resume_stream"] = summarize(streams, wall_time)
+    return result
+
+
+# --- Comparação com uma execução anterior ---
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Lista as métricas cujo p95 piorou mais que `tolerance` (fração) em relação ao baseline."""
+    regressions = []
+
+    def walk(cur, base, prefix):
+        for key, value in cur.items():
+            if not isinstance(value, dict) or key not in base or not isinstance(base[key], dict):
+                continue
+            if "p95_ms" in value and "p95_ms" in base[key]:
+                before, after = base[key]["p95_ms"], value["p95_ms"]
+                if before > 0 and after > before * (1 + tolerance):
+                    regressions.append(f"{prefix}{key}: p95 {before:.3f}ms -> {after:.3f}ms (+{(after / before - 1) * 100:.0f}%)")
+            elif key != "server_stats":
+                walk(value, base[key], f"{prefix}{key}.")
+
+    walk(current, baseline, "")
+    return regressions
+
+
+async def main(args) -> Dict[str, Any]:
+    import api
+
+    upstream = await StubUpstream(latency=args.upstream_latency_ms / 1000).start()
+    llm = BenchChatModel(latency=args.llm_latency_ms / 1000)
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+    }
+    try:
+        # stdout fica reservado para o JSON do relatório
+        with quiet():
+            async with api.app.router.lifespan_context(api.app):
+                # Dublês no lugar dos recursos dos executores, antes do primeiro request
+                # (o grafo compilado guarda as referências; os reais nunca são criados)
+                async with httpx.AsyncClient(transport=RedirectTransport(upstream.base_url)) as http_client:
+                    api.resources.set("http_client", http_client)
+                    api.resources.set("llm", llm)
+
+                    if args.only in (None, "micro"):
+                        report["micro"] = await run_micro(args, http_client, llm)
+                        report["peak_rss_mb_after_micro"] = peak_rss_mb()
+                    if args.only in (None, "macro"):
+                        report["macro"] = await run_macro(args, api)
+    finally:
+        await upstream.stop()
+
+    report["upstream_requests"] = upstream.requests
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do Flow Engine (saída JSON).")
+    parser.add_argument("--only", choices=("micro", "macro"), help="Roda só um dos grupos.")
+    parser.add_argument("--iterations", type=int, default=500, help="Iterações por microbenchmark.")
+    parser.add_argument("--sessions", type=int, default=200, help="Sessões no macrobenchmark.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Sessões simultâneas.")
+    parser.add_argument("--stream", action="store_true", help="Metade dos resumes via /stream (SSE).")
+    parser.add_argument("--upstream-latency-ms", type=float, default=5.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--output", help="Arquivo para gravar o JSON (padrão: stdout).")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para detectar regressões.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Piora aceitável do p95 (fração).")
+    args = parser.parse_args(argv)
+    args.run_id = str(int(time.time() * 1000))
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        if regressions:
+            exit_code = 1
+            print("Regressões de p95:\n  " + "\n  ".join(regressions), file=sys.stderr)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(exit_code)
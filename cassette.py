@@ -0,0 +1,279 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from llm_cache import llm_identity
+from telemetry import logger
+
+# Gravação e reprodução (record/replay) das chamadas externas dos nós `api` e `llm`,
+# para testes de carga sem rede (api.py escolhe o modo no `lifespan`, via FLOW_CASSETTE_*).
+#
+# - record: as chamadas vão ao upstream de verdade; requisição, resposta e latência são
+#   guardadas num índice em memória e gravadas no arquivo (cassete) no shutdown.
+# - replay: nada sai do processo; as respostas vêm do índice, pela chave da requisição
+#   já renderizada. Uma requisição que não está na cassete falha (`CassetteMiss`).
+#
+# Nós api: `CassetteTransport` no lugar do transporte do `httpx.AsyncClient` (chave =
+# método + URL + hash do corpo; headers ficam de fora, ex: tokens que mudam).
+# Nós llm: `CassetteChatModel` em volta do modelo (chave = modelo/parâmetros + mensagens).
+#
+# Arquivo: JSON lines (gzip se terminar em `.gz`), uma linha por requisição distinta, com
+# até `max_samples` latências observadas. No replay, `latency` escala um sorteio dessas
+# latências (0 = sem espera, 1 = como gravado).
+
+# Headers que não fazem sentido numa resposta reproduzida (o corpo é guardado já decodificado)
+_DROPPED_HEADERS = frozenset({"content-encoding", "content-length", "transfer-encoding", "connection",
+                              "keep-alive", "date", "set-cookie"})
+# Pedaços emitidos no replay em streaming (palavra + espaços seguintes)
+_STREAM_PIECES = re.compile(r"\S+\s*|\s+")
+
+
+class CassetteMiss(LookupError):
+    """Requisição sem gravação na cassete (modo replay)."""
+
+
+class CassetteHttpMiss(httpx.TransportError):
+    """`CassetteMiss` de um nó api: o engine trata como erro de requisição (`result.error`)."""
+
+
+def _digest(*parts: Any) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Índice das chamadas gravadas, por chave da requisição renderizada."""
+
+    MODES = ("record", "replay")
+
+    def __init__(self, path: str, mode: str, latency: float = 0.0, max_samples: int = 50):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de cassete inválido '{mode}'; use: {', '.join(self.MODES)}.")
+        self.path = path
+        self.mode = mode
+        self.latency = max(0.0, float(latency))
+        self.max_samples = max(1, int(max_samples))
+        self._entries: Dict[str, dict] = {}
+        self._dirty = False
+
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _open(self, path: str, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(path, mode + "t", encoding="utf-8")
+        return open(path, mode, encoding="utf-8")
+
+    def load(self) -> "Cassette":
+        """Lê o arquivo, se existir (no record, as gravações novas se somam às antigas)."""
+        if not os.path.exists(self.path):
+            if self.replaying:
+                raise FileNotFoundError(f"Cassete '{self.path}' não encontrada.")
+            return self
+        with self._open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+        logger.info("Cassete '%s' carregada (%d gravações, modo %s)", self.path, len(self._entries), self.mode)
+        return self
+
+    def save(self):
+        """Grava o índice (arquivo temporário + rename, para não deixar a cassete pela metade)."""
+        if not self._dirty:
+            return
+        tmp = f"{self.path}.tmp"
+        with self._open(tmp, "w") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+        self._dirty = False
+        logger.info("Cassete '%s' gravada (%d gravações)", self.path, len(self._entries))
+
+    def lookup(self, key: str, description: str) -> dict:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            raise CassetteMiss(f"Sem gravação na cassete para {description}")
+        self.hits += 1
+        return entry
+
+    def record(self, key: str, entry: dict, latency: float):
+        # A resposta mais recente vale; as latências se acumulam
+        latencies = self._entries.get(key, {}).get("latencies", [])
+        self._entries[key] = {"key": key, **entry, "latencies": (latencies + [round(latency, 4)])[-self.max_samples:]}
+        self.recorded += 1
+        self._dirty = True
+
+    def delay(self, entry: dict) -> float:
+        """Latência a simular para uma gravação (sorteada entre as observadas)."""
+        if not self.latency or not entry.get("latencies"):
+            return 0.0
+        return random.choice(entry["latencies"]) * self.latency
+
+    def transport(self, inner: Optional[httpx.AsyncBaseTransport] = None) -> "CassetteTransport":
+        return CassetteTransport(self, inner)
+
+    def chat_model(self, llm: BaseChatModel) -> "CassetteChatModel":
+        return CassetteChatModel(
+            wrapped=llm, cassette=self,
+            model_name=getattr(llm, "model_name", None) or getattr(llm, "model", None) or "",
+            temperature=getattr(llm, "temperature", None),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+            "latency": self.latency,
+        }
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """Transporte do cliente dos nós api: grava (repassando a `inner`) ou reproduz."""
+
+    def __init__(self, cassette: Cassette, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.cassette = cassette
+        self.inner = inner
+
+    @staticmethod
+    def key(request: httpx.Request, body: bytes) -> str:
+        return _digest("http", request.method, str(request.url), hashlib.sha256(body).hexdigest())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = self.key(request, body)
+        if self.cassette.replaying:
+            try:
+                entry = self.cassette.lookup(key, f"{request.method} {request.url}")
+            except CassetteMiss as e:
+                raise CassetteHttpMiss(str(e), request=request)
+            delay = self.cassette.delay(entry)
+            if delay:
+                await asyncio.sleep(delay)
+            content = base64.b64decode(entry["b64"]) if "b64" in entry else entry.get("text", "").encode("utf-8")
+            return httpx.Response(entry["status"], headers=entry["headers"], content=content, request=request)
+
+        inicio = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            # Lido inteiro (e já descomprimido) para gravar; no record o streaming não importa
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        latency = time.perf_counter() - inicio
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _DROPPED_HEADERS]
+        entry = {"kind": "http", "method": request.method, "url": str(request.url),
+                 "status": response.status_code, "headers": headers}
+        try:
+            entry["text"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["b64"] = base64.b64encode(content).decode("ascii")
+        self.cassette.record(key, entry, latency)
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Modelo de chat dos nós llm em modo cassete. Mantém a identidade do modelo original
+    (cache de respostas e upstream continuam com as mesmas chaves).
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    wrapped: Any
+    cassette: Any
+    model_name: str = ""
+    temperature: Optional[float] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.wrapped._llm_type}"
+
+    def _get_llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        return self.wrapped._get_llm_string(stop=stop, **kwargs)
+
+    def _key(self, messages: List[BaseMessage]) -> str:
+        return _digest("llm", llm_identity(self.wrapped), [(m.type, m.content) for m in messages])
+
+    def _replay(self, messages: List[BaseMessage]):
+        key = self._key(messages)
+        return self.cassette.lookup(key, f"prompt '{str(messages[-1].content)[:60]}'")
+
+    def _record(self, messages: List[BaseMessage], completion: str, latency: float):
+        prompt = [{"type": m.type, "content": m.content} for m in messages]
+        self.cassette.record(self._key(messages), {"kind": "llm", "prompt": prompt, "completion": completion}, latency)
+
+    @staticmethod
+    def _result(completion: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=completion))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.cassette.replaying:
+            entry = self._replay(messages)
+            delay = self.cassette.delay(entry)
+            if delay:
+                await asyncio.sleep(delay)
+            return self._result(entry["completion"])
+        inicio = time.perf_counter()
+        message = await self.wrapped.ainvoke(messages, stop=stop, **kwargs)
+        self._record(messages, message.content, time.perf_counter() - inicio)
+        return self._result(message.content)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.cassette.replaying:
+            entry = self._replay(messages)
+            time.sleep(self.cassette.delay(entry))
+            return self._result(entry["completion"])
+        inicio = time.perf_counter()
+        message = self.wrapped.invoke(messages, stop=stop, **kwargs)
+        self._record(messages, message.content, time.perf_counter() - inicio)
+        return self._result(message.content)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if self.cassette.replaying:
+            entry = self._replay(messages)
+            # A latência gravada é a da resposta inteira: distribuída entre os pedaços
+            pieces = _STREAM_PIECES.findall(entry["completion"]) or [""]
+            delay = self.cassette.delay(entry) / len(pieces)
+            for piece in pieces:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            return
+        inicio = time.perf_counter()
+        chunks: List[str] = []
+        async for chunk in self.wrapped.astream(messages, stop=stop, **kwargs):
+            token = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+            chunks.append(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        self._record(messages, "".join(chunks), time.perf_counter() - inicio)
@@ -0,0 +1,766 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from telemetry import CHECKPOINT_BYTES
+
+
+class CompactSerializer:
+    """
+    Serializer dos checkpointers: o msgpack do LangGraph (`JsonPlusSerializer`) e, acima
+    de `compress_threshold` bytes, zlib por cima (tipo "msgpack+zlib"), só quando fica
+    menor. O contexto do fluxo é quase todo texto e chaves repetidas, então comprime bem.
+
+    Conta os bytes antes e depois da compressão (`stats()` e o histograma
+    `flow_checkpoint_bytes`). `compress_threshold=0` desliga a compressão.
+    """
+
+    SUFFIX = "+zlib"
+
+    def __init__(self, compress_threshold: int = 512, level: int = 1, inner=None):
+        self.inner = inner or JsonPlusSerializer()
+        self.compress_threshold = compress_threshold
+        self.level = level
+
+        self.values = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.max_bytes = 0
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.inner.dumps_typed(obj)
+        raw = len(data)
+        if self.compress_threshold and raw > self.compress_threshold:
+            packed = zlib.compress(data, self.level)
+            if len(packed) < raw:
+                type_, data = type_ + self.SUFFIX, packed
+                self.compressed += 1
+        self.values += 1
+        self.raw_bytes += raw
+        self.stored_bytes += len(data)
+        self.max_bytes = max(self.max_bytes, len(data))
+        CHECKPOINT_BYTES.observe(len(data), type_)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            type_, payload = type_[:-len(self.SUFFIX)], zlib.decompress(payload)
+        return self.inner.loads_typed((type_, payload))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "values": self.values,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "max_bytes": self.max_bytes,
+            "ratio": round(self.stored_bytes / self.raw_bytes, 3) if self.raw_bytes else None,
+        }
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    MemorySaver com limite de memória.
+
+    - `ttl_seconds`: sessões (thread_id) sem acesso há mais tempo que isso são removidas.
+    - `max_sessions`: teto de sessões vivas; acima dele a menos usada (LRU) sai.
+    - `keep_latest_only`: guarda só o último checkpoint de cada thread em vez do histórico
+      completo (o fluxo só precisa do último para retomar um `interrupt()`).
+
+    A contabilidade de bytes é aproximada: soma o tamanho serializado de checkpoints,
+    metadados, blobs de canais e writes pendentes.
+    """
+
+    def __init__(self, *, ttl_seconds: Optional[float] = None, max_sessions: Optional[int] = None,
+                 keep_latest_only: bool = False, serde=None):
+        super().__init__(serde=serde)
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.keep_latest_only = keep_latest_only
+
+        # thread_id -> último acesso (monotônico); a ordem do dict é a ordem LRU
+        self._sessions: "OrderedDict[str, float]" = OrderedDict()
+        # Índices por thread para remover sem varrer todos os blobs/writes do processo
+        self._blob_keys: Dict[str, set] = defaultdict(set)
+        self._write_keys: Dict[str, set] = defaultdict(set)
+        self._write_bytes: Dict[Tuple[str, str, str], int] = {}
+        self._bytes: Dict[str, int] = defaultdict(int)
+
+        self.evictions_ttl = 0
+        self.evictions_lru = 0
+        self.pruned_checkpoints = 0
+
+    # --- Controle de sessões ---
+
+    def _touch(self, thread_id: str):
+        self._sessions[thread_id] = time.monotonic()
+        self._sessions.move_to_end(thread_id)
+
+    def sweep(self) -> int:
+        """Remove sessões expiradas e excedentes. Retorna quantas foram removidas."""
+        removed = 0
+        if self.ttl_seconds is not None:
+            limit = time.monotonic() - self.ttl_seconds
+            while self._sessions:
+                thread_id, last_access = next(iter(self._sessions.items()))
+                if last_access > limit:
+                    break
+                self.delete_thread(thread_id)
+                self.evictions_ttl += 1
+                removed += 1
+        if self.max_sessions is not None:
+            while len(self._sessions) > self.max_sessions:
+                self.delete_thread(next(iter(self._sessions)))
+                self.evictions_lru += 1
+                removed += 1
+        return removed
+
+    # --- Leitura ---
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self.sweep()
+        thread_id = config["configurable"]["thread_id"]
+        # O InMemorySaver usa defaultdict: consultar uma thread inexistente criaria a entrada
+        if thread_id not in self.storage:
+            return None
+        self._touch(thread_id)
+        return super().get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs) -> Iterator[CheckpointTuple]:
+        if config and config["configurable"].get("thread_id") not in self.storage:
+            return iter(())
+        return super().list(config, **kwargs)
+
+    # --- Escrita ---
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+        for channel, version in new_versions.items():
+            previous = self.blobs.get((thread_id, checkpoint_ns, channel, version))
+            if previous is not None:
+                self._bytes[thread_id] -= len(previous[1])
+        previous = self.storage[thread_id][checkpoint_ns].get(checkpoint["id"])
+        if previous is not None:
+            self._bytes[thread_id] -= self._saved_size(previous)
+
+        result = super().put(config, checkpoint, metadata, new_versions)
+
+        for channel, version in new_versions.items():
+            key = (thread_id, checkpoint_ns, channel, version)
+            self._blob_keys[thread_id].add(key)
+            self._bytes[thread_id] += len(self.blobs[key][1])
+        self._bytes[thread_id] += self._saved_size(self.storage[thread_id][checkpoint_ns][checkpoint["id"]])
+
+        if self.keep_latest_only:
+            self._prune(thread_id, checkpoint_ns, checkpoint)
+
+        self._touch(thread_id)
+        self.sweep()
+        return result
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        thread_id = config["configurable"]["thread_id"]
+        outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""),
+                     config["configurable"]["checkpoint_id"])
+        size = sum(len(w[2][1]) for w in self.writes.get(outer_key, {}).values())
+        self._bytes[thread_id] += size - self._write_bytes.get(outer_key, 0)
+        self._write_bytes[outer_key] = size
+        self._write_keys[thread_id].add(outer_key)
+        self._touch(thread_id)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, latest: Checkpoint):
+        """Mantém apenas o checkpoint `latest` (e os blobs que ele referencia) no namespace."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [cid for cid in checkpoints if cid != latest["id"]]:
+            self._bytes[thread_id] -= self._saved_size(checkpoints.pop(checkpoint_id))
+            outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes.pop(outer_key, None)
+            self._bytes[thread_id] -= self._write_bytes.pop(outer_key, 0)
+            self._write_keys[thread_id].discard(outer_key)
+            self.pruned_checkpoints += 1
+
+        versions = latest["channel_versions"]
+        blob_keys = self._blob_keys[thread_id]
+        stale = [k for k in blob_keys if k[1] == checkpoint_ns and versions.get(k[2]) != k[3]]
+        for key in stale:
+            blob = self.blobs.pop(key, None)
+            if blob is not None:
+                self._bytes[thread_id] -= len(blob[1])
+            blob_keys.discard(key)
+
+    def delete_thread(self, thread_id: str) -> None:
+        # Usa os índices por thread em vez da varredura completa do InMemorySaver
+        self.storage.pop(thread_id, None)
+        for key in self._write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+            self._write_bytes.pop(key, None)
+        for key in self._blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+        self._bytes.pop(thread_id, None)
+        self._sessions.pop(thread_id, None)
+
+    @staticmethod
+    def _saved_size(saved) -> int:
+        checkpoint, metadata, _parent = saved
+        return len(checkpoint[1]) + len(metadata[1])
+
+    # --- Métricas ---
+
+    def approx_bytes(self) -> int:
+        return sum(self._bytes.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "live_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "keep_latest_only": self.keep_latest_only,
+            "approx_bytes": self.approx_bytes(),
+            "evictions_ttl": self.evictions_ttl,
+            "evictions_lru": self.evictions_lru,
+            "pruned_checkpoints": self.pruned_checkpoints,
+        }
+
+
+class _ConnectionPool:
+    """Pool simples de conexões sqlite3 compartilhado pelas threads do executor."""
+
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: autocommit; transações são abertas explicitamente
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+class _WriteBatch:
+    """Checkpoints e writes de uma execução, acumulados até o flush."""
+
+    __slots__ = ("checkpoints", "writes", "depth")
+
+    def __init__(self):
+        # (ns, checkpoint_id) -> linha da tabela checkpoints
+        self.checkpoints: Dict[Tuple[str, str], tuple] = {}
+        # (ns, checkpoint_id, task_id, idx) -> linha da tabela writes
+        self.writes: Dict[Tuple[str, str, str, int], tuple] = {}
+        self.depth = 1
+
+
+class SqliteSaver(BaseCheckpointSaver):
+    """
+    Checkpointer durável em SQLite local (modo WAL).
+
+    Permite retomar uma sessão pausada em `interrupt()` em qualquer worker (ou depois
+    de um restart) que aponte para o mesmo arquivo.
+
+    - Checkpoints são gravados inteiros (com os valores dos canais) no formato binário
+      do serializer do LangGraph (msgpack), comprimidos com zlib acima de
+      `compress_threshold` bytes. Com um `CompactSerializer` a compressão fica só com ele
+      (e com o limite dele).
+    - Dentro de `batch(thread_id)`, os `aput`/`aput_writes` de uma execução ficam em
+      memória e são gravados numa única transação na saída. Com `keep_latest_only`,
+      só o último checkpoint de cada namespace chega ao disco.
+    - As chamadas ao banco rodam em threads (`asyncio.to_thread`) usando um pool de
+      conexões, sem bloquear o event loop.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            thread_id TEXT NOT NULL,
+            checkpoint_ns TEXT NOT NULL DEFAULT '',
+            checkpoint_id TEXT NOT NULL,
+            parent_checkpoint_id TEXT,
+            type TEXT,
+            checkpoint BLOB,
+            metadata_type TEXT,
+            metadata BLOB,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+        );
+        CREATE TABLE IF NOT EXISTS writes (
+            thread_id TEXT NOT NULL,
+            checkpoint_ns TEXT NOT NULL DEFAULT '',
+            checkpoint_id TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            type TEXT,
+            value BLOB,
+            task_path TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+        );
+        CREATE INDEX IF NOT EXISTS checkpoints_updated_at ON checkpoints (updated_at);
+    """
+
+    def __init__(self, path: str, *, pool_size: int = 4, keep_latest_only: bool = False,
+                 ttl_seconds: Optional[float] = None, compress_threshold: int = 1024, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_latest_only = keep_latest_only
+        self.ttl_seconds = ttl_seconds
+        # O CompactSerializer já decide o que comprimir: um segundo limite aqui comprimiria
+        # de novo o que ele deixou cru de propósito
+        self.compress_threshold = 0 if isinstance(serde, CompactSerializer) else compress_threshold
+        self.pool = _ConnectionPool(path, size=pool_size)
+        self._batches: Dict[str, _WriteBatch] = {}
+        self._is_setup = False
+        self._setup_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        self.flushes = 0
+        self.buffered_puts = 0
+        self.coalesced_checkpoints = 0
+        self.rows_written = 0
+        self.evictions_ttl = 0
+
+    # --- Infraestrutura ---
+
+    def setup(self):
+        with self._setup_lock:
+            if self._is_setup:
+                return
+            with self.pool.connection() as conn:
+                conn.executescript(self._SCHEMA)
+            self._is_setup = True
+
+    @contextmanager
+    def _transaction(self):
+        self.setup()
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _reader(self):
+        self.setup()
+        with self.pool.connection() as conn:
+            yield conn
+
+    def _dump(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if self.compress_threshold and len(data) > self.compress_threshold and not type_.endswith("+zlib"):
+            return f"{type_}+zlib", zlib.compress(data, 1)
+        return type_, data
+
+    def _load(self, type_: str, data: bytes) -> Any:
+        if type_.endswith("+zlib"):
+            type_, data = type_[:-len("+zlib")], zlib.decompress(data)
+        return self.serde.loads_typed((type_, data))
+
+    def close(self):
+        self.pool.close()
+
+    # --- Batch por execução ---
+
+    @asynccontextmanager
+    async def batch(self, thread_id: str):
+        """Agrupa as escritas de uma execução do grafo numa única transação."""
+        current = self._batches.get(thread_id)
+        if current is not None:
+            current.depth += 1
+            try:
+                yield
+            finally:
+                current.depth -= 1
+            return
+
+        current = self._batches[thread_id] = _WriteBatch()
+        try:
+            yield
+        finally:
+            # Grava mesmo se a execução falhar: os checkpoints já produzidos são válidos
+            del self._batches[thread_id]
+            if current.checkpoints or current.writes:
+                await asyncio.to_thread(self._flush, thread_id, current)
+
+    def _flush(self, thread_id: str, batch: _WriteBatch):
+        checkpoints = batch.checkpoints
+        writes = batch.writes
+        if self.keep_latest_only:
+            latest: Dict[str, str] = {}
+            for ns, checkpoint_id in checkpoints:
+                if checkpoint_id > latest.get(ns, ""):
+                    latest[ns] = checkpoint_id
+            self.coalesced_checkpoints += len(checkpoints) - len(latest)
+            checkpoints = {k: v for k, v in checkpoints.items() if latest[k[0]] == k[1]}
+            # Só os writes dos checkpoints descartados aqui: os de checkpoints que já estavam no
+            # disco (ex: ERROR/RESUME sobre o checkpoint carregado no resume) continuam valendo
+            dropped = batch.checkpoints.keys() - checkpoints.keys()
+            writes = {k: v for k, v in writes.items() if (k[0], k[1]) not in dropped}
+
+        with self._transaction() as conn:
+            self._write_rows(conn, checkpoints.values(), writes.items())
+            if self.keep_latest_only:
+                for (ns, checkpoint_id) in checkpoints:
+                    self._prune(conn, thread_id, ns, checkpoint_id)
+        self.flushes += 1
+        self._maybe_sweep()
+
+    def _write_rows(self, conn: sqlite3.Connection, checkpoint_rows, write_items):
+        checkpoint_rows = list(checkpoint_rows)
+        conn.executemany(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", checkpoint_rows
+        )
+        # Mesma semântica do InMemorySaver: writes especiais (idx < 0) sobrescrevem
+        write_items = list(write_items)
+        replace = [row for (_, _, _, idx), row in write_items if idx < 0]
+        ignore = [row for (_, _, _, idx), row in write_items if idx >= 0]
+        if replace:
+            conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", replace)
+        if ignore:
+            conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", ignore)
+        self.rows_written += len(checkpoint_rows) + len(replace) + len(ignore)
+
+    @staticmethod
+    def _prune(conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        )
+        conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def _maybe_sweep(self):
+        if self.ttl_seconds is None:
+            return
+        now = time.time()
+        # No máximo uma varredura por minuto (ou por TTL, se for menor)
+        if now - self._last_sweep < min(60.0, self.ttl_seconds):
+            return
+        self._last_sweep = now
+        self.sweep()
+
+    def sweep(self) -> int:
+        """Remove threads sem atualização há mais de `ttl_seconds`."""
+        if self.ttl_seconds is None:
+            return 0
+        limit = time.time() - self.ttl_seconds
+        with self._transaction() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(updated_at) < ?", (limit,)
+            )]
+            for thread_id in expired:
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        self.evictions_ttl += len(expired)
+        return len(expired)
+
+    # --- Escrita ---
+
+    def _checkpoint_row(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata):
+        configurable = config["configurable"]
+        type_, data = self._dump(checkpoint)
+        metadata_type, metadata_data = self._dump(get_checkpoint_metadata(config, metadata))
+        return (
+            configurable["thread_id"], configurable.get("checkpoint_ns", ""), checkpoint["id"],
+            configurable.get("checkpoint_id"), type_, data, metadata_type, metadata_data, time.time(),
+        )
+
+    def _write_items(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                     task_path: str):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        items = []
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            type_, data = self._dump(value)
+            items.append((
+                (checkpoint_ns, checkpoint_id, task_id, idx),
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, data, task_path),
+            ))
+        return items
+
+    @staticmethod
+    def _next_config(config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
+        return {
+            "configurable": {
+                "thread_id": config["configurable"]["thread_id"],
+                "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        row = self._checkpoint_row(config, checkpoint, metadata)
+        batch = self._batches.get(row[0])
+        if batch is not None:
+            batch.checkpoints[(row[1], row[2])] = row
+            self.buffered_puts += 1
+        else:
+            with self._transaction() as conn:
+                self._write_rows(conn, [row], [])
+                if self.keep_latest_only:
+                    self._prune(conn, row[0], row[1], row[2])
+        return self._next_config(config, checkpoint)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        items = self._write_items(config, writes, task_id, task_path)
+        batch = self._batches.get(config["configurable"]["thread_id"])
+        if batch is not None:
+            for key, row in items:
+                if key[3] >= 0 and key in batch.writes:
+                    continue
+                batch.writes[key] = row
+            return
+        with self._transaction() as conn:
+            self._write_rows(conn, [], items)
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        if config["configurable"]["thread_id"] in self._batches:
+            return self.put(config, checkpoint, metadata, new_versions)
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        if config["configurable"]["thread_id"] in self._batches:
+            return self.put_writes(config, writes, task_id, task_path)
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        batch = self._batches.get(thread_id)
+        if batch is not None:
+            batch.checkpoints.clear()
+            batch.writes.clear()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    # --- Leitura ---
+
+    def _buffered_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        batch = self._batches.get(thread_id)
+        if batch is None:
+            return []
+        return [row for key, row in batch.writes.items() if key[0] == checkpoint_ns and key[1] == checkpoint_id]
+
+    def _to_tuple(self, row: tuple, write_rows: list) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, data, metadata_type, metadata = row[:8]
+        # Ordem de aplicação dos writes: (task_path, task_id, idx)
+        write_rows = sorted(write_rows, key=lambda w: (w[8], w[3], w[4]))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self._load(type_, data),
+            metadata=self._load(metadata_type, metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(w[3], w[5], self._load(w[6], w[7])) for w in write_rows],
+        )
+
+    def _buffered_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        batch = self._batches.get(configurable["thread_id"])
+        if batch is None:
+            return None
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            # Checkpoints do batch são sempre mais novos que os do banco
+            ids = [cid for ns, cid in batch.checkpoints if ns == checkpoint_ns]
+            checkpoint_id = max(ids) if ids else None
+        row = batch.checkpoints.get((checkpoint_ns, checkpoint_id))
+        if row is None:
+            return None
+        return self._to_tuple(row, self._buffered_writes(row[0], checkpoint_ns, checkpoint_id))
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        buffered = self._buffered_tuple(config)
+        if buffered is not None:
+            return buffered
+        return self._db_get_tuple(config)
+
+    def _db_get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self._reader() as conn:
+            if checkpoint_id:
+                row = conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            write_rows = conn.execute(
+                "SELECT * FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, row[2]),
+            ).fetchall()
+        # Writes de um resume podem estar no batch apontando para um checkpoint do banco
+        return self._to_tuple(row, write_rows + self._buffered_writes(thread_id, checkpoint_ns, row[2]))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        buffered = self._buffered_tuple(config)
+        if buffered is not None:
+            return buffered
+        return await asyncio.to_thread(self._db_get_tuple, config)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query, params = "SELECT * FROM checkpoints", []
+        clauses = []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if "checkpoint_ns" in config["configurable"]:
+                clauses.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._reader() as conn:
+            rows = conn.execute(query, params).fetchall()
+            tuples = []
+            for row in rows:
+                write_rows = conn.execute(
+                    "SELECT * FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (row[0], row[1], row[2]),
+                ).fetchall()
+                tuples.append(self._to_tuple(row, write_rows))
+
+        count = 0
+        for item in tuples:
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            yield item
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    # --- Métricas ---
+
+    async def astats(self) -> Dict[str, Any]:
+        """`stats()` numa thread: as somas varrem as tabelas inteiras."""
+        return await asyncio.to_thread(self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._reader() as conn:
+            live_sessions, checkpoint_bytes = conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) "
+                "FROM checkpoints"
+            ).fetchone()
+            (write_bytes,) = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "live_sessions": live_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "keep_latest_only": self.keep_latest_only,
+            "approx_bytes": checkpoint_bytes + write_bytes,
+            "active_batches": len(self._batches),
+            "flushes": self.flushes,
+            "buffered_puts": self.buffered_puts,
+            "coalesced_checkpoints": self.coalesced_checkpoints,
+            "rows_written": self.rows_written,
+            "evictions_ttl": self.evictions_ttl,
+        }
+
+
+async def checkpointer_stats(saver: BaseCheckpointSaver) -> Dict[str, Any]:
+    """Contadores do checkpointer sem bloquear o event loop (`astats` quando houver)."""
+    astats = getattr(saver, "astats", None)
+    return await astats() if astats is not None else saver.stats()
+
+
+def checkpoint_batch(saver: BaseCheckpointSaver, thread_id: str):
+    """`saver.batch(thread_id)` se o checkpointer suportar agrupamento; senão, no-op."""
+    batch = getattr(saver, "batch", None)
+    return batch(thread_id) if batch is not None else nullcontext()
@@ -1,54 +1,191 @@
-import json
-import re
-# Importar httpx no lugar de requests
-import httpx 
-from typing import Dict, Any, List, TypedDict, Literal
-# Importar AsyncNodes e AsyncStateGraph
-from langgraph.graph import StateGraph, END, START 
-from langgraph.graph.state import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+import asyncio
+import time
+from typing import Dict, Any, TypedDict, Literal, Annotated, Awaitable, Callable
+from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.memory import MemorySaver
-from langgraph.types import interrupt
+from langgraph.config import get_stream_writer
+from langgraph.errors import GraphBubbleUp
 from pydantic import BaseModel
 
-from storage import ContextStore
-from templates import render_data
-from py_expression_eval import Parser
+from templates import compile_data, render_compiled, context_references
+from flow_plan import CONDITIONAL_TYPES, ERROR_KEY, EXIT, TEXT_FIELDS, compile_flow, key_mapping
+from expressions import compile_expression
+from http_cache import HttpResponseCache
+from llm_cache import LLMResultCache
+from json_projection import DEFAULT_MAX_RESPONSE_BYTES, build_trie, data_paths
+from layered_context import LayeredContext, changes, context_delta, materialize, merge_context
+from node_registry import REGISTRY, LazyResources
+from speculation import SpeculationStash
+from resilience import DeadlineExceeded, UpstreamRegistry, remaining_budget
+import telemetry
+from telemetry import logger, NODE_PHASE_SECONDS, NODE_ERRORS, SPECULATIONS
+
+def merge_branch_results(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer de `branch_results`: acumula o resultado de cada ramo; `None` limpa (usado pelo join)."""
+    if right is None:
+        return {}
+    return {**(left or {}), **right}
 
 # Definição do Estado do Grafo
 class FlowState(TypedDict):
-    context: Dict[str, Any]
+    # Cada nó publica só as chaves que alterou (delta); o reducer aplica sobre o contexto atual
+    context: Annotated[Dict[str, Any], merge_context]
     current_node: str
-    status: Literal["running", "waiting_input", "completed"]
+    status: Literal["running", "waiting_input", "completed", "timed_out"]
+    # Resultados dos ramos de um nó `parallel`, por id do ramo, até o `join` consolidar.
+    # Os ramos rodam no mesmo superstep, então não podem escrever em `context` diretamente.
+    branch_results: Annotated[Dict[str, Any], merge_branch_results]
+    # Hash da definição em que a sessão começou (gravado só no input inicial): o resume
+    # usa essa versão mesmo que o arquivo tenha sido editado enquanto a sessão esperava
+    flow_version: str
 class Message(BaseModel):
     type: str
     content: Dict[str, Any]
 class FlowEngine:
-    # Agora recebemos llm, http_client e parser prontos
-    def __init__(self, flow_config: dict, user_id: str,  memory: MemorySaver, #store: ContextStore,
-            llm: ChatOpenAI, http_client: httpx.AsyncClient, parser: Parser):
+    # Nó de callback do fim do fluxo no grafo
+    FINAL_NODE_ID = "flow_end_callback"
+
+    # llm e http_client podem vir prontos ou, com `resources`, ser pedidos em `build_graph`
+    # só se o fluxo tiver nós que precisam deles.
+    # O engine não guarda nada da requisição: o grafo compilado é reaproveitado
+    # entre usuários, e o user_id chega pelo config do LangGraph (thread_id).
+    def __init__(self, flow_config: dict, memory: MemorySaver, #store: ContextStore,
+            llm: Any = None, http_client: Any = None,
+            llm_cache: LLMResultCache = None, flow_name: str = None,
+            upstreams: UpstreamRegistry = None, subflows: Callable[[str], Awaitable[Any]] = None,
+            resources: LazyResources = None):
         
         self.config = flow_config
+        # Rótulo `flow` das métricas
+        self.flow_name = flow_name or flow_config.get("name", "flow")
         # self.store = store
         self.memory = memory
-        self.user_id = user_id
-        # Mapeamento é rápido, pode ficar aqui (é O(N) simples)
-        self.nodes_map = {node["id"]: node for node in flow_config["nodes"]}
+        # Validação estática + plano imutável (adjacência, entrada, leituras/escritas por nó).
+        # Um fluxo inválido falha aqui, no carregamento, e não no meio de uma sessão.
+        self.execution_plan = compile_flow(flow_config)
+        for warning in self.execution_plan.warnings:
+            logger.warning("Fluxo '%s': %s", self.flow_name, warning)
+        # Inclui os corpos inline de nós `map` como nós internos (não entram no grafo), para
+        # reaproveitar a compilação e a execução de ações dos nós comuns.
+        self.nodes_map = self.execution_plan.nodes
+        # Plano compilado: os templates Jinja2 de cada nó são compilados uma única vez
+        # aqui (o engine só é criado quando o grafo é construído) e reaproveitados
+        # em todas as execuções.
+        # `"render": "native"`: templates de expressão única devolvem o valor tipado do contexto
+        self.native_render = flow_config.get("render", "string") == "native"
+        self.plans = {node_id: self._compile_node(node, self.native_render) for node_id, node in self.nodes_map.items()}
+        # Cache HTTP opt-in por nó api (`action_config.cache`); vive junto com o grafo compilado
+        self.http_caches = {
+            node_id: HttpResponseCache(**node["action_config"]["cache"])
+            for node_id, node in self.nodes_map.items()
+            if node["type"] == "api" and node.get("action_config", {}).get("cache")
+        }
+        # Tabela de despacho nó -> executor: o módulo de cada tipo usado é importado aqui
+        # (uma vez por processo), e a execução não compara strings de tipo
+        self.executors = {node_id: REGISTRY.resolve(node["type"]) for node_id, node in self.nodes_map.items()}
+        # Fan-out/join: ramo -> nó parallel de origem; join -> ramos (na ordem declarada)
+        self.branch_of = self.execution_plan.branch_of
+        self.join_branches = self.execution_plan.join_branches
         
         # Referências aos objetos globais (Leve, apenas ponteiros)
-        self.expression_parser = parser
         self.llm = llm 
         self.http_client = http_client
+        self.resources = resources
+        # Cache de respostas do LLM (compartilhado entre fluxos); None desliga
+        self.llm_cache = llm_cache
+        # Bulkhead, timeout adaptativo, retries e circuit breaker por upstream (host ou
+        # provedor de LLM); o api.py passa um registro único, compartilhado entre fluxos
+        self.upstreams = upstreams or UpstreamRegistry()
+        # Nós `subflow`: `subflows(nome)` devolve o grafo compilado do fluxo filho (o registro
+        # de fluxos passa os do graph_cache); resolvidos uma vez em `build_graph`
+        self.subflows = subflows
+        self.subflow_apps: Dict[str, Any] = {}
+        # Especulação opt-in por fluxo (`"speculation": true` ou {"max_nodes", "ttl", "max_sessions"}):
+        # enquanto a sessão espera num output, adianta as ações que não dependem da resposta
+        speculation = flow_config.get("speculation")
+        if speculation is True:
+            speculation = {}
+        self.speculation = None
+        self.speculation_max_nodes = 0
+        if isinstance(speculation, dict) and speculation.get("enabled", True):
+            self.speculation = SpeculationStash(
+                self.flow_name,
+                ttl=speculation.get("ttl", 300),
+                max_sessions=speculation.get("max_sessions", 1000),
+            )
+            self.speculation_max_nodes = int(speculation.get("max_nodes", 3))
 
     # Lembre-se: Não feche o http_client aqui dentro se ele for compartilhado!
 
     # --- Funções Auxiliares (Não precisam ser assíncronas, exceto se usarem chamadas bloqueantes) ---
 
+    @staticmethod
+    def _compile_node(node: dict, native: bool = False) -> dict:
+        """Compila os campos templados de um nó (pre_update, action_config, post_update)."""
+        action_config = dict(node.get("action_config", {}))
+        expression = None
+        # Nós de desvio: a condição vira uma expressão tipada (sem Jinja2 nem eval)
+        if node["type"] == "if-else":
+            expression = compile_expression(action_config.pop("condition"))
+        elif node["type"] == "switch-case":
+            expression = compile_expression(action_config.pop("variable"))
+        elif node["type"] == "map":
+            # `items` é uma expressão tipada (a lista nativa do contexto, sem passar por string);
+            # o corpo é compilado à parte como nó interno.
+            expression = compile_expression(action_config.pop("items"))
+            action_config.pop("body", None)
+        # Configuração de cache é estática: não precisa ser renderizada a cada chamada
+        cache = action_config.pop("cache", None)
+        llm_cache = None
+        if node["type"] == "llm" and cache is not False:
+            # Nós llm usam o cache global por padrão; `"cache": false` desliga no nó e
+            # `"cache": {"normalize": false}` exige o prompt exato na chave
+            llm_cache = cache if isinstance(cache, dict) else {}
+        post_update = compile_data(node.get("post_update", {}), native)
+        # Projeção opcional do resultado de cada item (corpos de `map`)
+        output = compile_data(node["output"], native) if "output" in node else None
+        # Nós api: campos do corpo JSON a materializar (None = corpo inteiro) e teto do corpo
+        extract = action_config.pop("extract", None)
+        # Sobrescritas por nó da política do upstream (estáticas)
+        retries = timeout = None
+        if node["type"] in ("api", "llm"):
+            retries = action_config.pop("retries", None)
+            timeout = action_config.pop("timeout", None)
+        max_response_bytes = action_config.pop("max_response_bytes", DEFAULT_MAX_RESPONSE_BYTES)
+        # Nós subflow: fluxo filho e chaves copiadas na ida/volta (estáticos, sem render)
+        subflow = input_keys = output_keys = None
+        if node["type"] == "subflow":
+            subflow = action_config.pop("flow")
+            input_keys = key_mapping(action_config.pop("input", None))
+            output_keys = key_mapping(action_config.pop("output", None))
+        if extract == "auto":
+            # Os caminhos `context.result.data.*` lidos por post_update/output
+            paths = data_paths(context_references(post_update) + context_references(output))
+            extract = build_trie(paths) if paths is not None else None
+        elif extract:
+            extract = build_trie(extract)
+        return {
+            "pre_update": compile_data(node.get("pre_update", {}), native),
+            "action_config": {key: compile_data(value, native and key not in TEXT_FIELDS)
+                              for key, value in action_config.items()},
+            "post_update": post_update,
+            "expression": expression,
+            "output": output,
+            "llm_cache": llm_cache,
+            "extract": extract,
+            "max_response_bytes": max_response_bytes,
+            "retries": retries,
+            "timeout": timeout,
+            "subflow": subflow,
+            "input_keys": input_keys,
+            "output_keys": output_keys,
+        }
+
     def _update_context(self, current_context: dict, updates: dict, remove_keys: list = None):
-        """Atualiza e limpa o contexto."""
+        """Atualiza e limpa o contexto. `updates` é um plano já compilado."""
         # ... (Mantém a implementação atual)
-        rendered_updates = render_data(updates, current_context)
+        rendered_updates = render_compiled(updates, current_context)
         current_context.update(rendered_updates)
         
         if remove_keys:
@@ -58,155 +195,248 @@ class FlowEngine:
         return current_context
 
     
+    @staticmethod
+    def _user_id(config: RunnableConfig) -> str:
+        """Identificador da sessão atual, vindo do config da execução."""
+        return (config or {}).get("configurable", {}).get("thread_id")
+
+    @staticmethod
+    def deadline(config: RunnableConfig):
+        """Deadline da requisição (`time.monotonic()`), ou None; vem do config, como o thread_id."""
+        return (config or {}).get("configurable", {}).get("deadline")
+
     # Torna a função de execução de nó assíncrona
-    async def _execute_node(self, state: FlowState):
-        context = state["context"]
-        # context = self.store.get_context(self.user_id)
-        node_id = context.get("current_node",state["current_node"])
+    async def _execute_node(self, state: FlowState, config: RunnableConfig, node_id: str = None):
+        # O contexto do estado é só a base: o nó escreve numa camada própria, sem copiar o dict
+        context = LayeredContext(state["context"])
+        # context = self.store.get_context(self._user_id(config))
+        node_id = node_id or context.get("current_node",state["current_node"])
         node_config = self.nodes_map[node_id]
-        # context = state["context"]
-        next_node_id = None
         status = "running"
 
-        print(f"\n--- Executando Nó: {node_id} ({node_config['type']}) ---")
+        logger.debug("[%s] Executando nó: %s (%s)", self._user_id(config), node_id, node_config["type"])
 
-        # 1. Pre-Update Context
-        if "pre_update" in node_config:
-            context = self._update_context(context, node_config.get("pre_update", {}), node_config.get("pre_remove", []))
+        context, next_node_id = await self._apply_node(node_id, context, config, state)
 
-        # 2. Execução da Ação
-        action_result = {}
-        node_type = node_config["type"]
+        # 4. Determinar a Transição
+        update = {
+            "current_node": next_node_id,
+            # Apenas as chaves alteradas pelo nó
+            "context": context_delta(context),
+            "status": status,
+        }
+        if node_config["type"] == "join":
+            # Resultados dos ramos já consolidados no contexto
+            update["branch_results"] = None
         
-        # Renderizar configurações da ação
-        action_config = render_data(node_config.get("action_config", {}), context)
+        # self.store.save_state(self._user_id(config), state)  #
+        return update
 
-        if node_type == "api":
-            method = action_config.get("method", "get").lower()
-            url = action_config["url"]
-            headers = action_config.get("headers", {})
-            body = action_config.get("body", None)
-            
-            # Determine if we should send as JSON or content
-            json_body = None
-            content_body = None
-            
-            if isinstance(body, (dict, list)):
-                json_body = body
-            elif isinstance(body, str):
-                try: 
-                    json_body = json.loads(body)
-                except:
-                    content_body = body
-            else:
-                json_body = body
+    async def _apply_node(self, node_id: str, context: dict, config: RunnableConfig, state: FlowState = None):
+        """Executa pre_update, ação e post_update de um nó sobre `context`. Retorna (context, próximo nó)."""
+        node_config = self.nodes_map[node_id]
+        plan = self.plans[node_id]
+        node_type = node_config["type"]
+        # Cancelamento cooperativo: com o orçamento esgotado o nó nem começa, e o checkpoint
+        # fica no fim do nó anterior (ponto de retomada)
+        remaining_budget(self.deadline(config))
 
-            # !!! SUBSTITUIÇÃO CHAVE: Usar httpx.AsyncClient para chamadas assíncronas !!!
-            # O `aclose()` garante que a conexão seja fechada.
-            client = self.http_client
+        with telemetry.span("node", self._user_id(config), flow=self.flow_name, node=node_id, type=node_type):
             try:
-                # Usa await para esperar a requisição assíncrona
-                if json_body is not None:
-                    response = await client.request(method, url, headers=headers, json=json_body, timeout=60.0)
-                else:
-                    response = await client.request(method, url, headers=headers, content=content_body, timeout=60.0)
-                
-                response.raise_for_status() # Lança exceção para status 4xx/5xx
-
-                try:
-                    action_result = {"status": response.status_code, "data": response.json()}
-                except:
-                    action_result = {"status": response.status_code, "text": response.text}
-            except httpx.HTTPStatusError as e:
-                print(f"Erro HTTP: {e}")
-                action_result = {"error": f"HTTP Error: {e.response.status_code}", "status": e.response.status_code}
-            except httpx.RequestError as e:
-                print(f"Erro de Requisição: {e}")
-                action_result = {"error": f"Request Error: {e}"}
-
-        elif node_type == "llm":
-            prompt = action_config["prompt"]
-            # A chamada para self.llm.invoke é síncrona, mas a LangChain oferece
-            # 'ainvoke' para uso assíncrono.
-            msg = await self.llm.ainvoke([HumanMessage(content=prompt)]) 
-            # Garantir que o conteúdo seja corretamente decodificado como UTF-8
-            response_content = msg.content
-            if isinstance(response_content, bytes):
-                response_content = response_content.decode('utf-8')
-            action_result = {"response": response_content}
-
-        # elif node_type == "input":
-            # prompt_text = action_config.get("message", "Insira um valor:")
-            
-            # # Tenta obter o input do contexto (injetado pela API)
-            # user_inputs = context.get("user_inputs", {})
-            # if user_inputs:
-            #    messages: List[Message] = [Message(**item) for item in user_inputs]
-            
-            # # action_result = {"value": user_input}
+                # 1. Pre-Update Context
+                if "pre_update" in node_config:
+                    inicio = time.perf_counter()
+                    context = self._update_context(context, plan["pre_update"], node_config.get("pre_remove", []))
+                    NODE_PHASE_SECONDS.observe(time.perf_counter() - inicio, self.flow_name, node_id, node_type, "pre_update")
 
-            # status = "waiting_input"
-        elif node_type == "output":
-            prompt_text = action_config.get("message", "Insira um valor:")
-            
-            # Tenta obter o input do contexto (injetado pela API)
-            user_inputs = context.get("user_inputs", {})
-            if node_id in user_inputs:
-                user_input = user_inputs[node_id]
-                print(f">> Input para '{node_id}' recebido via contexto: {user_input}")
-            else:
-                context["user_inputs"] = interrupt(prompt_text)
-                # Fallback para input interativo (apenas para testes locais)
-                # user_input = input(f">> {prompt_text} ")
-            
-            # action_result = {"value": user_input}
+                # 2. Execução da Ação (render + action medidos em run_action)
+                action_result, next_node_id = await self.run_action(node_id, context, config, state)
 
-            # status = "waiting_input"
+                # 3. Post-Update Context (Injetar resultado da ação no contexto)
+                inicio = time.perf_counter()
+                if node_config.get("on_error") and isinstance(action_result, dict) and "error" in action_result:
+                    # Desvio para `on_error`: o post_update espera o resultado de sucesso;
+                    # o nó de erro lê o que houve em `context.last_error`
+                    context[ERROR_KEY] = {"node": node_id, **action_result}
+                else:
+                    self._post_update(node_id, context, action_result)
+                NODE_PHASE_SECONDS.observe(time.perf_counter() - inicio, self.flow_name, node_id, node_type, "post_update")
+            except (GraphBubbleUp, DeadlineExceeded):
+                # interrupt/Command: controle de fluxo do LangGraph, não é erro; deadline também não
+                raise
+            except Exception:
+                NODE_ERRORS.inc(self.flow_name, node_id, node_type)
+                raise
 
-        elif node_type == "fixed":
-            action_result = action_config.get("data", {})
-        
-        elif node_type == "if-else":
-            action_result = render_data(node_config["action_config"]["condition"], context)
-            next_node_id = (node_config["action_config"]["true_node"] if eval(action_result) 
-                            else node_config["action_config"]["false_node"])
+        return context, next_node_id or node_config.get("next")
 
-        # 3. Post-Update Context (Injetar resultado da ação no contexto)
-        temp_context_for_mapping = {**context, "result": action_result}
+    def _post_update(self, node_id: str, context: dict, action_result: Any):
+        node_config = self.nodes_map[node_id]
+        # `result` numa camada por cima do contexto, sem copiá-lo
+        temp_context_for_mapping = LayeredContext(context, {"result": action_result})
         
         if "post_update" in node_config:
-            updates = render_data(node_config["post_update"], temp_context_for_mapping)
+            updates = render_compiled(self.plans[node_id]["post_update"], temp_context_for_mapping)
             context.update(updates)
             
         if "post_remove" in node_config:
             for key in node_config["post_remove"]:
                 context.pop(key, None)
 
-        # 4. Determinar a Transição
-        next_node_id = next_node_id or node_config.get("next")
-        state["current_node"] = next_node_id
+    async def run_action(self, node_id: str, context: dict, config: RunnableConfig, state: FlowState = None):
+        """
+        Renderiza e executa a ação do nó sobre `context`, sem pre/post update. Retorna
+        (action_result, próximo nó definido pela ação ou None). Usado também pelos executores
+        (ex: corpo de cada item do `map`).
+        """
+        plan = self.plans[node_id]
+        node_type = self.nodes_map[node_id]["type"]
         
-        state["context"] = context
-        state["status"] = status
-        
-        # self.store.save_state(self.user_id, state)  #
-        return state
+        # Renderizar configurações da ação
+        inicio = time.perf_counter()
+        action_config = render_compiled(plan["action_config"], context)
+        renderizado = time.perf_counter()
+        NODE_PHASE_SECONDS.observe(renderizado - inicio, self.flow_name, node_id, node_type, "render")
+        try:
+            if self.speculation is not None:
+                speculated = self.speculation.take(self._user_id(config), node_id, action_config)
+                if speculated is not None:
+                    result = await self._commit_speculation(node_id, speculated, config)
+                    if result is not None:
+                        return result
+            return await self._dispatch_action(node_id, node_type, action_config, context, config, state)
+        finally:
+            NODE_PHASE_SECONDS.observe(time.perf_counter() - renderizado, self.flow_name, node_id, node_type, "action")
+
+    async def _dispatch_action(self, node_id: str, node_type: str, action_config: dict, context: dict,
+                               config: RunnableConfig, state: FlowState = None):
+        # Tabela nó -> executor montada no __init__ (ver node_registry)
+        return await self.executors[node_id](self, node_id, action_config, context, config, state)
+
+    # --- Especulação ---
+
+    def start_speculation(self, output_id: str, context: dict, config: RunnableConfig):
+        """Com a sessão pausada no output, adianta a cadeia de ações que não depende da resposta."""
+        chain = self.execution_plan.prefetch.get(output_id)
+        thread_id = self._user_id(config)
+        if self.speculation is None or not chain or not thread_id:
+            return
+        # Cópia rasa do contexto no momento da pausa; a simulação escreve numa camada por cima
+        snapshot = LayeredContext(materialize(context))
+        task = asyncio.ensure_future(self._speculate(thread_id, chain, snapshot))
+        self.speculation.start(thread_id, task)
+
+    async def _speculate(self, thread_id: str, chain: tuple, context: LayeredContext):
+        """
+        Percorre a cadeia adiantável do output: nós `run` têm a ação disparada e guardada
+        no stash; nós `simulate` (fixed) e os `run` atualizam o contexto simulado para os
+        seguintes; nós `skip` dependem da resposta do usuário e são pulados.
+        """
+        config = {"configurable": {"thread_id": thread_id}}
+        started = 0
+        for node_id, mode in chain:
+            if mode == "skip":
+                continue
+            if mode == "run" and started >= self.speculation_max_nodes:
+                break
+            node_config = self.nodes_map[node_id]
+            node_type = node_config["type"]
+            try:
+                if "pre_update" in node_config:
+                    self._update_context(context, self.plans[node_id]["pre_update"], node_config.get("pre_remove", []))
+                action_config = render_compiled(self.plans[node_id]["action_config"], context)
+                action = self._dispatch_action(node_id, node_type, action_config, context, config)
+                if mode == "run":
+                    future = asyncio.ensure_future(action)
+                    if not self.speculation.put(thread_id, node_id, action_config, future):
+                        return
+                    started += 1
+                    # shield: o resume pode estar esperando a mesma task
+                    action_result, _ = await asyncio.shield(future)
+                else:
+                    action_result, _ = await action
+                self._post_update(node_id, context, action_result)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                logger.debug("[%s] Especulação interrompida no nó %s: %s", thread_id, node_id, e)
+                return
+
+    async def _commit_speculation(self, node_id: str, speculated: asyncio.Future, config: RunnableConfig):
+        """Aproveita a ação adiantada; None (executa de novo) se ela falhou."""
+        try:
+            result = await speculated
+        except (Exception, asyncio.CancelledError) as e:
+            SPECULATIONS.inc(self.flow_name, node_id, "failed")
+            logger.debug("[%s] Especulação do nó %s descartada: %s", self._user_id(config), node_id, e)
+            return None
+        action_result = result[0]
+        if isinstance(action_result, dict) and action_result.get("error"):
+            # Falha do upstream (ex: 503 passageiro) não é reaproveitada: executa de novo
+            SPECULATIONS.inc(self.flow_name, node_id, "failed")
+            return None
+        SPECULATIONS.inc(self.flow_name, node_id, "committed")
+        if self.nodes_map[node_id]["type"] == "llm" and (config or {}).get("configurable", {}).get("stream_tokens"):
+            # Resposta já pronta: sai como um único token, como nos acertos do cache
+            get_stream_writer()({"event": "token", "node": node_id, "token": action_result["response"],
+                                 "speculative": True})
+        return result
+
+    # --- Fan-out / Join ---
+
+    async def _execute_branch(self, state: FlowState, config: RunnableConfig, node_id: str):
+        """
+        Executa um ramo de `parallel` sobre uma camada do contexto e publica só o delta
+        (chaves alteradas/removidas) em `branch_results`, para o join consolidar.
+        """
+        parallel_config = self.nodes_map[self.branch_of[node_id]].get("action_config", {})
+        timeout = parallel_config.get("timeouts", {}).get(node_id, parallel_config.get("timeout"))
+        mode = parallel_config.get("mode", "fail_fast")
+
+        logger.debug("[%s] Executando ramo: %s (%s)", self._user_id(config), node_id, self.nodes_map[node_id]["type"])
+
+        context = LayeredContext(state["context"])
+        try:
+            if timeout:
+                context, _ = await asyncio.wait_for(self._apply_node(node_id, context, config), timeout)
+            else:
+                context, _ = await self._apply_node(node_id, context, config)
+        except Exception as e:
+            # fail_fast: o erro derruba o superstep (o LangGraph cancela os outros ramos)
+            if mode != "collect_errors" or isinstance(e, DeadlineExceeded):
+                raise
+            error = f"Timeout após {timeout}s" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+            logger.warning("Erro no ramo '%s': %s", node_id, error)
+            return {"branch_results": {node_id: {"error": error}}}
+
+        updates, removed = changes(context)
+        return {"branch_results": {node_id: {"updates": updates, "removed": removed}}}
+
+    def _node_runner(self, node_id: str):
+        """Função do nó no grafo, já ligada ao id (ramos paralelos não podem depender de `current_node`)."""
+        if node_id in self.branch_of:
+            async def run_branch(state: FlowState, config: RunnableConfig):
+                return await self._execute_branch(state, config, node_id)
+            return run_branch
+
+        async def run_node(state: FlowState, config: RunnableConfig):
+            return await self._execute_node(state, config, node_id)
+        return run_node
 
     # --- Função de Callback do END ---
 
-    async def _print_final_message(self, state: FlowState):
-        """Callback executado ao atingir o END: Imprime a final_message do contexto."""
+    async def _print_final_message(self, state: FlowState, config: RunnableConfig):
+        """Callback executado ao atingir o END: registra a final_message do contexto."""
+        if self.speculation is not None:
+            # Fim da sessão: nada mais vai aproveitar o que foi adiantado
+            self.speculation.discard(self._user_id(config))
         final_message = state["context"].get("final_message", "Fluxo finalizado sem 'final_message' definida no contexto.")
         
-        # O print assíncrono não existe, mas a função em si é um `async def` para ser 
-        # aceita pelo `langgraph` como um executor do END.
-        print("\n" + "="*50)
-        print(">>> FIM DO FLUXO: MENSAGEM FINAL (Contexto) <<<")
-        print(f"Mensagem: {final_message}")
-        print("="*50 + "\n")
+        # A função é um `async def` para ser aceita pelo `langgraph` como um executor do END.
+        logger.debug("Fim do fluxo '%s'. Mensagem final: %s", self.flow_name, final_message)
         
-        # É importante retornar o estado para que o histórico seja mantido
-        return state
+        # Nada muda no estado: não reescreve o contexto no último checkpoint
+        return {}
 
     # --- Roteador e Build do Grafo ---
 
@@ -214,37 +444,73 @@ class FlowEngine:
         """Decide o próximo nó baseado em lógica condicional ou fluxo simples."""
         # Se 'current_node' for None/vazio, o fluxo acabou, o LangGraph usa END.
         return state["current_node"] or END
+
+    def _error_router(self, state: FlowState) -> str:
+        """Nós com `on_error`: segue `next` ou `on_error`; sem `next`, vai para o callback final."""
+        return state["current_node"] or self.FINAL_NODE_ID
         
+    async def _acquire_resources(self):
+        """Pede ao `resources` os recursos dos tipos de nó do fluxo que não vieram prontos."""
+        node_types = {node["type"] for node in self.nodes_map.values()}
+        for name in REGISTRY.resources_for(node_types):
+            if getattr(self, name, None) is not None:
+                continue
+            if self.resources is None:
+                raise ValueError(f"Fluxo '{self.flow_name}' precisa do recurso '{name}', que não foi fornecido ao engine.")
+            setattr(self, name, await self.resources.get(name))
+
     async def build_graph(self):
+        await self._acquire_resources()
+        # Grafos dos fluxos filhos: compilados uma vez (graph_cache) e compartilhados
+        for child in self.execution_plan.subflows:
+            if self.subflows is None:
+                raise ValueError(f"Fluxo '{self.flow_name}' usa o subflow '{child}', mas o engine não tem resolvedor de subfluxos.")
+            self.subflow_apps[child] = await self.subflows(child)
+
         workflow = StateGraph(FlowState) 
 
         # 1. Adicionar o nó de finalização
         # É preciso dar um ID para a função de callback e adicioná-la como um nó.
-        FINAL_NODE_ID = "flow_end_callback"
+        FINAL_NODE_ID = self.FINAL_NODE_ID
         workflow.add_node(FINAL_NODE_ID, self._print_final_message)
         
+        plan = self.execution_plan
         # Adicionar nós normais ao grafo
-        for node in self.config["nodes"]:
-            workflow.add_node(node["id"], self._execute_node)
+        for node_id in plan.order:
+            workflow.add_node(node_id, self._node_runner(node_id))
 
         # Definir ponto de entrada
-        start_node_id = self.config["nodes"][0]["id"]
-        workflow.set_entry_point(start_node_id)
-
-        # Adicionar arestas
-        for node in self.config["nodes"]:
-            if node["type"] in ["switch-case", "if-else"]:
-                workflow.add_conditional_edges(
-                    node["id"],
-                    self._router,
-                )
+        workflow.set_entry_point(plan.entry)
+
+        # Adicionar arestas (adjacência já validada pelo plano)
+        for node_id in plan.order:
+            if node_id in self.branch_of:
+                # Saída dos ramos: aresta conjunta para o join (abaixo)
+                continue
+            node_type = self.nodes_map[node_id]["type"]
+            targets = plan.successors[node_id]
+            if node_type in CONDITIONAL_TYPES:
+                # Destinos possíveis declarados ao LangGraph; desvio templado fica em aberto
+                path_map = None if node_id in plan.dynamic else [END if t == EXIT else t for t in targets]
+                workflow.add_conditional_edges(node_id, self._router, path_map)
+            elif node_type == "parallel":
+                # Fan-out: todos os ramos rodam no mesmo superstep
+                for branch in targets:
+                    workflow.add_edge(node_id, branch)
+            elif len(targets) > 1:
+                # `on_error`: dois destinos possíveis, decididos pelo resultado da ação
+                path_map = [FINAL_NODE_ID if t == EXIT else t for t in targets]
+                workflow.add_conditional_edges(node_id, self._error_router, path_map)
+            elif targets[0] == EXIT:
+                # CORREÇÃO CHAVE: Usar o ID do nó de callback recém-criado
+                workflow.add_edge(node_id, FINAL_NODE_ID)
             else:
                 # Aresta normal
-                if "next" in node:
-                    workflow.add_edge(node["id"], node["next"])
-                else:
-                    # CORREÇÃO CHAVE: Usar o ID do nó de callback recém-criado
-                    workflow.add_edge(node["id"], FINAL_NODE_ID)
+                workflow.add_edge(node_id, targets[0])
+
+        # Join: só executa quando todos os ramos terminarem
+        for join_id, branches in self.join_branches.items():
+            workflow.add_edge(list(branches), join_id)
 
         # 2. Conectar o nó de callback ao END do fluxo
         # Após a mensagem final ser impressa, o fluxo realmente termina.
@@ -0,0 +1,360 @@
+import ast
+import operator
+import re
+from collections.abc import Mapping
+from typing import Any, Callable
+
+# Avaliador de expressões para nós de desvio (if-else / switch-case).
+#
+# A expressão é convertida uma única vez (no carregamento do fluxo) em uma
+# árvore de closures Python; na execução só essas closures são chamadas, sem
+# renderizar template nem usar eval(). Os tipos são preservados: um número no
+# contexto continua número, então `context.peso > 100` funciona sem `| int`.
+#
+# Sintaxe suportada (subconjunto comum a Python e Jinja2):
+#   - acesso: context.a.b, context.lista[0], context["chave"]
+#   - literais: números, strings, True/False/None (ou true/false/none), listas
+#   - operadores: + - * / // %, comparações (inclusive encadeadas), in, not in,
+#     and, or, not, is / is not
+#   - filtros estilo Jinja: valor | int, valor | default(0), valor | lower ...
+#   - testes estilo Jinja: valor is defined, valor is not none, valor is number ...
+
+_WRAPPED = re.compile(r"^\s*\{\{(.*)\}\}\s*$", re.DOTALL)
+
+
+class ExpressionError(Exception):
+    """Expressão inválida (na compilação) ou que falhou ao ser avaliada."""
+
+
+class _Missing:
+    """Marca de chave/atributo inexistente (equivalente ao Undefined do Jinja2)."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def _n(value):
+    return None if value is MISSING else value
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _default(value, default_value="", boolean=False):
+    if value is MISSING or value is None or (boolean and not value):
+        return default_value
+    return value
+
+
+FILTERS = {
+    "int": _to_int,
+    "float": _to_float,
+    "string": lambda v: "" if v is MISSING else str(v),
+    "str": lambda v: "" if v is MISSING else str(v),
+    "bool": lambda v: bool(_n(v)),
+    "lower": lambda v: str(_n(v) or "").lower(),
+    "upper": lambda v: str(_n(v) or "").upper(),
+    "trim": lambda v: str(_n(v) or "").strip(),
+    "length": lambda v: len(_n(v) or ()),
+    "count": lambda v: len(_n(v) or ()),
+    "abs": lambda v: abs(_n(v)),
+    "round": lambda v, precision=0: round(_n(v), precision),
+    "default": _default,
+    "d": _default,
+}
+
+TESTS = {
+    "defined": lambda v: v is not MISSING,
+    "undefined": lambda v: v is MISSING,
+    "none": lambda v: v is None,
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+    "mapping": lambda v: isinstance(v, Mapping),
+    "sequence": lambda v: isinstance(v, (list, tuple, str)),
+    "boolean": lambda v: isinstance(v, bool),
+    "true": lambda v: v is True,
+    "false": lambda v: v is False,
+    "even": lambda v: _to_int(v) % 2 == 0,
+    "odd": lambda v: _to_int(v) % 2 == 1,
+}
+
+_CONSTANT_NAMES = {"True": True, "False": False, "None": None,
+                   "true": True, "false": False, "none": None}
+
+_BIN_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+}
+
+_CMP_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_, ast.IsNot: operator.is_not,
+}
+
+
+def _get_attr(obj, name):
+    if obj is MISSING or obj is None:
+        return MISSING
+    if isinstance(obj, Mapping):
+        return obj.get(name, MISSING)
+    return getattr(obj, name, MISSING)
+
+
+def _get_item(obj, key):
+    if obj is MISSING or obj is None:
+        return MISSING
+    try:
+        return obj[key]
+    except (KeyError, IndexError, TypeError):
+        # Mesmo comportamento do Jinja2: tenta como atributo antes de desistir (exceto
+        # privados: `x["__class__"]` não pode contornar a regra de `x.__class__`)
+        if isinstance(key, str) and not key.startswith("_"):
+            return _get_attr(obj, key)
+        return MISSING
+
+
+class CompiledExpression:
+    """Expressão pronta para ser avaliada contra o contexto do fluxo."""
+
+    __slots__ = ("source", "_fn")
+
+    def __init__(self, source: str, fn: Callable[[Any], Any]):
+        self.source = source
+        self._fn = fn
+
+    def evaluate(self, context: Any) -> Any:
+        try:
+            return _n(self._fn(context))
+        except ExpressionError:
+            raise
+        except Exception as e:
+            raise ExpressionError(f"Erro ao avaliar '{self.source}': {e}") from e
+
+    def __repr__(self):
+        return f"CompiledExpression({self.source!r})"
+
+
+def _filter_call(node: ast.AST):
+    """Converte o lado direito de `valor | filtro(...)` em (função, args)."""
+    if isinstance(node, ast.Name):
+        name, args = node.id, []
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        name, args = node.func.id, [_compile(arg) for arg in node.args]
+    else:
+        raise ExpressionError(f"Filtro inválido: {ast.dump(node)}")
+    if name not in FILTERS:
+        raise ExpressionError(f"Filtro desconhecido: '{name}'")
+    return FILTERS[name], args
+
+
+# Precedência dos operadores aritméticos (a do Jinja2, igual à do Python)
+_ARITH_PRECEDENCE = {
+    ast.Add: 1, ast.Sub: 1,
+    ast.Mult: 2, ast.Div: 2, ast.FloorDiv: 2, ast.Mod: 2,
+}
+
+
+def _is_chain(node: ast.AST) -> bool:
+    return isinstance(node, ast.BinOp) and (isinstance(node.op, ast.BitOr) or type(node.op) in _BIN_OPS)
+
+
+def _flatten_chain(node: ast.BinOp, items: list):
+    """
+    Achata `a + b | int * 2` em [a, +, b, |, int, *, 2], na ordem do texto.
+
+    Subexpressões entre parênteses continuam como um operando só: o `ast` não guarda os
+    parênteses, mas um filho parentizado não começa (à esquerda) ou não termina (à direita)
+    no mesmo ponto que o pai.
+    """
+    left, right = node.left, node.right
+    if _is_chain(left) and (left.lineno, left.col_offset) == (node.lineno, node.col_offset):
+        _flatten_chain(left, items)
+    else:
+        items.append(left)
+    items.append(node.op)
+    if _is_chain(right) and (right.end_lineno, right.end_col_offset) == (node.end_lineno, node.end_col_offset):
+        _flatten_chain(right, items)
+    else:
+        items.append(right)
+
+
+def _apply_filter(value: Callable[[Any], Any], node: ast.AST) -> Callable[[Any], Any]:
+    fn, args = _filter_call(node)
+    return lambda ctx: fn(value(ctx), *[_n(arg(ctx)) for arg in args])
+
+
+def _binary(op, left: Callable[[Any], Any], right: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    return lambda ctx: op(_n(left(ctx)), _n(right(ctx)))
+
+
+def _compile_chain(node: ast.BinOp) -> Callable[[Any], Any]:
+    """
+    Compila uma cadeia aritmética com filtros usando a precedência do Jinja2.
+
+    Em Python `|` tem precedência menor que `+` e `*` (`a + b | int` é `(a + b) | int`); no
+    Jinja2 o filtro se liga só ao operando imediatamente à esquerda, antes de qualquer
+    operador: `a + (b | int)`. A cadeia é achatada, os filtros aplicados aos operandos e
+    a árvore remontada com `* / // %` antes de `+ -`.
+    """
+    items = []
+    _flatten_chain(node, items)
+    operands = [_compile(items[0])]
+    ops = []
+    for op, operand in zip(items[1::2], items[2::2]):
+        if isinstance(op, ast.BitOr):
+            operands[-1] = _apply_filter(operands[-1], operand)
+        else:
+            ops.append(type(op))
+            operands.append(_compile(operand))
+
+    # Remonta por nível de precedência, da maior para a menor (associatividade à esquerda)
+    for level in (2, 1):
+        merged_operands, merged_ops = [operands[0]], []
+        for op, operand in zip(ops, operands[1:]):
+            if _ARITH_PRECEDENCE[op] == level:
+                merged_operands[-1] = _binary(_BIN_OPS[op], merged_operands[-1], operand)
+            else:
+                merged_ops.append(op)
+                merged_operands.append(operand)
+        operands, ops = merged_operands, merged_ops
+    return operands[0]
+
+
+def _compile(node: ast.AST) -> Callable[[Any], Any]:
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda ctx: value
+
+    if isinstance(node, ast.Name):
+        if node.id == "context":
+            return lambda ctx: ctx
+        if node.id in _CONSTANT_NAMES:
+            value = _CONSTANT_NAMES[node.id]
+            return lambda ctx: value
+        raise ExpressionError(f"Nome desconhecido: '{node.id}' (use 'context.{node.id}')")
+
+    if isinstance(node, ast.Attribute):
+        if node.attr.startswith("_"):
+            raise ExpressionError(f"Acesso a atributo privado não permitido: '{node.attr}'")
+        target, name = _compile(node.value), node.attr
+        return lambda ctx: _get_attr(target(ctx), name)
+
+    if isinstance(node, ast.Subscript):
+        if (isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)
+                and node.slice.value.startswith("_")):
+            raise ExpressionError(f"Acesso a atributo privado não permitido: '{node.slice.value}'")
+        target, key = _compile(node.value), _compile(node.slice)
+        return lambda ctx: _get_item(target(ctx), _n(key(ctx)))
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        items = [_compile(elt) for elt in node.elts]
+        return lambda ctx: [_n(item(ctx)) for item in items]
+
+    if _is_chain(node):
+        return _compile_chain(node)
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile(node.operand)
+        if isinstance(node.op, ast.Not):
+            return lambda ctx: not _n(operand(ctx))
+        if isinstance(node.op, ast.USub):
+            return lambda ctx: -_n(operand(ctx))
+        if isinstance(node.op, ast.UAdd):
+            return lambda ctx: +_n(operand(ctx))
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile(v) for v in node.values]
+        if isinstance(node.op, ast.And):
+            def _and(ctx):
+                result = True
+                for v in values:
+                    result = _n(v(ctx))
+                    if not result:
+                        return result
+                return result
+            return _and
+
+        def _or(ctx):
+            result = False
+            for v in values:
+                result = _n(v(ctx))
+                if result:
+                    return result
+            return result
+        return _or
+
+    if isinstance(node, ast.Compare):
+        return _compile_compare(node)
+
+    raise ExpressionError(f"Construção não suportada: {type(node).__name__}")
+
+
+def _compile_compare(node: ast.Compare) -> Callable[[Any], Any]:
+    left = _compile(node.left)
+    steps = []
+    for op, comparator in zip(node.ops, node.comparators):
+        # `x is defined` / `x is not none`: testes estilo Jinja2
+        if isinstance(op, (ast.Is, ast.IsNot)) and isinstance(comparator, ast.Name) \
+                and comparator.id.lower() in TESTS:
+            test = TESTS[comparator.id.lower()]
+            negate = isinstance(op, ast.IsNot)
+            steps.append(("test", test, negate))
+        else:
+            steps.append(("cmp", _CMP_OPS[type(op)], _compile(comparator)))
+
+    def _cmp(ctx):
+        current = left(ctx)
+        for kind, fn, arg in steps:
+            if kind == "test":
+                if fn(current) == arg:
+                    return False
+                continue
+            right = arg(ctx)
+            if not fn(_n(current), _n(right)):
+                return False
+            current = right
+        return True
+    return _cmp
+
+
+def compile_expression(source: str) -> CompiledExpression:
+    """
+    Compila uma condição do fluxo. Aceita a forma Jinja2 (`{{ expr }}`) ou a expressão pura.
+    """
+    if not isinstance(source, str):
+        # Valor literal no JSON (ex: "condition": true)
+        return CompiledExpression(repr(source), lambda ctx: source)
+
+    match = _WRAPPED.match(source)
+    expr = (match.group(1) if match else source).strip()
+    if "{{" in expr or "{%" in expr:
+        raise ExpressionError(f"Expressão com template misto não é suportada: '{source}'")
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"Sintaxe inválida em '{source}': {e.msg}") from e
+    return CompiledExpression(source, _compile(tree.body))
@@ -0,0 +1,502 @@
+from collections import deque
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Tuple
+
+from expressions import ExpressionError, compile_expression
+from json_projection import ProjectionError, build_trie
+from node_registry import BUILTIN_EXECUTORS, node_types
+from templates import compile_data, context_references, is_templated
+
+# Validação e compilação estática de uma definição de fluxo.
+#
+# `compile_flow` roda uma vez por versão do fluxo (no carregamento) e rejeita o que
+# hoje só apareceria no meio de uma sessão: tipos desconhecidos, destinos inexistentes,
+# nós inalcançáveis e ciclos sem saída. O resultado é um `ExecutionPlan` imutável
+# (adjacência, nó de entrada, chaves lidas/escritas por nó) que o engine consome.
+
+# Tipos embutidos; os válidos num fluxo são os do registro de executores (inclui plugins)
+NODE_TYPES = tuple(BUILTIN_EXECUTORS)
+# Nós cuja transição é decidida pela ação (aresta condicional no grafo)
+CONDITIONAL_TYPES = ("if-else", "switch-case")
+# Tipos aceitos como corpo de um `map` (executados uma vez por item, sem interrupt)
+MAP_BODY_TYPES = ("api", "llm", "fixed")
+# Tipos que podem ser ramos de um `parallel`: precisam rodar sem interrupt e
+# sem decidir transições (o destino de todo ramo é o join).
+BRANCH_NODE_TYPES = ("api", "llm", "fixed", "map")
+# Nós que podem ser adiantados enquanto a sessão espera o usuário num `output`
+# (ver `_prefetch_chains`); `fixed` só é simulado, sem efeito externo
+SPECULATIVE_TYPES = ("api", "llm")
+SIMULATED_TYPES = ("api", "llm", "fixed")
+# Nós que podem desviar para `on_error` quando a chamada ao upstream falha
+ERROR_ROUTED_TYPES = ("api", "llm")
+# Modos de renderização dos templates (`"render"` no fluxo; ver templates.py)
+RENDER_MODES = ("string", "native")
+# Campos de `action_config` que continuam texto no modo nativo (o upstream espera string)
+TEXT_FIELDS = ("url", "method", "headers", "prompt", "message")
+# Chave do contexto com o erro ({"node", "error", ...}) que desviou para `on_error`
+ERROR_KEY = "last_error"
+# Métodos HTTP adiantados por padrão (sem efeito colateral no upstream)
+SAFE_METHODS = ("GET", "HEAD")
+# Campos obrigatórios de `action_config` por tipo
+REQUIRED_FIELDS = {
+    "api": ("url",),
+    "llm": ("prompt",),
+    "if-else": ("condition", "true_node", "false_node"),
+    "switch-case": ("variable",),
+    "map": ("items", "body"),
+    "parallel": ("branches",),
+    "subflow": ("flow",),
+}
+
+# Destino "fim do fluxo" na adjacência
+EXIT = "__exit__"
+# Leitura do contexto inteiro (ex: `{{ context }}`), nos conjuntos de leitura
+ANY_KEY = "*"
+# Chaves que a API injeta no contexto inicial de toda sessão
+INITIAL_KEYS = frozenset({"user_id"})
+
+
+class FlowValidationError(ValueError):
+    """Definição de fluxo rejeitada; `issues` lista todos os problemas encontrados."""
+
+    def __init__(self, issues: Iterable[str]):
+        self.issues = list(issues)
+        super().__init__("Fluxo inválido:\n- " + "\n- ".join(self.issues))
+
+
+def map_body_id(node_id: str) -> str:
+    return f"{node_id}#body"
+
+
+class ExecutionPlan:
+    """
+    Plano imutável de uma versão do fluxo.
+
+    - `entry`: primeiro nó; `order`: nós do grafo na ordem declarada.
+    - `nodes`: id -> definição (inclui os corpos internos de `map`, `<id>#body`).
+    - `successors`: id -> destinos possíveis (`EXIT` = fim do fluxo).
+    - `dynamic`: nós de desvio com destino templado (resolvido só na execução).
+    - `branch_of` (ramo -> parallel) e `join_branches` (join -> ramos).
+    - `reads`, `writes`, `removes`: chaves de primeiro nível do contexto por nó;
+      `action_reads` é o subconjunto de `reads` lido antes da ação (pre_update e action_config).
+    - `prefetch`: nó output -> nós seguintes que não dependem da resposta do usuário,
+      como pares (id, modo) com modo `run` (adiantar a ação), `simulate` ou `skip`.
+    - `subflows`: nomes dos fluxos chamados por nós `subflow` (na ordem declarada).
+    - `warnings`: problemas que não impedem a execução (ex: chave lida e nunca escrita).
+    """
+
+    __slots__ = ("entry", "order", "nodes", "successors", "dynamic", "branch_of", "join_branches",
+                 "reads", "action_reads", "writes", "removes", "prefetch", "subflows", "warnings")
+
+    def __init__(self, **fields: Any):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExecutionPlan é imutável")
+
+    def __repr__(self):
+        return f"ExecutionPlan(entry={self.entry!r}, nodes={len(self.order)})"
+
+
+def key_mapping(spec: Any) -> Dict[str, str]:
+    """`input`/`output` de um nó subflow: lista de chaves (mesmo nome) ou {destino: origem}."""
+    if isinstance(spec, list):
+        return {key: key for key in spec}
+    return dict(spec or {})
+
+
+def _frozen(mapping: Dict[str, Iterable]) -> Mapping[str, FrozenSet[str]]:
+    return MappingProxyType({key: frozenset(values) for key, values in mapping.items()})
+
+
+def _template_reads(data: Any, exclude: Iterable[str] = ()) -> Set[str]:
+    """Chaves de primeiro nível de `context` lidas pelos templates de `data`."""
+    keys = set()
+    for chain in context_references(compile_data(data)):
+        if not chain:
+            keys.add(ANY_KEY)
+        elif isinstance(chain[0], str) and chain[0] not in exclude:
+            keys.add(chain[0])
+    return keys
+
+
+def _expression_reads(source: Any) -> Set[str]:
+    """Mesmo que `_template_reads`, para expressões tipadas (sintaxe compatível com Jinja2)."""
+    if not isinstance(source, str):
+        return set()
+    return _template_reads(source if is_templated(source) else "{{ %s }}" % source)
+
+
+def _targets(node: dict, issues: List[str]) -> Tuple[List[Any], bool]:
+    """(destinos declarados, destino templado?) de um nó, sem checar se existem."""
+    node_type = node["type"]
+    action_config = node.get("action_config") or {}
+    fallback = node.get("next") or EXIT
+    if node_type == "if-else":
+        targets = [action_config.get("true_node"), action_config.get("false_node")]
+        for label, target in zip(("true_node", "false_node"), targets):
+            if not target:
+                issues.append(f"Nó if-else '{node['id']}' sem '{label}'.")
+    elif node_type == "switch-case":
+        cases = action_config.get("cases") or {}
+        if not isinstance(cases, dict):
+            issues.append(f"Nó switch-case '{node['id']}': 'cases' deve ser um objeto.")
+            cases = {}
+        # Sem case correspondente nem default, segue o `next` (ou encerra)
+        targets = list(cases.values()) + [action_config.get("default") or fallback]
+    elif node_type == "parallel":
+        targets = list(action_config.get("branches") or [])
+    else:
+        targets = [fallback]
+        # `on_error` vem depois do `next`: o primeiro destino continua sendo o caminho normal
+        if node_type in ERROR_ROUTED_TYPES and node.get("on_error"):
+            targets.append(node["on_error"])
+    # Só os desvios resolvem o destino na execução; nos demais a aresta do grafo é fixa
+    dynamic = node_type in CONDITIONAL_TYPES and any(isinstance(t, str) and is_templated(t) for t in targets)
+    return [t for t in targets if t], dynamic
+
+
+def _check_node(node: dict, issues: List[str]):
+    """Campos obrigatórios e trechos que já podem ser compilados (expressões, extract)."""
+    node_id, node_type = node["id"], node["type"]
+    action_config = node.get("action_config") or {}
+    for field in REQUIRED_FIELDS.get(node_type, ()):
+        if action_config.get(field) in (None, "", [], {}):
+            issues.append(f"Nó {node_type} '{node_id}' sem 'action_config.{field}'.")
+    if node.get("on_error") and node_type not in ERROR_ROUTED_TYPES:
+        issues.append(f"Nó {node_type} '{node_id}': 'on_error' só vale em nós {', '.join(ERROR_ROUTED_TYPES)}.")
+    expression_field = {"if-else": "condition", "switch-case": "variable", "map": "items"}.get(node_type)
+    if expression_field and expression_field in action_config:
+        try:
+            compile_expression(action_config[expression_field])
+        except ExpressionError as e:
+            issues.append(f"Nó '{node_id}': {e}")
+    if node_type == "subflow":
+        _check_subflow(node_id, action_config, issues)
+    extract = action_config.get("extract")
+    if node_type == "api" and extract and extract != "auto":
+        try:
+            build_trie(extract)
+        except (ProjectionError, TypeError) as e:
+            issues.append(f"Nó '{node_id}': 'extract' inválido ({e}).")
+
+
+def _check_subflow(node_id: str, action_config: dict, issues: List[str]):
+    # O fluxo filho é resolvido e compilado junto com o pai: o nome não pode ser templado
+    flow = action_config.get("flow")
+    if flow is not None and (not isinstance(flow, str) or is_templated(flow)):
+        issues.append(f"Nó subflow '{node_id}': 'flow' deve ser o nome fixo de um fluxo.")
+    for field in ("input", "output"):
+        spec = action_config.get(field)
+        if spec is None:
+            continue
+        if isinstance(spec, list):
+            keys = [(key, key) for key in spec]
+        elif isinstance(spec, dict):
+            keys = list(spec.items())
+        else:
+            keys = None
+        if keys is None or not all(isinstance(k, str) and isinstance(v, str) and k and v for k, v in keys):
+            issues.append(f"Nó subflow '{node_id}': '{field}' deve ser uma lista de chaves ou um objeto "
+                          "{chave de destino: chave de origem}.")
+
+
+def _map_body(node: dict, issues: List[str]) -> Optional[dict]:
+    body = (node.get("action_config") or {}).get("body")
+    if not isinstance(body, dict) or body.get("type") not in MAP_BODY_TYPES:
+        issues.append(f"Nó map '{node['id']}' precisa de 'body' com 'type' em: {', '.join(MAP_BODY_TYPES)}.")
+        return None
+    if body.get("on_error"):
+        issues.append(f"Corpo do map '{node['id']}' não pode ter 'on_error' (use 'mode': 'collect_errors').")
+    return {**body, "id": map_body_id(node["id"])}
+
+
+def _index_parallel_nodes(nodes: Dict[str, dict], issues: List[str]):
+    branch_of, join_branches = {}, {}
+    for node in nodes.values():
+        if node["type"] != "parallel":
+            continue
+        branches = (node.get("action_config") or {}).get("branches") or []
+        join_id = node.get("next")
+        if join_id not in nodes or nodes[join_id]["type"] != "join":
+            issues.append(f"Nó parallel '{node['id']}' deve ter 'next' apontando para um nó 'join'.")
+            continue
+        if join_id in join_branches:
+            issues.append(f"Nó join '{join_id}' é destino de mais de um parallel.")
+            continue
+        for branch in branches:
+            if branch not in nodes:
+                continue  # reportado na checagem de destinos
+            if nodes[branch]["type"] not in BRANCH_NODE_TYPES:
+                issues.append(
+                    f"Ramo '{branch}' do parallel '{node['id']}' tem tipo "
+                    f"'{nodes[branch]['type']}'; permitidos: {', '.join(BRANCH_NODE_TYPES)}."
+                )
+            if nodes[branch].get("on_error"):
+                # O destino de todo ramo é o join; o erro vai para branch_results
+                issues.append(f"Ramo '{branch}' do parallel '{node['id']}' não pode ter 'on_error'.")
+            if branch in branch_of:
+                issues.append(f"Nó '{branch}' é ramo de mais de um parallel.")
+            branch_of[branch] = node["id"]
+        join_branches[join_id] = tuple(branches)
+    return branch_of, join_branches
+
+
+def _reachable(start: Iterable[str], edges: Mapping[str, Iterable[str]]) -> Set[str]:
+    seen = set(start)
+    queue = deque(seen)
+    while queue:
+        for target in edges.get(queue.popleft(), ()):
+            if target not in seen:
+                seen.add(target)
+                queue.append(target)
+    return seen
+
+
+def _cyclic(nodes: Set[str], edges: Mapping[str, Iterable[str]]) -> Set[str]:
+    """Nós de `nodes` que estão em (ou só levam a) um ciclo dentro do próprio conjunto (Kahn reverso)."""
+    out_degree = {n: sum(1 for t in edges.get(n, ()) if t in nodes) for n in nodes}
+    predecessors: Dict[str, List[str]] = {n: [] for n in nodes}
+    for n in nodes:
+        for t in edges.get(n, ()):
+            if t in nodes:
+                predecessors[t].append(n)
+    queue = deque(n for n, degree in out_degree.items() if degree == 0)
+    remaining = set(nodes)
+    while queue:
+        n = queue.popleft()
+        remaining.discard(n)
+        for p in predecessors[n]:
+            out_degree[p] -= 1
+            if out_degree[p] == 0:
+                queue.append(p)
+    return remaining
+
+
+def _data_flow(node: dict, body: Optional[dict]) -> Tuple[Set[str], Set[str], Set[str], Set[str]]:
+    """
+    (lidas até a ação, lidas no post_update, escritas, removidas) por um nó, a partir
+    dos templates e da semântica do tipo.
+    """
+    node_type = node["type"]
+    action_config = dict(node.get("action_config") or {})
+    reads = _template_reads(node.get("pre_update", {}))
+    for field in ("condition", "variable", "items"):
+        if node_type in ("if-else", "switch-case", "map") and field in action_config:
+            reads |= _expression_reads(action_config.pop(field))
+    action_config.pop("body", None)
+    reads |= _template_reads(action_config)
+    # `context.result` no post_update é o resultado da ação, não uma chave do contexto
+    post_reads = _template_reads(node.get("post_update", {}), exclude=("result",))
+    writes = set(node.get("pre_update", {})) | set(node.get("post_update", {}))
+    removes = set(node.get("pre_remove", [])) | set(node.get("post_remove", []))
+
+    if node_type == "output":
+        # A resposta do usuário (resume do interrupt) entra em `user_inputs`
+        writes.add("user_inputs")
+    elif node_type in ERROR_ROUTED_TYPES and node.get("on_error"):
+        # Desvio para `on_error`: o erro vai para `last_error` no lugar do post_update
+        writes.add(ERROR_KEY)
+    elif node_type == "subflow":
+        # Chaves copiadas do contexto do pai para o filho e, no fim, do filho para o pai
+        reads |= set(key_mapping(action_config.get("input")).values())
+        writes |= set(key_mapping(action_config.get("output")))
+    elif node_type == "map" and body is not None:
+        local = (action_config.get("item_var", "item"), "index")
+        reads |= _template_reads(body.get("action_config", {}), exclude=local)
+        reads |= _template_reads(body.get("output", {}), exclude=local + ("result",))
+        target = action_config.get("target")
+        if isinstance(target, str) and not is_templated(target):
+            writes.add(target)
+    return reads, post_reads, writes, removes
+
+
+def _speculable(node: dict) -> bool:
+    """`speculate` no nó decide; sem ele, llm sempre e api só com método seguro."""
+    if node["type"] not in SPECULATIVE_TYPES:
+        return False
+    if node.get("speculate") is not None:
+        return bool(node["speculate"])
+    if node["type"] == "api":
+        method = (node.get("action_config") or {}).get("method", "GET")
+        return isinstance(method, str) and method.upper() in SAFE_METHODS
+    return True
+
+
+def _prefetch_chains(order: Tuple[str, ...], nodes: Dict[str, dict], successors: Mapping[str, Tuple[str, ...]],
+                     action_reads: Mapping[str, FrozenSet[str]], reads: Mapping[str, FrozenSet[str]],
+                     writes: Mapping[str, FrozenSet[str]],
+                     removes: Mapping[str, FrozenSet[str]]) -> Dict[str, Tuple[Tuple[str, str], ...]]:
+    """
+    Para cada nó `output`, segue a cadeia linear de nós seguintes (até um desvio,
+    parallel, map ou outro output) e marca as ações que não leem nada que dependa da
+    resposta do usuário: a resposta entra em `user_inputs` e no post_update do output,
+    e tudo o que um nó escreve a partir de algo dependente passa a depender dela também.
+    """
+    def dependent(keys: FrozenSet[str], tainted: Set[str]) -> bool:
+        return ANY_KEY in keys or bool(keys & tainted)
+
+    chains = {}
+    for output_id in order:
+        if nodes[output_id]["type"] != "output":
+            continue
+        tainted = {"user_inputs"} | writes[output_id] | removes[output_id]
+        chain: List[Tuple[str, str]] = []
+        seen = {output_id}
+        node_id = successors[output_id][0]
+        while node_id != EXIT and node_id not in seen and nodes[node_id]["type"] in SIMULATED_TYPES:
+            seen.add(node_id)
+            if dependent(action_reads[node_id], tainted):
+                mode = "skip"
+            elif nodes[node_id]["type"] == "fixed":
+                mode = "simulate"
+            else:
+                mode = "run" if _speculable(nodes[node_id]) else "skip"
+            if mode == "skip" or dependent(reads[node_id], tainted):
+                tainted |= writes[node_id] | removes[node_id]
+            chain.append((node_id, mode))
+            node_id = successors[node_id][0]
+        while chain and chain[-1][1] != "run":
+            chain.pop()
+        if chain:
+            chains[output_id] = tuple(chain)
+    return chains
+
+
+def compile_flow(flow_config: Any) -> ExecutionPlan:
+    """Valida a definição inteira e devolve o plano; levanta `FlowValidationError` com todos os problemas."""
+    issues: List[str] = []
+    raw_nodes = flow_config.get("nodes") if isinstance(flow_config, dict) else None
+    if not isinstance(raw_nodes, list) or not raw_nodes:
+        raise FlowValidationError(["A definição precisa de uma lista 'nodes' não vazia."])
+
+    deadline_ms = flow_config.get("deadline_ms")
+    if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                                    or deadline_ms <= 0):
+        issues.append("'deadline_ms' deve ser um número positivo (milissegundos).")
+
+    if flow_config.get("render", "string") not in RENDER_MODES:
+        issues.append(f"'render' deve ser um de: {', '.join(RENDER_MODES)}.")
+
+    inputs = flow_config.get("inputs") or []
+    if not isinstance(inputs, list) or not all(isinstance(key, str) for key in inputs):
+        issues.append("'inputs' deve ser uma lista de chaves do contexto.")
+        inputs = []
+
+    nodes: Dict[str, dict] = {}
+    for position, node in enumerate(raw_nodes):
+        if not isinstance(node, dict) or not node.get("id"):
+            issues.append(f"Nó na posição {position} precisa ser um objeto com 'id'.")
+            continue
+        if node["id"] in nodes:
+            issues.append(f"Id de nó duplicado: '{node['id']}'.")
+            continue
+        if node.get("type") not in node_types():
+            issues.append(f"Nó '{node['id']}' tem tipo desconhecido '{node.get('type')}'; "
+                          f"tipos válidos: {', '.join(node_types())}.")
+        nodes[node["id"]] = node
+    if issues:
+        raise FlowValidationError(issues)
+
+    order = tuple(nodes)
+    entry = order[0]
+    successors: Dict[str, Tuple[str, ...]] = {}
+    dynamic = set()
+    bodies: Dict[str, dict] = {}
+    for node_id, node in nodes.items():
+        _check_node(node, issues)
+        targets, is_dynamic = _targets(node, issues)
+        if is_dynamic:
+            dynamic.add(node_id)
+        for target in targets:
+            if target != EXIT and target not in nodes and not (is_dynamic and is_templated(str(target))):
+                issues.append(f"Nó '{node_id}' aponta para '{target}', que não existe.")
+        successors[node_id] = tuple(dict.fromkeys(t for t in targets if t == EXIT or t in nodes))
+        if node["type"] == "map":
+            body = _map_body(node, issues)
+            if body is not None:
+                bodies[body["id"]] = body
+
+    branch_of, join_branches = _index_parallel_nodes(nodes, issues)
+    for branch, parallel_id in branch_of.items():
+        # Todo ramo segue para o join do seu parallel
+        successors[branch] = (nodes[parallel_id]["next"],)
+
+    # Alcance a partir da entrada. Um desvio templado pode ir para qualquer nó,
+    # então nesse caso nada é considerado inalcançável nem preso.
+    reachable = _reachable([entry], successors)
+    if not dynamic & reachable:
+        unreachable = [n for n in order if n not in reachable]
+        if unreachable:
+            issues.append(f"Nós inalcançáveis a partir de '{entry}': {', '.join(unreachable)}.")
+
+        # Nós que nunca chegam ao fim: um ciclo entre eles só é aceito se passar por
+        # um `output` (conversa que espera o usuário a cada volta); sem isso é um loop infinito.
+        predecessors: Dict[str, List[str]] = {EXIT: []}
+        for node_id, targets in successors.items():
+            for target in targets:
+                predecessors.setdefault(target, []).append(node_id)
+        trapped = reachable - _reachable([EXIT], predecessors)
+        looping = _cyclic({n for n in trapped if nodes[n]["type"] != "output"}, successors)
+        if looping:
+            issues.append("Ciclo sem saída e sem nó output (loop infinito): "
+                          + ", ".join(n for n in order if n in looping) + ".")
+
+    if issues:
+        raise FlowValidationError(issues)
+
+    action_reads, reads, writes, removes = {}, {}, {}, {}
+    for node_id, node in nodes.items():
+        flow = _data_flow(node, bodies.get(map_body_id(node_id)))
+        action_reads[node_id], writes[node_id], removes[node_id] = flow[0], flow[2], flow[3]
+        reads[node_id] = flow[0] | flow[1]
+
+    warnings = []
+    # `inputs` no topo declara as chaves recebidas de quem chama o fluxo como subflow
+    written = set(INITIAL_KEYS).union(inputs, *writes.values())
+    for node_id in order:
+        for key in sorted(reads[node_id] - written - {ANY_KEY}):
+            warnings.append(f"Nó '{node_id}' lê 'context.{key}', que nenhum nó escreve.")
+    action_reads, reads = _frozen(action_reads), _frozen(reads)
+    writes, removes = _frozen(writes), _frozen(removes)
+
+    return ExecutionPlan(
+        entry=entry,
+        order=order,
+        nodes=MappingProxyType({**nodes, **bodies}),
+        successors=MappingProxyType(successors),
+        dynamic=frozenset(dynamic),
+        branch_of=MappingProxyType(branch_of),
+        join_branches=MappingProxyType(join_branches),
+        reads=reads,
+        action_reads=action_reads,
+        writes=writes,
+        removes=removes,
+        prefetch=MappingProxyType(_prefetch_chains(order, nodes, successors, action_reads, reads, writes, removes)),
+        subflows=tuple(dict.fromkeys(node["action_config"]["flow"] for node in nodes.values()
+                                     if node["type"] == "subflow")),
+        warnings=tuple(warnings),
+    )
+
+
+if __name__ == "__main__":
+    # Validação offline: python flow_plan.py flow_definition.json
+    import json
+    import sys
+
+    for path in sys.argv[1:]:
+        with open(path, encoding="utf-8") as f:
+            try:
+                plan = compile_flow(json.load(f))
+            except FlowValidationError as e:
+                print(f"{path}: {e}")
+                sys.exit(1)
+        print(f"{path}: ok (entrada '{plan.entry}', {len(plan.order)} nós)")
+        for node_id in plan.order:
+            print(f"  {node_id} -> {', '.join(plan.successors[node_id])}"
+                  f" | lê {sorted(plan.reads[node_id])} | escreve {sorted(plan.writes[node_id])}")
+        for output_id, chain in plan.prefetch.items():
+            print(f"  adiantáveis em {output_id}: " + ", ".join(f"{n} ({mode})" for n, mode in chain))
+        for warning in plan.warnings:
+            print(f"  aviso: {warning}")
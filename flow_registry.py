@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from flow_plan import ExecutionPlan, FlowValidationError, compile_flow
+from graph_cache import CompiledGraphCache, flow_digest
+from telemetry import logger
+
+# Registro das definições de fluxo (arquivos `<nome>.json` de um diretório).
+#
+# - Um arquivo é lido na primeira requisição e, a partir daí, acompanhado por polling
+#   (mtime + tamanho; o hash do conteúdo decide se houve mudança de fato).
+# - Uma alteração é relida, validada e compilada em background; só então a versão
+#   atual do fluxo é trocada (uma atribuição de dict). Se algo falhar, a versão
+#   anterior continua servindo e o erro fica em `stats()`.
+# - As versões anteriores ficam guardadas (`keep_versions` por fluxo) para que sessões
+#   paradas num `interrupt()` retomem na versão em que começaram.
+# - Fluxos chamados por nós `subflow` são carregados junto com o pai e fazem parte da
+#   versão dele: o hash do pai inclui o dos filhos, então editar um filho publica uma
+#   versão nova do pai, e sessões paradas dentro do filho retomam no filho antigo.
+
+
+class FlowNotFound(Exception):
+    """Nome inválido ou arquivo inexistente no diretório de fluxos."""
+
+
+class FlowDefinitionError(Exception):
+    """Arquivo de fluxo ilegível, com JSON inválido ou que não compila."""
+
+
+class FlowVersion:
+    """
+    Uma versão imutável de uma definição de fluxo (identificada pelo hash do conteúdo
+    e das versões dos subfluxos, que ficam fixadas em `subflows`).
+    """
+
+    __slots__ = ("name", "digest", "config", "subflows", "loaded_at")
+
+    def __init__(self, name: str, digest: str, config: dict, subflows: Dict[str, "FlowVersion"] = None):
+        self.name = name
+        self.digest = digest
+        self.config = config
+        self.subflows = subflows or {}
+        self.loaded_at = time.time()
+
+
+def normalize_flow_name(flow_name: str) -> str:
+    """`flow_definition.json` e `flow_definition` -> `flow_definition`; rejeita caminhos."""
+    name = flow_name[:-5] if flow_name.endswith(".json") else flow_name
+    if not name or name.startswith(".") or "/" in name or "\\" in name or "\x00" in name:
+        raise FlowNotFound(f"Flow definition '{flow_name}' not found.")
+    return name
+
+
+def validate_flow_config(flow_config: Any) -> ExecutionPlan:
+    """Validação estática completa (`flow_plan.compile_flow`) antes de compilar o grafo."""
+    try:
+        return compile_flow(flow_config)
+    except FlowValidationError as e:
+        raise FlowDefinitionError(str(e))
+
+
+class FlowRegistry:
+    """
+    Versões carregadas dos fluxos de `directory`, com recarga a quente.
+
+    `builder(name, config, subflows)` compila o grafo de uma versão; o resultado fica no
+    `graph_cache` sob (nome, hash), então a troca de versão não recompila nada
+    que já esteja em cache e a versão nova já chega compilada à primeira requisição.
+    `subflows(nome)` devolve o grafo compilado (também do cache) de um subfluxo da versão.
+    """
+
+    def __init__(self, directory: str, graph_cache: CompiledGraphCache,
+                 builder: Callable[[str, dict, Callable[[str], Awaitable[Any]]], Awaitable[Any]],
+                 poll_interval: float = 2.0, keep_versions: int = 5):
+        self.directory = directory
+        self.graph_cache = graph_cache
+        self.builder = builder
+        self.poll_interval = poll_interval
+        self.keep_versions = max(1, int(keep_versions))
+
+        self._current: Dict[str, FlowVersion] = {}
+        # Histórico por fluxo (inclui a atual), do mais antigo para o mais novo
+        self._versions: Dict[str, "OrderedDict[str, FlowVersion]"] = {}
+        # (mtime_ns, tamanho) da última leitura de cada arquivo acompanhado
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        # Quantas corrotinas usam (ou esperam) o lock de cada fluxo
+        self._load_waiters: Dict[str, int] = {}
+        self._errors: Dict[str, str] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+        self.loads = 0
+        self.reloads = 0
+        self.reload_errors = 0
+        self.polls = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _stamp(self, name: str) -> Tuple[int, int]:
+        stat = os.stat(self._path(name))
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self, name: str) -> Tuple[Tuple[int, int], dict, ExecutionPlan]:
+        path = self._path(name)
+        try:
+            # O stamp é lido antes do conteúdo: uma escrita no meio gera um novo poll
+            stamp = self._stamp(name)
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except FileNotFoundError:
+            raise FlowNotFound(f"Flow definition '{name}.json' not found.")
+        except OSError as e:
+            raise FlowDefinitionError(f"Could not read '{name}.json': {e}")
+        try:
+            flow_config = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise FlowDefinitionError(f"Invalid JSON format in '{name}.json': {e}")
+        return stamp, flow_config, validate_flow_config(flow_config)
+
+    async def _load_subflows(self, name: str, plan: ExecutionPlan, stack: Tuple[str, ...]) -> Dict[str, FlowVersion]:
+        """Versões atuais dos subfluxos de `name` (carregando os que faltam)."""
+        subflows = {}
+        for child in plan.subflows:
+            if child == name or child in stack:
+                raise FlowDefinitionError(f"Subflow cycle: {' -> '.join(stack + (name, child))}.")
+            try:
+                child_name = normalize_flow_name(child)
+                # Sem o lock de `get`: dois pais carregando o mesmo filho no máximo leem o
+                # arquivo duas vezes (a compilação é deduplicada pelo graph_cache)
+                subflows[child] = self._current.get(child_name) or await self._load(child_name, stack + (name,))
+            except FlowNotFound:
+                raise FlowDefinitionError(f"Subflow '{child}' used by '{name}' not found.")
+            if self._calls(subflows[child], name):
+                # Filho já carregado que chama o pai (ex: filho editado para chamar o pai)
+                raise FlowDefinitionError(f"Subflow cycle: '{name}' -> '{child}' -> ... -> '{name}'.")
+        return subflows
+
+    @classmethod
+    def _calls(cls, version: FlowVersion, name: str) -> bool:
+        """Se a versão chama `name`, direta ou indiretamente."""
+        return any(child.name == name or cls._calls(child, name) for child in version.subflows.values())
+
+    async def _load(self, name: str, stack: Tuple[str, ...] = ()) -> FlowVersion:
+        """Lê, valida e compila o arquivo; só publica a versão se tudo der certo."""
+        stamp, flow_config, plan = await asyncio.to_thread(self._read, name)
+        subflows = await self._load_subflows(name, plan, stack)
+        digest = flow_digest(flow_config)
+        if subflows:
+            digest = flow_digest({"flow": digest, "subflows": {child: v.digest for child, v in subflows.items()}})
+        current = self._current.get(name)
+        if current is not None and current.digest == digest:
+            # Só o mtime mudou (ex: `touch`, editor que regrava o mesmo conteúdo)
+            self._stamps[name] = stamp
+            return current
+
+        version = self._versions.get(name, {}).get(digest) or FlowVersion(name, digest, flow_config, subflows)
+        try:
+            await self.compiled(version)
+        except Exception as e:
+            raise FlowDefinitionError(f"Error building flow graph: {e}")
+        self._publish(version)
+        self._stamps[name] = stamp
+        self._errors.pop(name, None)
+        return version
+
+    def _publish(self, version: FlowVersion):
+        history = self._versions.setdefault(version.name, OrderedDict())
+        history[version.digest] = version
+        history.move_to_end(version.digest)
+        while len(history) > self.keep_versions:
+            history.popitem(last=False)
+        previous = self._current.get(version.name)
+        # Troca atômica: requisições novas passam a ver a versão nova daqui em diante
+        self._current[version.name] = version
+        if previous is None:
+            self.loads += 1
+            logger.info("Fluxo '%s' carregado (versão %s)", version.name, version.digest[:12])
+        else:
+            self.reloads += 1
+            logger.info("Fluxo '%s' recarregado: %s -> %s", version.name,
+                        previous.digest[:12], version.digest[:12])
+
+    async def get(self, flow_name: str) -> FlowVersion:
+        """Versão atual do fluxo; carrega do disco na primeira vez."""
+        name = normalize_flow_name(flow_name)
+        version = self._current.get(name)
+        if version is not None:
+            return version
+        lock = self._load_locks.setdefault(name, asyncio.Lock())
+        self._load_waiters[name] = self._load_waiters.get(name, 0) + 1
+        try:
+            async with lock:
+                version = self._current.get(name)
+                if version is None:
+                    version = await self._load(name)
+        finally:
+            # Sai com o último usuário, também quando o fluxo não existe ou é inválido (senão
+            # cada nome pedido deixa um lock); antes disso quem chega ainda espera no mesmo lock
+            self._load_waiters[name] -= 1
+            if not self._load_waiters[name]:
+                del self._load_waiters[name]
+                self._load_locks.pop(name, None)
+        return version
+
+    def version(self, flow_name: str, digest: str) -> Optional[FlowVersion]:
+        """Uma versão específica ainda guardada (para sessões fixadas), ou None."""
+        return self._versions.get(normalize_flow_name(flow_name), {}).get(digest)
+
+    async def compiled(self, version: FlowVersion):
+        async def subflow(child: str):
+            # A versão fixada no pai, mesmo que o filho já tenha sido recarregado
+            return await self.compiled(version.subflows[child])
+
+        return await self.graph_cache.get_or_build(
+            version.name, version.digest, lambda: self.builder(version.name, version.config, subflow)
+        )
+
+    def _stale(self, version: FlowVersion) -> bool:
+        """Algum subfluxo da versão tem uma versão mais nova publicada."""
+        for child in version.subflows.values():
+            current = self._current.get(child.name)
+            if current is not None and current.digest != child.digest:
+                return True
+        return False
+
+    async def refresh(self):
+        """
+        Um ciclo de polling: recarrega os fluxos acompanhados cujo arquivo mudou ou cujos
+        subfluxos mudaram (os filhos são carregados antes dos pais, então vêm antes aqui).
+        """
+        self.polls += 1
+        for name in list(self._current):
+            try:
+                stamp = await asyncio.to_thread(self._stamp, name)
+            except FileNotFoundError:
+                # Arquivo removido: sessões novas recebem 404, as fixadas seguem no histórico
+                logger.warning("Fluxo '%s' removido do diretório", name)
+                self._current.pop(name, None)
+                self._stamps.pop(name, None)
+                continue
+            except OSError:
+                continue
+            if stamp == self._stamps.get(name) and not self._stale(self._current[name]):
+                continue
+            try:
+                await self._load(name)
+            except (FlowNotFound, FlowDefinitionError) as e:
+                # Mantém a versão anterior e não tenta de novo até o arquivo mudar outra vez
+                self.reload_errors += 1
+                self._stamps[name] = stamp
+                self._errors[name] = str(e)
+                logger.error("Recarga do fluxo '%s' falhou, mantendo a versão atual: %s", name, e)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Erro no polling de fluxos")
+
+    def start(self):
+        """Inicia o polling em background (`poll_interval` <= 0 desliga a recarga)."""
+        if self._watcher is None and self.poll_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "flows": len(self._current),
+            "versions": sum(len(h) for h in self._versions.values()),
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "polls": self.polls,
+            "watching": self._watcher is not None,
+            "current": {name: v.digest[:12] for name, v in self._current.items()},
+            "errors": dict(self._errors),
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+def flow_digest(flow_config: dict) -> str:
+    """Hash estável do conteúdo de uma definição de fluxo (independe da ordem das chaves)."""
+    canonical = json.dumps(flow_config, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompiledGraphCache:
+    """
+    Cache de processo para grafos LangGraph já compilados.
+
+    A chave é (nome do fluxo, hash do conteúdo), então uma definição editada gera
+    uma nova entrada em vez de reaproveitar um grafo antigo. A remoção é LRU.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._graphs: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        # Um lock por chave evita que N requisições simultâneas compilem o mesmo grafo
+        self._build_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        # Quantas corrotinas usam (ou esperam) o lock de cada chave
+        self._build_waiters: Dict[Tuple[str, str], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.builds = 0
+        self.build_time_total = 0.0
+        self.build_time_last = 0.0
+
+    def _lookup(self, key: Tuple[str, str]):
+        graph = self._graphs.get(key)
+        if graph is not None:
+            self._graphs.move_to_end(key)
+        return graph
+
+    async def get_or_build(self, flow_name: str, digest: str, builder: Callable[[], Awaitable[Any]]):
+        """Retorna o grafo compilado da chave, compilando via `builder()` apenas no miss."""
+        key = (flow_name, digest)
+
+        graph = self._lookup(key)
+        if graph is not None:
+            self.hits += 1
+            return graph
+
+        lock = self._build_locks.setdefault(key, asyncio.Lock())
+        self._build_waiters[key] = self._build_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                # Outra corrotina pode ter compilado enquanto esperávamos o lock
+                graph = self._lookup(key)
+                if graph is not None:
+                    self.hits += 1
+                    return graph
+
+                self.misses += 1
+                inicio = time.perf_counter()
+                graph = await builder()
+                elapsed = time.perf_counter() - inicio
+
+                self.builds += 1
+                self.build_time_total += elapsed
+                self.build_time_last = elapsed
+
+                self._graphs[key] = graph
+                while len(self._graphs) > self.maxsize:
+                    self._graphs.popitem(last=False)
+                    self.evictions += 1
+        finally:
+            # Sai só com o último usuário, também quando o builder falha (senão cada versão
+            # inválida deixa um lock para trás). Antes disso, quem chega depois de uma falha
+            # ainda espera no mesmo lock que quem está tentando de novo
+            self._build_waiters[key] -= 1
+            if not self._build_waiters[key]:
+                del self._build_waiters[key]
+                self._build_locks.pop(key, None)
+        return graph
+
+    def invalidate(self, flow_name: str = None):
+        """Remove todas as entradas (ou apenas as de um fluxo)."""
+        if flow_name is None:
+            self._graphs.clear()
+            return
+        for key in [k for k in self._graphs if k[0] == flow_name]:
+            del self._graphs[key]
+
+    def __len__(self):
+        return len(self._graphs)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._graphs),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "builds": self.builds,
+            "build_time_total_s": self.build_time_total,
+            "build_time_last_s": self.build_time_last,
+            "build_time_avg_s": (self.build_time_total / self.builds) if self.builds else 0.0,
+        }
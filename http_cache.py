@@ -0,0 +1,211 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+# Métodos idempotentes e seguros: só eles passam pelo cache/coalescing
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+# Cabeçalhos que identificam o usuário: sempre entram na chave, nunca são compartilhados
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+
+# Diretivas que autorizam um cache compartilhado a guardar resposta de requisição autenticada
+_SHARED_WITH_CREDENTIALS = ("public", "s-maxage", "must-revalidate")
+
+# Descrevem o corpo como veio do upstream; o conteúdo guardado já está decodificado (e
+# possivelmente projetado), então esses cabeçalhos não valem mais para ele
+_BODY_ENCODING_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+# Todos os caches vivos, para agregar métricas no /stats
+_caches: "weakref.WeakSet[HttpResponseCache]" = weakref.WeakSet()
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition("=")
+        directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+def decoded_headers(headers: httpx.Headers) -> List[Tuple[str, str]]:
+    """Cabeçalhos da resposta sem os que descrevem a codificação do corpo original."""
+    return [(k, v) for k, v in headers.multi_items() if k.lower() not in _BODY_ENCODING_HEADERS]
+
+
+class CachedResponse:
+    __slots__ = ("status_code", "headers", "content", "expires_at", "etag", "last_modified")
+
+    def __init__(self, response: httpx.Response, fresh_for: float):
+        self.status_code = response.status_code
+        self.headers = decoded_headers(response.headers)
+        self.content = response.content
+        self.expires_at = time.monotonic() + fresh_for
+        self.etag = response.headers.get("etag")
+        self.last_modified = response.headers.get("last-modified")
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def to_response(self, method: str, url: str) -> httpx.Response:
+        # Cada chamador recebe sua própria Response (o conteúdo em bytes é compartilhado)
+        return httpx.Response(
+            self.status_code, headers=self.headers, content=self.content,
+            request=httpx.Request(method, url),
+        )
+
+
+class HttpResponseCache:
+    """
+    Cache de respostas HTTP (LRU em memória) na frente de `http_client.request`, por nó `api`.
+
+    - Só GET/HEAD sem corpo, e só respostas 2xx.
+    - `Cache-Control` da resposta é respeitado: `no-store`/`private` não são guardadas,
+      `max-age` limita o TTL (o `ttl` do nó é o teto) e `no-cache` obriga revalidação.
+    - Entradas vencidas com `ETag`/`Last-Modified` são revalidadas (`If-None-Match` /
+      `If-Modified-Since`); um 304 renova a entrada sem baixar o corpo de novo.
+    - Argumentos extras (ex: `read` do `GuardedClient`) vão para `client.request`; o
+      `content` da resposta é o que fica guardado.
+    - Requisições idênticas em andamento são coalescidas: N sessões simultâneas
+      compartilham uma única chamada ao upstream.
+    - `Authorization`/`Cookie` sempre fazem parte da chave (entrada e coalescing por
+      credencial), e respostas a requisições com eles só são guardadas com `public`,
+      `s-maxage` ou `must-revalidate` (como um cache compartilhado, RFC 9111 3.5).
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 256, vary_headers: Iterable[str] = ()):
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.vary_headers = tuple(h.lower() for h in vary_headers)
+        self._entries: "OrderedDict[Tuple, CachedResponse]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.coalesced = 0
+        self.evictions = 0
+        _caches.add(self)
+
+    def _key(self, method: str, url: str, headers: Dict[str, str]) -> Tuple:
+        lowered = {k.lower(): v for k, v in (headers or {}).items()}
+        return (method, str(url), tuple(lowered.get(h) for h in self.vary_headers),
+                tuple(lowered.get(h) for h in CREDENTIAL_HEADERS))
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str,
+                      headers: Optional[Dict[str, str]] = None, **kwargs: Any) -> httpx.Response:
+        method = method.upper()
+        request_cc = _parse_cache_control((headers or {}).get("Cache-Control") or (headers or {}).get("cache-control"))
+        if method not in CACHEABLE_METHODS or "no-store" in request_cc:
+            return await client.request(method, url, headers=headers, **kwargs)
+
+        key = self._key(method, url, headers)
+        entry = self._entries.get(key)
+        if entry is not None and entry.is_fresh() and "no-cache" not in request_cc:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.to_response(method, url)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(client, key, method, url, headers, entry, kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        # shield: se este chamador for cancelado, a chamada segue para os demais
+        cached, response = await asyncio.shield(task)
+        return cached.to_response(method, url) if cached is not None else response
+
+    def _done(self, key: Tuple, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # marca como lida mesmo se nenhum chamador sobrou
+
+    async def _fetch(self, client, key, method, url, headers, entry: Optional[CachedResponse], kwargs):
+        request_headers = dict(headers or {})
+        if entry is not None and (entry.etag or entry.last_modified):
+            self.revalidations += 1
+            if entry.etag:
+                request_headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request_headers["If-Modified-Since"] = entry.last_modified
+
+        response = await client.request(method, url, headers=request_headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.not_modified += 1
+            entry.expires_at = time.monotonic() + self._fresh_for(response)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            return entry, None
+
+        await response.aread()
+        if not (200 <= response.status_code < 300):
+            return None, response
+
+        cache_control = _parse_cache_control(response.headers.get("cache-control"))
+        if "no-store" in cache_control or "private" in cache_control:
+            self._entries.pop(key, None)
+            return None, response
+        if any(key[3]) and not any(d in cache_control for d in _SHARED_WITH_CREDENTIALS):
+            self._entries.pop(key, None)
+            return None, response
+
+        fresh_for = self._fresh_for(response)
+        has_validator = "etag" in response.headers or "last-modified" in response.headers
+        if fresh_for <= 0 and not has_validator:
+            self._entries.pop(key, None)
+            return None, response
+
+        cached = CachedResponse(response, fresh_for)
+        self._entries[key] = cached
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return cached, None
+
+    def _fresh_for(self, response: httpx.Response) -> float:
+        cache_control = _parse_cache_control(response.headers.get("cache-control"))
+        if "no-cache" in cache_control:
+            return 0.0
+        max_age = cache_control.get("s-maxage") or cache_control.get("max-age")
+        if max_age is not None:
+            try:
+                return max(0.0, min(self.ttl, float(max_age) - float(response.headers.get("age", 0) or 0)))
+            except ValueError:
+                pass
+        return self.ttl
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+
+def http_cache_stats() -> Dict[str, Any]:
+    """Soma das métricas de todos os caches HTTP ativos no processo."""
+    total: Dict[str, Any] = {"caches": 0}
+    for cache in list(_caches):
+        total["caches"] += 1
+        for name, value in cache.stats().items():
+            total[name] = total.get(name, 0) + value
+    lookups = total.get("hits", 0) + total.get("misses", 0) + total.get("coalesced", 0)
+    total["hit_rate"] = ((total.get("hits", 0) + total.get("coalesced", 0)) / lookups) if lookups else 0.0
+    return total
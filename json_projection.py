@@ -0,0 +1,291 @@
+import json
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Union
+
+try:
+    # Parser incremental (backend C yajl2 quando disponível)
+    import ijson
+except ImportError:  # pragma: no cover - sem ijson, cai no parse completo + poda
+    ijson = None
+
+# Projeção de campos de respostas JSON para nós `api`.
+#
+# `extract` é uma lista de caminhos relativos à raiz do corpo (o que vira
+# `result.data`): "name", "$.sprites.front_default", "types[*].type.name",
+# "stats[0].base_stat", 'headers["x-id"]'. Só esses campos são materializados;
+# o restante do documento é descartado enquanto é lido.
+
+# Teto padrão para o corpo de respostas de nós api (sobrescrito por `max_response_bytes`)
+DEFAULT_MAX_RESPONSE_BYTES = 10 * 1024 * 1024
+
+WILDCARD = "*"
+# Subárvore inteira (folha do trie)
+FULL = None
+
+_TOKEN = re.compile(r"""\.?([^.\[\]]+)|\[(\d+|\*)\]|\[["']([^"']*)["']\]""")
+
+
+class ResponseTooLarge(Exception):
+    """Corpo da resposta maior que o limite configurado no nó."""
+
+
+class ProjectionError(ValueError):
+    """Caminho de `extract` inválido."""
+
+
+def parse_path(path: str) -> List[Union[str, int]]:
+    """`a.b[0].c` -> ["a", "b", 0, "c"]; `[*]` vira WILDCARD."""
+    text = path.strip()
+    if text.startswith("$"):
+        text = text[1:]
+    parts: List[Union[str, int]] = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ProjectionError(f"Caminho de extract inválido: '{path}'")
+        name, index, quoted = match.groups()
+        if name is not None:
+            parts.append(WILDCARD if name == WILDCARD else name)
+        elif index is not None:
+            parts.append(WILDCARD if index == WILDCARD else int(index))
+        else:
+            parts.append(quoted)
+        position = match.end()
+    return parts
+
+
+def build_trie(paths: Iterable[Union[str, List]]) -> Optional[Dict]:
+    """
+    Junta os caminhos num trie (dict aninhado; FULL marca subárvore inteira).
+    Um caminho vazio pede o documento inteiro: retorna FULL.
+    """
+    root: Dict = {}
+    for path in paths:
+        parts = parse_path(path) if isinstance(path, str) else list(path)
+        if not parts:
+            return FULL
+        node = root
+        for part in parts[:-1]:
+            child = node.get(part, {})
+            if child is FULL:
+                break
+            node = node.setdefault(part, child)
+        else:
+            node[parts[-1]] = FULL
+    _spread_wildcards(root)
+    return root
+
+
+def _merge_tries(left: Optional[Dict], right: Optional[Dict]) -> Optional[Dict]:
+    if left is FULL or right is FULL:
+        return FULL
+    merged = dict(left)
+    for key, sub in right.items():
+        merged[key] = _merge_tries(merged[key], sub) if key in merged else sub
+    return merged
+
+
+def _spread_wildcards(node: Optional[Dict]):
+    """`a[*].x` + `a[0].y`: o índice explícito também recebe o que o curinga pede."""
+    if node is FULL:
+        return
+    if WILDCARD in node:
+        for key in node:
+            if key != WILDCARD:
+                node[key] = _merge_tries(node[key], node[WILDCARD])
+    for sub in node.values():
+        _spread_wildcards(sub)
+
+
+def _child(trie: Optional[Dict], key: Union[str, int], missing: Any) -> Any:
+    if trie is FULL:
+        return FULL
+    if key in trie:
+        return trie[key]
+    return trie.get(WILDCARD, missing)
+
+
+_MISSING = object()
+
+
+def _place(container: Union[Dict, List], key: Union[str, int], value: Any):
+    if isinstance(container, dict):
+        container[key] = value
+    else:
+        # Índices específicos (`lista[3]`) mantêm a posição original: completa com None
+        container.extend([None] * (key - len(container)))
+        container.append(value)
+
+
+def project(document: Any, trie: Optional[Dict]) -> Any:
+    """Poda um documento já decodificado (respostas em cache ou sem ijson)."""
+    if trie is FULL:
+        return document
+    if isinstance(document, dict):
+        result = {}
+        for key, value in document.items():
+            sub = _child(trie, key, _MISSING)
+            if sub is not _MISSING:
+                result[key] = project(value, sub)
+        return result
+    if isinstance(document, list):
+        result: List = []
+        for index, value in enumerate(document):
+            sub = _child(trie, index, _MISSING)
+            if sub is not _MISSING:
+                _place(result, index, project(value, sub))
+        return result
+    return document
+
+
+class _Projector:
+    """Monta o documento projetado a partir dos eventos de `ijson.basic_parse`."""
+
+    def __init__(self, trie: Optional[Dict]):
+        self.result: Any = None
+        self._stack: List[list] = []  # [container, trie, chave pendente, próximo índice]
+        self._skip = 0
+        self._root_trie = trie
+        # Chaves de primeiro nível ainda não lidas; quando zera o resto pode ser descartado
+        self._remaining = None
+        if trie is not FULL and WILDCARD not in trie:
+            self._remaining = {k for k in trie if isinstance(k, str)}
+
+    def _slot(self):
+        """(container pai, chave/índice, trie do valor) para o próximo valor."""
+        if not self._stack:
+            return None, None, self._root_trie
+        frame = self._stack[-1]
+        container, trie = frame[0], frame[1]
+        if isinstance(container, dict):
+            key = frame[2]
+        else:
+            key = frame[3]
+            frame[3] += 1
+        return container, key, _child(trie, key, _MISSING)
+
+    def _finished_root_value(self, key) -> bool:
+        if self._remaining is None or len(self._stack) != 1:
+            return False
+        self._remaining.discard(key)
+        return not self._remaining
+
+    def feed(self, event: str, value: Any) -> bool:
+        """Processa um evento; retorna True quando todos os campos pedidos já foram lidos."""
+        if self._skip:
+            if event in ("start_map", "start_array"):
+                self._skip += 1
+            elif event in ("end_map", "end_array"):
+                self._skip -= 1
+            return False
+
+        if event == "map_key":
+            self._stack[-1][2] = value
+            return False
+
+        if event in ("end_map", "end_array"):
+            self._stack.pop()
+            if self._stack and isinstance(self._stack[-1][0], dict):
+                return self._finished_root_value(self._stack[-1][2])
+            return False
+
+        container, key, trie = self._slot()
+        if trie is _MISSING:
+            if event in ("start_map", "start_array"):
+                self._skip = 1
+            return False
+
+        if event in ("start_map", "start_array"):
+            value = {} if event == "start_map" else []
+            self._stack.append([value, trie, None, 0])
+            if container is None:
+                self.result = value
+                # Nenhum campo de primeiro nível pedido: nada mais a ler
+                return self._remaining is not None and not self._remaining
+            _place(container, key, value)
+            return False
+
+        if container is None:
+            self.result = value
+            return True
+        _place(container, key, value)
+        return isinstance(container, dict) and self._finished_root_value(key)
+
+
+class _ChunkReader:
+    """Adapta um iterador assíncrono de bytes ao `read()` esperado pelo ijson, com limite de tamanho."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int]):
+        self._chunks = chunks.__aiter__()
+        self._buffer = b""
+        self._max_bytes = max_bytes
+        self.size = 0
+
+    async def _next_chunk(self) -> bytes:
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        self.size += len(chunk)
+        if self._max_bytes and self.size > self._max_bytes:
+            raise ResponseTooLarge(f"Resposta maior que {self._max_bytes} bytes")
+        return chunk
+
+    async def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            parts = [self._buffer]
+            self._buffer = b""
+            while True:
+                chunk = await self._next_chunk()
+                if not chunk:
+                    return b"".join(parts)
+                parts.append(chunk)
+        while not self._buffer:
+            chunk = await self._next_chunk()
+            if not chunk:
+                return b""
+            self._buffer = chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+async def read_limited(chunks: AsyncIterator[bytes], max_bytes: Optional[int]) -> bytes:
+    """Lê o corpo inteiro, abortando assim que passar de `max_bytes`."""
+    return await _ChunkReader(chunks, max_bytes).read()
+
+
+async def stream_project(chunks: AsyncIterator[bytes], trie: Optional[Dict],
+                         max_bytes: Optional[int] = None) -> Any:
+    """
+    Decodifica o JSON conforme os bytes chegam, materializando só os campos do trie.
+    Quando todos os campos de primeiro nível pedidos já foram lidos, para de ler.
+    """
+    reader = _ChunkReader(chunks, max_bytes)
+    if ijson is None:
+        return project(json.loads(await reader.read()), trie)
+    projector = _Projector(trie)
+    async for event, value in ijson.basic_parse_async(reader, use_float=True):
+        if projector.feed(event, value):
+            break
+    return projector.result
+
+
+def data_paths(references: Iterable[Optional[List]]) -> Optional[List[List]]:
+    """
+    Converte referências `context.result.data.<caminho>` (de `templates.context_references`)
+    em caminhos de extract. Retorna None quando o corpo inteiro pode ser usado
+    (`context`, `context.result` ou `context.result.data` sem campo).
+    """
+    paths = []
+    for chain in references:
+        if chain is None or len(chain) < 2:
+            if chain is None or not chain or chain[0] == "result":
+                return None
+            continue
+        if chain[0] != "result" or chain[1] != "data":
+            continue
+        if len(chain) == 2:
+            return None
+        paths.append(chain[2:])
+    return paths
@@ -0,0 +1,117 @@
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Contexto em camadas (copy-on-write) usado pelo engine durante a execução de um nó.
+#
+# O contexto salvo no estado do LangGraph nunca é copiado nem alterado: o nó escreve
+# numa camada própria e, ao final, só as chaves alteradas/removidas viram o update do
+# estado (um "delta"), aplicado pelo reducer `merge_context` do canal `context`.
+#
+# Só chaves de primeiro nível são rastreadas: `context["a"] = x` entra no delta,
+# mas mutar um objeto aninhado (`context["a"]["b"] = x`) não.
+
+# Marcador de update parcial no canal `context`; um dict sem ele substitui o contexto
+# inteiro (input inicial de uma sessão).
+DELTA_KEY = "__delta__"
+
+
+class LayeredContext(MutableMapping):
+    """
+    Mapping com uma base somente leitura e uma camada de escrita por cima.
+
+    Leituras consultam a camada e depois a base; escritas e remoções só tocam a
+    camada (a base é compartilhada com o estado do grafo e com outros nós).
+    A interface pública é a de um dict, para que `context.<chave>` nos templates
+    não seja sombreado por atributos próprios; use `changes`/`materialize`.
+    """
+
+    __slots__ = ("_base", "_overlay", "_removed")
+
+    def __init__(self, base: Optional[Mapping] = None, overlay: Optional[Dict[str, Any]] = None):
+        self._base = base if base is not None else {}
+        self._overlay: Dict[str, Any] = dict(overlay) if overlay else {}
+        self._removed: set = set()
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        if key in self._removed:
+            raise KeyError(key)
+        return self._base[key]
+
+    def __contains__(self, key):
+        if key in self._overlay:
+            return True
+        return key not in self._removed and key in self._base
+
+    def get(self, key, default=None):
+        # Caminho quente (templates, expressões): evita a exceção do Mapping.get
+        if key in self._overlay:
+            return self._overlay[key]
+        if key in self._removed:
+            return default
+        return self._base.get(key, default)
+
+    def __setitem__(self, key, value):
+        self._overlay[key] = value
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._overlay.pop(key, None)
+        if key in self._base:
+            self._removed.add(key)
+
+    def __iter__(self) -> Iterator:
+        yield from self._overlay
+        for key in self._base:
+            if key not in self._overlay and key not in self._removed:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"LayeredContext({materialize(self)!r})"
+
+
+def changes(context: Mapping) -> Tuple[Dict[str, Any], List[str]]:
+    """(chaves escritas, chaves removidas) desde que a camada foi criada."""
+    if isinstance(context, LayeredContext):
+        return dict(context._overlay), [k for k in context._removed if k not in context._overlay]
+    return dict(context), []
+
+
+def materialize(context: Mapping) -> Dict[str, Any]:
+    """Cópia rasa em dict comum (ex: para serializar ou devolver ao cliente)."""
+    return dict(context.items())
+
+
+def context_delta(context: Mapping) -> Dict[str, Any]:
+    """Update parcial do canal `context` com apenas o que o nó alterou."""
+    updates, removed = changes(context)
+    return {DELTA_KEY: {"set": updates, "unset": removed}}
+
+
+def delta_updates(value: Any) -> Dict[str, Any]:
+    """Chaves escritas por um update do canal `context` (delta ou contexto completo)."""
+    if isinstance(value, Mapping) and DELTA_KEY in value:
+        return value[DELTA_KEY]["set"]
+    return value if isinstance(value, Mapping) else {}
+
+
+def merge_context(left: Optional[Dict[str, Any]], right: Any) -> Dict[str, Any]:
+    """
+    Reducer do canal `context`: aplica um delta sobre o contexto atual; um dict
+    completo (sem `DELTA_KEY`) substitui o contexto. A cópia é rasa: os valores
+    (payloads grandes de API) são compartilhados entre as versões.
+    """
+    if not isinstance(right, Mapping) or DELTA_KEY not in right:
+        return right
+    delta = right[DELTA_KEY]
+    merged = dict(left or {})
+    merged.update(delta["set"])
+    for key in delta["unset"]:
+        merged.pop(key, None)
+    return merged
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+_SPACES = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Forma canônica do prompt para a chave do cache: Unicode NFC, quebras de linha
+    `\\n`, espaços repetidos colapsados, sem espaços no fim das linhas nem nas pontas.
+    Maiúsculas/minúsculas e pontuação são mantidas (mudam a resposta do modelo).
+    """
+    text = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(_SPACES.sub(" ", line).rstrip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def llm_identity(llm: Any) -> str:
+    """Modelo + parâmetros serializados (o mesmo critério do cache da própria LangChain)."""
+    try:
+        return llm._get_llm_string()
+    except Exception:
+        return f"{type(llm).__module__}.{type(llm).__qualname__}"
+
+
+def is_deterministic(llm: Any) -> bool:
+    """Só faz sentido reaproveitar respostas de modelos com temperatura 0 (ou sem temperatura)."""
+    temperature = getattr(llm, "temperature", None)
+    return temperature is None or float(temperature) == 0.0
+
+
+class _DiskTier:
+    """Segundo nível do cache: tabela SQLite, compartilhável entre workers e restarts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str, ttl: Optional[float]) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl and time.time() - row[1] > ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def set(self, key: str, response: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, time.time()),
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMResultCache:
+    """
+    Cache de respostas do LLM por (modelo + parâmetros, prompt).
+
+    - Nível 1: LRU em memória (`max_entries`); nível 2 opcional: SQLite em `disk_path`.
+    - `normalize=True` usa o prompt normalizado (`normalize_prompt`) na chave; com
+      `False` a chave é o prompt exato.
+    - Prompts idênticos em andamento são coalescidos: N sessões simultâneas
+      compartilham uma única chamada ao modelo.
+    - Modelos com temperatura > 0 não passam pelo cache (respostas não são intercambiáveis).
+    - `ttl` (segundos, opcional) vale para os dois níveis.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None,
+                 disk_path: Optional[str] = None, normalize: bool = True):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl) if ttl else None
+        self.normalize = normalize
+        self.disk = _DiskTier(disk_path) if disk_path else None
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def key(self, llm: Any, prompt: str, normalize: Optional[bool] = None) -> str:
+        normalize = self.normalize if normalize is None else normalize
+        text = normalize_prompt(prompt) if normalize else prompt
+        raw = json.dumps([llm_identity(llm), "normalized" if normalize else "exact", text], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, stored_at = entry
+        if self.ttl and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _set_memory(self, key: str, response: str):
+        self._entries[key] = (response, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def lookup(self, llm: Any, prompt: str, normalize: Optional[bool] = None) -> Optional[str]:
+        """Consulta os dois níveis sem chamar o modelo (usado no caminho em lote do `map`)."""
+        if not is_deterministic(llm):
+            return None
+        key = self.key(llm, prompt, normalize)
+        response = self._get_memory(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        if self.disk is not None:
+            response = await asyncio.to_thread(self.disk.get, key, self.ttl)
+            if response is not None:
+                self.disk_hits += 1
+                self._set_memory(key, response)
+                return response
+        self.misses += 1
+        return None
+
+    async def store(self, llm: Any, prompt: str, response: str, normalize: Optional[bool] = None):
+        if not is_deterministic(llm) or not isinstance(response, str):
+            return
+        key = self.key(llm, prompt, normalize)
+        self._set_memory(key, response)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, response)
+
+    async def get_or_compute(self, llm: Any, prompt: str, compute: Callable[[], Awaitable[str]],
+                             normalize: Optional[bool] = None) -> Tuple[str, str]:
+        """
+        Retorna (resposta, origem). `compute()` só é chamado no miss.
+        Origem: `memory`, `disk`, `coalesced`, `miss` ou `bypass` (modelo não determinístico).
+        """
+        if not is_deterministic(llm):
+            self.bypassed += 1
+            return await compute(), "bypass"
+
+        key = self.key(llm, prompt, normalize)
+        response = self._get_memory(key)
+        if response is not None:
+            self.hits += 1
+            return response, "memory"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            response, _ = await asyncio.shield(task)
+            return response, "coalesced"
+
+        task = asyncio.ensure_future(self._fill(key, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t, k=key: self._done(k, t))
+        # shield: se este chamador for cancelado, a chamada segue para os demais
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # marca como lida mesmo se nenhum chamador sobrou
+
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        if self.disk is not None:
+            response = await asyncio.to_thread(self.disk.get, key, self.ttl)
+            if response is not None:
+                self.disk_hits += 1
+                self._set_memory(key, response)
+                return response, "disk"
+
+        self.misses += 1
+        response = await compute()
+        if isinstance(response, str):
+            self._set_memory(key, response)
+            if self.disk is not None:
+                await asyncio.to_thread(self.disk.set, key, response)
+        return response, "miss"
+
+    def clear(self):
+        """Limpa só o nível em memória."""
+        self._entries.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        served = self.hits + self.disk_hits + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk_entries": self.disk.count() if self.disk is not None else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": (served / lookups) if lookups else 0.0,
+        }
@@ -1,44 +1,116 @@
+import argparse
 import asyncio
 import json
-from dotenv import load_dotenv # Importar a função
-from engine import FlowEngine
-from storage import InMemoryStore
-
-# =======================================================
-# NOVO PASSO: CARREGAR VARIÁVEIS DO .ENV
-# Isso deve ser feito ANTES de qualquer código que use variáveis de ambiente,
-# garantindo que OPENAI_API_KEY esteja disponível para o FlowEngine.
+import sys
+import time
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+
+from batch import DEFAULT_BATCH_CONCURRENCY, iter_lines, run_batch
+
+# Runner de lotes: executa um arquivo JSON lines de sessões ({"user_id", "messages"} por
+# linha) contra um fluxo e grava um resultado por linha, na ordem em que terminam.
+#
+#   python main.py flow_definition itens.jsonl -o resultados.jsonl --concurrency 32
+#   python main.py flow_definition itens.jsonl --url http://localhost:8000
+#
+# Sem --url roda no próprio processo (mesmo engine, caches e variáveis FLOW_* da API;
+# use FLOW_CHECKPOINTER=sqlite para as sessões sobreviverem ao fim do processo).
+# Com --url envia o lote para o endpoint /execute/{flow}/batch de um servidor.
+
 load_dotenv()
-# =======================================================
-
-# Exemplo de Configuração JSON (Mantido para Contexto)
-with open('flow_definition.json', 'r') as f:
-    flow_json = json.load(f)
-
-async def main():
-    store = InMemoryStore()
-    engine = FlowEngine(flow_json, store) 
-    
-    # CHAVE 1: Use 'await' para compilar o grafo assíncrono
-    app = await engine.build_graph()
-
-    initial_state = {
-        "context": {},
-        "current_node": "setup" 
-    }
-
-    print(">>> Iniciando Fluxo Assíncrono <<<")
-    
-    # CORREÇÃO CHAVE: Troque .stream() por .astream() 
-    # O .astream() retorna um AsyncIterator que é compatível com o 'async for'.
-    async for output in app.astream(initial_state):
-        # Aqui você pode inspecionar o estado a cada passo
-        # print(f"Estado Atual: {output}") 
-        pass 
-    
-    print("\n>>> Fluxo Finalizado. Verifique a mensagem final acima. <<<")
-    # final_state = await app.ainvoke(initial_state)
+
+# Status de item que contam como falha no código de saída
+FAILED_STATUSES = ("invalid", "error", "rejected")
+
+
+async def _read_lines(path: str) -> AsyncIterator[str]:
+    """Linhas do arquivo (ou stdin com "-"), lidas fora do event loop."""
+    source = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        while True:
+            line = await asyncio.to_thread(source.readline)
+            if not line:
+                break
+            yield line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+async def _local_results(flow_name: str, lines: AsyncIterator[str], concurrency: int,
+                         deadline_ms: Optional[int]) -> AsyncIterator[dict]:
+    # Importado aqui: cria checkpointer, caches e registro de fluxos da API
+    import api
+
+    async with api.app.router.lifespan_context(api.app):
+        try:
+            await api.flow_registry.get(flow_name)
+        except (api.FlowNotFound, api.FlowDefinitionError) as e:
+            raise SystemExit(str(e))
+        async for result in run_batch(lines, api.batch_item_runner(flow_name, deadline_ms), concurrency):
+            yield result
+
+
+async def _remote_results(url: str, flow_name: str, lines: AsyncIterator[str], concurrency: int,
+                          deadline_ms: Optional[int]) -> AsyncIterator[dict]:
+    import httpx
+
+    async def body():
+        async for line in lines:
+            yield line.encode("utf-8")
+
+    headers = {"Content-Type": "application/x-ndjson"}
+    if deadline_ms:
+        headers["X-Deadline-Ms"] = str(deadline_ms)
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", f"{url.rstrip('/')}/execute/{flow_name}/batch",
+                                 params={"concurrency": concurrency}, headers=headers, content=body()) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise SystemExit(f"Erro {response.status_code}: {response.text}")
+            async for line in iter_lines(response.aiter_text()):
+                if line.strip():
+                    yield json.loads(line)
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Executa um lote de sessões (JSON lines) contra um fluxo.")
+    parser.add_argument("flow", help="Nome do fluxo (ex: flow_definition)")
+    parser.add_argument("input", nargs="?", default="-", help="Arquivo JSON lines de entrada (padrão: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Arquivo JSON lines de saída (padrão: stdout)")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                        help=f"Itens executados ao mesmo tempo (padrão: {DEFAULT_BATCH_CONCURRENCY})")
+    parser.add_argument("--deadline-ms", type=int, default=None, help="Orçamento de tempo por item")
+    parser.add_argument("--url", default=None, help="Envia para um servidor em vez de rodar localmente")
+    args = parser.parse_args(argv)
+
+    lines = _read_lines(args.input)
+    if args.url:
+        results = _remote_results(args.url, args.flow, lines, args.concurrency, args.deadline_ms)
+    else:
+        results = _local_results(args.flow, lines, args.concurrency, args.deadline_ms)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    statuses: Counter = Counter()
+    inicio = time.perf_counter()
+    try:
+        async for result in results:
+            statuses[result.get("status")] += 1
+            output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - inicio
+    total = sum(statuses.values())
+    print(f"{total} itens em {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s): "
+          + ", ".join(f"{status}={count}" for status, count in statuses.most_common()), file=sys.stderr)
+    return 1 if any(statuses[status] for status in FAILED_STATUSES) else 0
 
 
 if __name__ == "__main__":
-    asyncio.run(main())  
\ No newline at end of file
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import httpx
+
+from json_projection import ResponseTooLarge, project, read_limited, stream_project
+from resilience import IDEMPOTENT_METHODS, GuardedClient, UpstreamUnavailable, http_upstream_key, within_deadline
+from telemetry import logger, HTTP_RESPONSES
+
+# Executor dos nós `api` (registrado em node_registry; recurso: `http_client`).
+
+
+class InvalidResponseBody(ValueError):
+    """JSON inválido percebido no meio da leitura em streaming (o corpo já foi consumido em parte)."""
+
+
+def _projects(plan: dict, response: httpx.Response) -> bool:
+    return plan["extract"] is not None and "json" in response.headers.get("content-type", "")
+
+
+async def _stream_body(engine, node_id: str, response: httpx.Response):
+    """Corpo lido em streaming com o limite do nó: os campos de `extract` (JSON) ou os bytes."""
+    plan = engine.plans[node_id]
+    limit = plan["max_response_bytes"]
+    try:
+        length = response.headers.get("content-length")
+        if limit and length and length.isdigit() and int(length) > limit:
+            raise ResponseTooLarge(f"Content-Length {length} maior que {limit} bytes")
+        if not _projects(plan, response):
+            return await read_limited(response.aiter_bytes(), limit)
+        try:
+            return await stream_project(response.aiter_bytes(), plan["extract"], limit)
+        except ResponseTooLarge:
+            raise
+        except Exception as e:
+            raise InvalidResponseBody(f"Invalid JSON: {e}") from e
+    except (ResponseTooLarge, InvalidResponseBody) as e:
+        # O status vai junto: com cache, quem leu o corpo pode ter sido outra sessão (coalescing)
+        e.status_code = response.status_code
+        raise
+
+
+async def read_response(engine, node_id: str, response: httpx.Response) -> dict:
+    """Lê o corpo de uma resposta em streaming respeitando `max_response_bytes` e `extract`."""
+    body = await _stream_body(engine, node_id, response)
+    if _projects(engine.plans[node_id], response):
+        return {"status": response.status_code, "data": body}
+    return decode_response(engine, node_id, response, body)
+
+
+async def read_cacheable(engine, node_id: str, response: httpx.Response) -> bytes:
+    """
+    Corpo guardado no cache, lido como em `read_response`: com `extract`, só os campos
+    projetados (JSON compacto) em vez do documento inteiro.
+    """
+    body = await _stream_body(engine, node_id, response)
+    if _projects(engine.plans[node_id], response):
+        return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
+    return body
+
+
+def decode_response(engine, node_id: str, response: httpx.Response, content: bytes) -> dict:
+    # O limite de tamanho já foi aplicado durante a leitura (`_stream_body`)
+    plan = engine.plans[node_id]
+    try:
+        data = json.loads(content)
+    except:
+        return {"status": response.status_code, "text": content.decode(response.encoding or "utf-8", errors="replace")}
+    if plan["extract"] is not None:
+        data = project(data, plan["extract"])
+    return {"status": response.status_code, "data": data}
+
+
+async def run_api(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    plan = engine.plans[node_id]
+    next_node_id = None
+    action_result = {}
+
+    method = action_config.get("method", "get").lower()
+    url = action_config["url"]
+    headers = action_config.get("headers", {})
+    body = action_config.get("body", None)
+
+    # Determine if we should send as JSON or content
+    json_body = None
+    content_body = None
+
+    if isinstance(body, (dict, list)):
+        json_body = body
+    elif isinstance(body, str):
+        try:
+            json_body = json.loads(body)
+        except:
+            content_body = body
+    else:
+        json_body = body
+
+    # Cliente compartilhado (pool de conexões do processo): não é fechado aqui
+    client = engine.http_client
+    cache = engine.http_caches.get(node_id)
+    # Retries só em métodos idempotentes; timeout/retries do nó sobrescrevem a política
+    guard = {"idempotent": method.upper() in IDEMPOTENT_METHODS,
+             "retries": plan["retries"], "timeout": plan["timeout"], "deadline": engine.deadline(config)}
+    response = None
+    try:
+        if cache is not None and json_body is None and content_body is None:
+            # GET/HEAD idempotentes: cache + coalescing de chamadas idênticas. O corpo é lido em
+            # streaming (limite e projeção) e o cache guarda só o que foi projetado. A chamada
+            # pode ser compartilhada: roda sem deadline e cada sessão limita só a própria espera
+            shared_guard = dict(guard, deadline=None)
+            response = await within_deadline(
+                cache.request(GuardedClient(engine.upstreams, client, **shared_guard), method, url,
+                              headers=headers, read=lambda r: read_cacheable(engine, node_id, r)),
+                guard["deadline"],
+            )
+            HTTP_RESPONSES.inc(engine.flow_name, node_id, response.status_code)
+            response.raise_for_status() # Lança exceção para status 4xx/5xx
+            action_result = decode_response(engine, node_id, response, response.content)
+        else:
+            body_kwargs = {"json": json_body} if json_body is not None else {"content": content_body}
+
+            async def stream(timeout: float):
+                nonlocal response
+                # Corpo lido em streaming: limite de tamanho e projeção sem materializar o documento
+                async with client.stream(method, url, headers=headers, timeout=timeout, **body_kwargs) as response:
+                    HTTP_RESPONSES.inc(engine.flow_name, node_id, response.status_code)
+                    response.raise_for_status() # Lança exceção para status 4xx/5xx
+                    return await read_response(engine, node_id, response)
+
+            # O timeout do httpx vale por fase (conexão, cada leitura); o wait_for limita a chamada toda
+            attempt = lambda timeout: asyncio.wait_for(stream(timeout), timeout)
+            action_result = await engine.upstreams.call(http_upstream_key(url), attempt, **guard)
+    except UpstreamUnavailable as e:
+        logger.warning("Upstream indisponível no nó %s: %s", node_id, e)
+        action_result = {"error": f"Upstream Unavailable: {e}"}
+    except asyncio.TimeoutError:
+        HTTP_RESPONSES.inc(engine.flow_name, node_id, "error")
+        logger.warning("Timeout no nó %s (%s)", node_id, url)
+        action_result = {"error": "Timeout"}
+    except ResponseTooLarge as e:
+        logger.warning("Resposta grande demais no nó %s: %s", node_id, e)
+        action_result = {"error": f"Response Too Large: {e}", "status": e.status_code}
+    except InvalidResponseBody as e:
+        logger.warning("Corpo JSON inválido no nó %s: %s", node_id, e)
+        action_result = {"status": e.status_code, "error": str(e)}
+    except httpx.HTTPStatusError as e:
+        logger.warning("Erro HTTP no nó %s: %s", node_id, e)
+        action_result = {"error": f"HTTP Error: {e.response.status_code}", "status": e.response.status_code}
+    except httpx.RequestError as e:
+        HTTP_RESPONSES.inc(engine.flow_name, node_id, "error")
+        logger.warning("Erro de requisição no nó %s: %s", node_id, e)
+        action_result = {"error": f"Request Error: {e}"}
+    if "error" in action_result and engine.nodes_map[node_id].get("on_error"):
+        next_node_id = engine.nodes_map[node_id]["on_error"]
+
+    return action_result, next_node_id
@@ -0,0 +1,274 @@
+import asyncio
+from typing import Any, Dict, List
+
+from langchain_core.messages import HumanMessage
+from langgraph.errors import GraphInterrupt
+from langgraph.types import interrupt
+
+from flow_plan import map_body_id
+from layered_context import LayeredContext
+from resilience import DeadlineExceeded, llm_upstream_key
+from telemetry import logger, LLM_CALLS
+from templates import render_compiled
+
+# Executores dos nós de controle (registrados em node_registry; sem recursos externos).
+# Usam só a API pública do engine (`plans`, `nodes_map`, `run_action`, `deadline`,
+# `start_speculation`); os planos de map, subflow e join são compilados pelo engine.
+
+
+async def run_output(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    prompt_text = action_config.get("message", "Insira um valor:")
+
+    # Tenta obter o input do contexto (injetado pela API)
+    user_inputs = context.get("user_inputs", {})
+    if node_id in user_inputs:
+        logger.debug("Input para '%s' recebido via contexto: %s", node_id, user_inputs[node_id])
+    else:
+        try:
+            context["user_inputs"] = interrupt(prompt_text)
+        except GraphInterrupt:
+            # A sessão vai esperar o usuário: adianta o que não depende da resposta
+            engine.start_speculation(node_id, context, config)
+            raise
+    return {}, None
+
+
+async def run_fixed(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    return action_config.get("data", {}), None
+
+
+async def run_if_else(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    # Expressão pré-compilada, avaliada direto sobre o contexto (tipos nativos)
+    action_result = bool(engine.plans[node_id]["expression"].evaluate(context))
+    return action_result, action_config["true_node"] if action_result else action_config["false_node"]
+
+
+async def run_switch_case(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    action_result = engine.plans[node_id]["expression"].evaluate(context)
+    next_node_id = (select_case(action_config.get("cases", {}), action_result)
+                    or action_config.get("default"))
+    return action_result, next_node_id
+
+
+async def run_map(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    action_result = await _map_items(engine, node_id, action_config, context, config)
+    if action_config.get("target"):
+        context[action_config["target"]] = action_result
+    return action_result, None
+
+
+async def run_subflow(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    return await _invoke_subflow(engine, node_id, context, config), None
+
+
+async def run_parallel(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    # Os ramos são disparados pelas arestas do grafo (fan-out do LangGraph)
+    return {"branches": list(action_config.get("branches", []))}, None
+
+
+async def run_join(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    branch_results = (state or {}).get("branch_results") or {}
+    return merge_branches(engine, node_id, context, branch_results), None
+
+
+def select_case(cases: dict, value: Any):
+    """Procura o valor nos `cases` (chaves do JSON são sempre strings)."""
+    if isinstance(value, bool):
+        candidates = (str(value), str(value).lower())
+    else:
+        candidates = (value, str(value))
+    for candidate in candidates:
+        try:
+            if candidate in cases:
+                return cases[candidate]
+        except TypeError:
+            continue
+    return None
+
+
+async def _map_items(engine, node_id: str, action_config: dict, context: dict, config) -> list:
+    """
+    Executa o corpo do `map` para cada item da lista, com no máximo `concurrency`
+    execuções simultâneas, devolvendo os resultados na ordem dos itens.
+
+    Cada item enxerga o contexto com `context.<item_var>` (padrão `item`) e `context.index`.
+    Corpos `llm` com `batch_size` usam `abatch` do modelo, `batch_size` prompts por chamada.
+    """
+    items = engine.plans[node_id]["expression"].evaluate(context)
+    if items is None:
+        items = []
+    if isinstance(items, dict):
+        items = list(items.values())
+    if not isinstance(items, (list, tuple)):
+        raise ValueError(f"Nó map '{node_id}': 'items' deve ser uma lista, recebido {type(items).__name__}.")
+
+    body_id = map_body_id(node_id)
+    body_plan = engine.plans[body_id]
+    item_var = action_config.get("item_var", "item")
+    concurrency = max(1, int(action_config.get("concurrency", 5)))
+    batch_size = int(action_config.get("batch_size", 0) or 0)
+    collect_errors = action_config.get("mode", "fail_fast") == "collect_errors"
+
+    def item_context(index, item):
+        return LayeredContext(context, {item_var: item, "index": index})
+
+    def project(index, item, result):
+        if body_plan["output"] is None:
+            return result
+        return render_compiled(body_plan["output"], LayeredContext(item_context(index, item), {"result": result}))
+
+    results = [None] * len(items)
+
+    if batch_size and engine.nodes_map[body_id]["type"] == "llm":
+        await _map_llm_batches(engine, body_id, items, item_context, project, results,
+                               batch_size, concurrency, collect_errors, config)
+        return results
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(index, item):
+        async with semaphore:
+            try:
+                result, _ = await engine.run_action(body_id, item_context(index, item), config)
+            except Exception as e:
+                if not collect_errors or isinstance(e, DeadlineExceeded):
+                    raise
+                results[index] = {"error": f"{type(e).__name__}: {e}"}
+                return
+            results[index] = project(index, item, result)
+
+    tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(items)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # fail_fast: cancela os itens que ainda estão rodando
+        for task in tasks:
+            task.cancel()
+        raise
+    return results
+
+
+async def _map_llm_batches(engine, body_id: str, items, item_context, project, results: list,
+                           batch_size: int, concurrency: int, collect_errors: bool, config):
+    body_plan = engine.plans[body_id]
+    cache_options = body_plan["llm_cache"] if engine.llm_cache is not None else None
+    normalize = (cache_options or {}).get("normalize")
+    # Com cache, prompts repetidos na lista viram uma única entrada (chave do cache)
+    pending: Dict[Any, List] = {}
+    for i, item in enumerate(items):
+        prompt = render_compiled(body_plan["action_config"], item_context(i, item))["prompt"]
+        if cache_options is None:
+            pending[i] = [prompt, (i, item)]
+            continue
+        key = engine.llm_cache.key(engine.llm, prompt, normalize)
+        if key in pending:
+            pending[key].append((i, item))
+            continue
+        cached = await engine.llm_cache.lookup(engine.llm, prompt, normalize=normalize)
+        if cached is not None:
+            LLM_CALLS.inc(engine.flow_name, body_id, "cache")
+            results[i] = project(i, item, {"response": cached})
+        else:
+            pending[key] = [prompt, (i, item)]
+
+    # Só os prompts sem resposta em cache vão para o modelo
+    groups = list(pending.values())
+    for start in range(0, len(groups), batch_size):
+        chunk = groups[start:start + batch_size]
+        LLM_CALLS.inc(engine.flow_name, body_id, "model", amount=len(chunk))
+        # Um lote ocupa uma vaga do bulkhead; o timeout adaptativo (medido em chamadas
+        # unitárias) não vale para lotes, que usam o teto da política
+        upstream_key = llm_upstream_key(engine.llm)
+        messages = await engine.upstreams.call(
+            upstream_key,
+            lambda timeout: asyncio.wait_for(engine.llm.abatch(
+                [[HumanMessage(content=group[0])] for group in chunk],
+                config={"max_concurrency": concurrency},
+                return_exceptions=collect_errors,
+            ), timeout),
+            retries=body_plan["retries"],
+            timeout=body_plan["timeout"] or engine.upstreams.get(upstream_key).policy.max_timeout,
+            deadline=engine.deadline(config),
+        )
+        for (prompt, *targets), msg in zip(chunk, messages):
+            if isinstance(msg, Exception):
+                for i, item in targets:
+                    results[i] = {"error": f"{type(msg).__name__}: {msg}"}
+                continue
+            if cache_options is not None:
+                await engine.llm_cache.store(engine.llm, prompt, msg.content, normalize=normalize)
+            for i, item in targets:
+                results[i] = project(i, item, {"response": msg.content})
+
+
+async def _invoke_subflow(engine, node_id: str, context: dict, config) -> dict:
+    """
+    Executa o fluxo filho no mesmo event loop e devolve o contexto final dele.
+
+    Chamado com o config do nó, o grafo filho roda como subgrafo do LangGraph: usa o
+    checkpointer e o thread_id do pai, num namespace próprio. Um `interrupt()` no filho
+    pausa o pai; no resume o nó roda de novo e o filho continua do próprio checkpoint.
+    """
+    plan = engine.plans[node_id]
+    child_context = {"user_id": context.get("user_id")}
+    for child_key, key in plan["input_keys"].items():
+        if key in context:
+            child_context[child_key] = context[key]
+
+    values = await engine.subflow_apps[plan["subflow"]].ainvoke(
+        {"context": child_context, "current_node": None}, config,
+    )
+    child_result = (values or {}).get("context") or {}
+    for key, child_key in plan["output_keys"].items():
+        if child_key in child_result:
+            context[key] = child_result[child_key]
+    return child_result
+
+
+def merge_branches(engine, join_id: str, context: dict, branch_results: dict) -> dict:
+    """
+    Aplica no contexto os deltas dos ramos, na ordem declarada no parallel.
+
+    Regras de conflito (`conflict` padrão do join ou `conflicts` por chave) quando
+    dois ramos escrevem valores diferentes na mesma chave:
+    `error` (padrão), `first`, `last` ou `merge` (dicts são unidos, listas concatenadas).
+    """
+    join_config = engine.nodes_map[join_id].get("action_config", {})
+    default_rule = join_config.get("conflict", "error")
+    rules = join_config.get("conflicts", {})
+
+    merged, owners, errors = {}, {}, {}
+    for branch in engine.join_branches[join_id]:
+        result = branch_results.get(branch)
+        if result is None:
+            continue
+        if "error" in result:
+            errors[branch] = result["error"]
+            continue
+        for key in result["removed"]:
+            context.pop(key, None)
+        for key, value in result["updates"].items():
+            if key in owners and merged[key] != value:
+                rule = rules.get(key, default_rule)
+                if rule == "first":
+                    continue
+                elif rule == "merge":
+                    value = _merge_values(merged[key], value)
+                elif rule != "last":
+                    raise ValueError(
+                        f"Conflito no join '{join_id}': a chave '{key}' foi alterada pelos ramos "
+                        f"'{owners[key]}' e '{branch}'."
+                    )
+            merged[key] = value
+            owners[key] = branch
+
+    context.update(merged)
+    return {"branches": list(engine.join_branches[join_id]), "errors": errors}
+
+
+def _merge_values(current: Any, new: Any) -> Any:
+    if isinstance(current, dict) and isinstance(new, dict):
+        return {**current, **new}
+    if isinstance(current, list) and isinstance(new, list):
+        return current + new
+    return new
@@ -0,0 +1,86 @@
+import asyncio
+from typing import List
+
+from langchain_core.messages import HumanMessage
+from langgraph.config import get_stream_writer
+
+from resilience import DeadlineExceeded, llm_upstream_key, within_deadline
+from telemetry import logger, LLM_CALLS
+
+# Executor dos nós `llm` (registrado em node_registry; recurso: `llm`).
+
+
+async def _stream_llm(engine, prompt: str, node_id: str, chunks: List[str]) -> str:
+    """Chama o LLM em modo streaming, emitindo cada token no stream 'custom' do LangGraph."""
+    writer = get_stream_writer()
+    async for chunk in engine.llm.astream([HumanMessage(content=prompt)]):
+        token = chunk.content
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        if not token:
+            continue
+        chunks.append(token)
+        writer({"event": "token", "node": node_id, "token": token})
+    return "".join(chunks)
+
+
+async def _invoke_llm(engine, prompt: str) -> str:
+    msg = await engine.llm.ainvoke([HumanMessage(content=prompt)])
+    # Garantir que o conteúdo seja corretamente decodificado como UTF-8
+    response_content = msg.content
+    if isinstance(response_content, bytes):
+        response_content = response_content.decode('utf-8')
+    return response_content
+
+
+async def call_llm(engine, node_id: str, prompt: str, config) -> str:
+    """Chama o LLM do nó, passando pelo cache de respostas quando habilitado."""
+    streaming = bool((config or {}).get("configurable", {}).get("stream_tokens"))
+    plan = engine.plans[node_id]
+    emitted: List[str] = []
+    if streaming:
+        # Execução via SSE: repassa cada token ao cliente assim que chega
+        call = lambda: _stream_llm(engine, prompt, node_id, emitted)
+    else:
+        call = lambda: _invoke_llm(engine, prompt)
+
+    deadline = engine.deadline(config)
+
+    def compute(deadline=None):
+        # Só chamadas que vão ao modelo passam pelo upstream (acertos do cache não).
+        # Depois do primeiro token enviado ao cliente não há como repetir a chamada.
+        return engine.upstreams.call(
+            llm_upstream_key(engine.llm), lambda timeout: asyncio.wait_for(call(), timeout),
+            retries=plan["retries"], timeout=plan["timeout"], can_retry=lambda: not emitted,
+            deadline=deadline,
+        )
+
+    cache_options = plan["llm_cache"]
+    if engine.llm_cache is None or cache_options is None:
+        LLM_CALLS.inc(engine.flow_name, node_id, "model")
+        return await compute(deadline)
+
+    # Com cache a chamada pode ser compartilhada (coalescing): roda sem o deadline desta
+    # sessão, que só limita a própria espera
+    response_content, source = await within_deadline(engine.llm_cache.get_or_compute(
+        engine.llm, prompt, compute, normalize=cache_options.get("normalize"),
+    ), deadline)
+    LLM_CALLS.inc(engine.flow_name, node_id, "model" if source == "miss" else source)
+    if streaming and source in ("memory", "disk", "coalesced"):
+        # Sem chamada ao modelo: a resposta inteira sai como um único token
+        get_stream_writer()({"event": "token", "node": node_id, "token": response_content, "cached": True})
+    return response_content
+
+
+async def run_llm(engine, node_id: str, action_config: dict, context: dict, config, state=None):
+    try:
+        response_content = await call_llm(engine, node_id, action_config["prompt"], config)
+        return {"response": response_content}, None
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Sem `on_error` o erro derruba a execução, como antes
+        if not engine.nodes_map[node_id].get("on_error"):
+            raise
+        logger.warning("Erro do LLM no nó %s: %s", node_id, e)
+        return {"error": f"{type(e).__name__}: {e}"}, engine.nodes_map[node_id]["on_error"]
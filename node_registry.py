@@ -0,0 +1,182 @@
+import asyncio
+import importlib
+import os
+import resource
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from telemetry import logger
+
+# Registro dos executores de nó, importados só quando um fluxo carregado usa o tipo.
+#
+# Cada tipo aponta para "módulo:função" e declara os recursos compartilhados de que
+# precisa (ex: `llm`, `http_client`). O engine resolve o executor de cada nó uma vez, ao
+# compilar o fluxo (tabela nó -> executor), e pede os recursos ao `LazyResources` do
+# processo: um worker cujos fluxos não têm nó `llm` nunca importa `node_llm` nem cria o
+# cliente da OpenAI.
+#
+# Executor: async (engine, node_id, action_config, context, config, state)
+#           -> (action_result, próximo nó definido pela ação ou None)
+#
+# Tipos novos: `register_executor("tipo", "modulo:funcao", resources=(...))` antes de os
+# fluxos carregarem, ou FLOW_NODE_PLUGINS="tipo=modulo:funcao,..." (sem recursos; lido pelo api.py).
+
+Executor = Callable[..., Awaitable[Tuple[Any, Optional[str]]]]
+# Fábrica de recurso: context manager assíncrono (o `__aexit__` fecha o recurso no shutdown)
+ResourceFactory = Callable[[], AsyncContextManager[Any]]
+
+BUILTIN_EXECUTORS = {
+    "api": ("node_api:run_api", ("http_client",)),
+    "llm": ("node_llm:run_llm", ("llm",)),
+    "output": ("node_core:run_output", ()),
+    "fixed": ("node_core:run_fixed", ()),
+    "if-else": ("node_core:run_if_else", ()),
+    "switch-case": ("node_core:run_switch_case", ()),
+    "map": ("node_core:run_map", ()),
+    "parallel": ("node_core:run_parallel", ()),
+    "join": ("node_core:run_join", ()),
+    "subflow": ("node_core:run_subflow", ()),
+}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta em KB, macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class ExecutorSpec:
+    __slots__ = ("node_type", "target", "resources", "executor", "import_seconds")
+
+    def __init__(self, node_type: str, target: str, resources: Iterable[str] = ()):
+        module, _, function = target.partition(":")
+        if not module or not function:
+            raise ValueError(f"Executor do tipo '{node_type}' deve ser 'modulo:funcao', recebido '{target}'.")
+        self.node_type = node_type
+        self.target = target
+        self.resources = tuple(resources)
+        self.executor: Optional[Executor] = None
+        self.import_seconds = 0.0
+
+
+class NodeExecutorRegistry:
+    """Tipos de nó conhecidos e seus executores (importados no primeiro uso)."""
+
+    def __init__(self, specs: Optional[Dict[str, Tuple[str, Iterable[str]]]] = None):
+        self._specs: Dict[str, ExecutorSpec] = {}
+        for node_type, (target, resources) in (specs or {}).items():
+            self.register(node_type, target, resources)
+
+    def register(self, node_type: str, target: str, resources: Iterable[str] = (), replace: bool = False):
+        if node_type in self._specs and not replace:
+            raise ValueError(f"Tipo de nó '{node_type}' já registrado ({self._specs[node_type].target}).")
+        self._specs[node_type] = ExecutorSpec(node_type, target, resources)
+
+    def types(self) -> Tuple[str, ...]:
+        return tuple(self._specs)
+
+    def resolve(self, node_type: str) -> Executor:
+        """Executor do tipo; o módulo é importado na primeira vez."""
+        spec = self._specs.get(node_type)
+        if spec is None:
+            raise KeyError(f"Tipo de nó desconhecido '{node_type}'.")
+        if spec.executor is None:
+            module, _, function = spec.target.partition(":")
+            inicio = time.perf_counter()
+            executor = getattr(importlib.import_module(module), function)
+            spec.import_seconds = time.perf_counter() - inicio
+            spec.executor = executor
+            logger.info("Executor de nós '%s' carregado (%s, %.1f ms)",
+                        node_type, spec.target, spec.import_seconds * 1000)
+        return spec.executor
+
+    def resources_for(self, node_types: Iterable[str]) -> Tuple[str, ...]:
+        """Recursos compartilhados de que os tipos precisam (sem repetição, na ordem)."""
+        needed: Dict[str, None] = {}
+        for node_type in node_types:
+            for name in self._specs[node_type].resources:
+                needed[name] = None
+        return tuple(needed)
+
+    def stats(self) -> Dict[str, Any]:
+        loaded = {t: round(s.import_seconds * 1000, 1) for t, s in self._specs.items() if s.executor is not None}
+        return {
+            "registered": len(self._specs),
+            "loaded": len(loaded),
+            "import_ms": loaded,
+        }
+
+
+class LazyResources:
+    """
+    Recursos compartilhados pelos executores, criados no primeiro `get` e fechados
+    juntos em `aclose` (na ordem inversa da criação).
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, ResourceFactory] = {}
+        self._values: Dict[str, Any] = {}
+        self._init_seconds: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._stack = AsyncExitStack()
+
+    def register(self, name: str, factory: ResourceFactory):
+        self._factories[name] = factory
+
+    def set(self, name: str, value: Any):
+        """Usa um objeto pronto (ex: dublês do benchmark); quem passou é quem fecha."""
+        self._values[name] = value
+        self._init_seconds.pop(name, None)
+
+    async def get(self, name: str) -> Any:
+        if name in self._values:
+            return self._values[name]
+        factory = self._factories.get(name)
+        if factory is None:
+            raise KeyError(f"Recurso '{name}' não registrado.")
+        # Dois fluxos compilando ao mesmo tempo esperam a mesma criação
+        async with self._locks.setdefault(name, asyncio.Lock()):
+            if name in self._values:
+                return self._values[name]
+            inicio = time.perf_counter()
+            self._values[name] = await self._stack.enter_async_context(factory())
+            self._init_seconds[name] = time.perf_counter() - inicio
+        logger.info("Recurso '%s' criado (%.1f ms)", name, self._init_seconds[name] * 1000)
+        return self._values[name]
+
+    async def aclose(self):
+        await self._stack.aclose()
+        self._values.clear()
+        self._init_seconds.clear()
+        self._stack = AsyncExitStack()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "registered": len(self._factories),
+            "created": len(self._values),
+            "init_ms": {name: round(seconds * 1000, 1) for name, seconds in self._init_seconds.items()},
+        }
+
+
+REGISTRY = NodeExecutorRegistry(BUILTIN_EXECUTORS)
+
+
+def register_executor(node_type: str, target: str, resources: Iterable[str] = (), replace: bool = False):
+    """Registra um tipo de nó novo (ou troca o executor de um existente, com `replace=True`)."""
+    REGISTRY.register(node_type, target, resources, replace=replace)
+
+
+def node_types() -> Tuple[str, ...]:
+    return REGISTRY.types()
+
+
+def register_plugins(spec: Optional[str] = None):
+    """Tipos de FLOW_NODE_PLUGINS ("tipo=modulo:funcao,..."); só o nome é lido aqui, sem importar."""
+    spec = os.getenv("FLOW_NODE_PLUGINS", "") if spec is None else spec
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        node_type, _, target = entry.partition("=")
+        if not target:
+            raise ValueError(f"Entrada inválida em FLOW_NODE_PLUGINS: '{entry}' (use tipo=modulo:funcao).")
+        register_executor(node_type.strip(), target.strip(), replace=True)
@@ -0,0 +1,414 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from http_cache import decoded_headers
+from telemetry import UPSTREAM_EVENTS
+
+# Proteções por upstream (host HTTP ou provedor de LLM) compartilhadas por todos os fluxos:
+#
+# - Bulkhead: no máximo `max_concurrency` chamadas simultâneas por upstream; quem espera
+#   mais que `queue_timeout` por uma vaga falha na hora (não empilha sessões no worker).
+# - Timeout adaptativo: `p99 observado x timeout_multiplier`, limitado a
+#   [`min_timeout`, `max_timeout`]; até juntar `min_samples` vale `max_timeout`.
+# - Retries com backoff exponencial e jitter ("full jitter"), só em chamadas idempotentes
+#   e só para falhas passageiras (timeout, conexão, 429/502/503/504).
+# - Circuit breaker: `failure_threshold` falhas seguidas abrem o circuito por
+#   `reset_timeout` segundos (chamadas falham na hora); depois uma chamada de teste
+#   decide se fecha de novo.
+# - Deadline da execução (`deadline`, em `time.monotonic()`): o timeout de cada tentativa
+#   nunca passa do orçamento restante, e um timeout causado pelo orçamento levanta
+#   `DeadlineExceeded` (não é falha do upstream, não conta para o circuito).
+
+# Status HTTP tratados como falha passageira do upstream
+RETRY_STATUSES = (429, 502, 503, 504)
+# Métodos que podem ser repetidos sem efeito colateral
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class UpstreamUnavailable(Exception):
+    """Chamada recusada antes de sair do processo (circuito aberto ou bulkhead cheio)."""
+
+
+class DeadlineExceeded(Exception):
+    """O orçamento de tempo da execução acabou (X-Deadline-Ms ou `deadline_ms` do fluxo)."""
+
+
+def remaining_budget(deadline: Optional[float]) -> Optional[float]:
+    """Segundos até o deadline (None = sem deadline); levanta `DeadlineExceeded` se já passou."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Orçamento de tempo da execução esgotado")
+    return remaining
+
+
+async def within_deadline(awaitable: Awaitable[Any], deadline: Optional[float]) -> Any:
+    """
+    Espera `awaitable` só até o deadline do chamador. Para chamadas compartilhadas (cache
+    com coalescing): a chamada roda sem o deadline de ninguém, e cada sessão desiste dela
+    no próprio prazo sem cancelá-la para as demais (o `shield` fica dentro do cache).
+    """
+    try:
+        remaining = remaining_budget(deadline)
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()  # nunca vai ser esperada
+        raise
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        if time.monotonic() < deadline:
+            raise  # timeout da própria chamada, não do orçamento
+        raise DeadlineExceeded("Orçamento de tempo da execução esgotado") from None
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class UpstreamPolicy:
+    """Parâmetros de um upstream; `FLOW_UPSTREAMS` (api.py) sobrescreve por chave."""
+
+    __slots__ = ("max_concurrency", "queue_timeout", "retries", "backoff_base", "backoff_max",
+                 "min_timeout", "max_timeout", "timeout_multiplier", "min_samples",
+                 "failure_threshold", "reset_timeout")
+
+    DEFAULTS = {
+        "max_concurrency": 20,
+        "queue_timeout": 10.0,
+        "retries": 2,
+        "backoff_base": 0.1,
+        "backoff_max": 2.0,
+        "min_timeout": 1.0,
+        "max_timeout": 60.0,
+        "timeout_multiplier": 3.0,
+        "min_samples": 20,
+        "failure_threshold": 5,
+        "reset_timeout": 30.0,
+    }
+
+    def __init__(self, **overrides: Any):
+        unknown = set(overrides) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Parâmetros de upstream desconhecidos: {', '.join(sorted(unknown))}")
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, type(default)(overrides.get(name, default)))
+
+    def merged(self, overrides: Dict[str, Any]) -> "UpstreamPolicy":
+        return UpstreamPolicy(**{**{name: getattr(self, name) for name in self.__slots__}, **overrides})
+
+
+class LatencyWindow:
+    """Últimas `size` latências (s) de um upstream, para os percentis do timeout adaptativo."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+        self._sorted: Optional[list] = None
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Se a chamada pode sair; no meio-aberto só uma chamada de teste por vez."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def failure(self) -> bool:
+        """Registra a falha; True se o circuito acabou de abrir."""
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            opened = self.state != self.OPEN
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            return opened
+        return False
+
+    def release(self):
+        """Chamada de teste terminou sem veredito (ex: erro 4xx, cancelamento)."""
+        self._probing = False
+
+
+def _classify(error: BaseException):
+    """(pode repetir?, conta como falha do upstream?) para uma exceção da chamada."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in RETRY_STATUSES, status >= 500 or status == 429
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True, True
+    # Erros dos SDKs de LLM (openai, etc.): status HTTP ou nome da classe
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUSES, status >= 500 or status == 429
+    name = type(error).__name__
+    if "Timeout" in name or "Connection" in name:
+        return True, True
+    return False, False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Upstream:
+    """Estado de um upstream: bulkhead, janela de latência, circuito e contadores."""
+
+    def __init__(self, key: str, policy: UpstreamPolicy):
+        self.key = key
+        self.policy = policy
+        self.semaphore = asyncio.Semaphore(policy.max_concurrency)
+        self.latency = LatencyWindow()
+        self.breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def timeout(self) -> float:
+        policy = self.policy
+        if len(self.latency) < policy.min_samples:
+            return policy.max_timeout
+        p99 = self.latency.percentile(0.99)
+        return max(policy.min_timeout, min(policy.max_timeout, p99 * policy.timeout_multiplier))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.breaker.state,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.policy.max_concurrency,
+            "timeout_s": self.timeout(),
+            "p50_s": self.latency.percentile(0.5),
+            "p99_s": self.latency.percentile(0.99),
+            "samples": len(self.latency),
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamRegistry:
+    """Upstreams do processo, criados sob demanda com a política padrão ou a da chave."""
+
+    def __init__(self, default: Optional[Dict[str, Any]] = None,
+                 overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.default = UpstreamPolicy(**(default or {}))
+        self.overrides = dict(overrides or {})
+        self._upstreams: Dict[str, Upstream] = {}
+
+    def get(self, key: str) -> Upstream:
+        upstream = self._upstreams.get(key)
+        if upstream is None:
+            policy = self.default.merged(self.overrides.get(key, {}))
+            upstream = self._upstreams[key] = Upstream(key, policy)
+        return upstream
+
+    async def call(self, key: str, fn: Callable[[float], Awaitable[Any]], idempotent: bool = True,
+                   retries: Optional[int] = None, timeout: Optional[float] = None,
+                   can_retry: Optional[Callable[[], bool]] = None, deadline: Optional[float] = None) -> Any:
+        """
+        Executa `fn(timeout)` com as proteções do upstream `key`.
+
+        `timeout` fixo desliga o adaptativo; `retries` sobrescreve o da política
+        (chamadas não idempotentes nunca são repetidas); `can_retry()` pode vetar uma
+        repetição (ex: streaming que já emitiu tokens). Com `deadline`, espera na fila,
+        timeouts e backoff ficam dentro do orçamento restante.
+        """
+        upstream = self.get(key)
+        policy = upstream.policy
+        attempts = 1 + (max(0, policy.retries if retries is None else int(retries)) if idempotent else 0)
+
+        for attempt in range(attempts):
+            remaining = remaining_budget(deadline)
+            if not upstream.breaker.allow():
+                upstream.rejected += 1
+                UPSTREAM_EVENTS.inc(key, "circuit_open")
+                raise CircuitOpenError(f"Circuito aberto para '{key}'")
+            try:
+                await asyncio.wait_for(upstream.semaphore.acquire(), min(policy.queue_timeout, remaining or math.inf))
+            except asyncio.TimeoutError:
+                upstream.breaker.release()
+                remaining_budget(deadline)
+                upstream.rejected += 1
+                UPSTREAM_EVENTS.inc(key, "bulkhead_full")
+                raise BulkheadFullError(
+                    f"'{key}' já tem {policy.max_concurrency} chamadas em andamento"
+                ) from None
+
+            call_timeout = timeout or upstream.timeout()
+            # Tentativa limitada pelo orçamento da execução, não pela política do upstream
+            bounded = False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < call_timeout:
+                    call_timeout, bounded = max(remaining, 0.001), True
+            upstream.in_flight += 1
+            upstream.calls += 1
+            inicio = time.perf_counter()
+            try:
+                result = await fn(call_timeout)
+            except BaseException as e:
+                elapsed = time.perf_counter() - inicio
+                retryable, is_failure = _classify(e) if isinstance(e, Exception) else (False, False)
+                if bounded and "Timeout" in type(e).__name__ and elapsed >= call_timeout * 0.99:
+                    # Quem estourou foi o orçamento da execução, não o upstream
+                    upstream.breaker.release()
+                    raise DeadlineExceeded("Orçamento de tempo esgotado durante a chamada a "
+                                           f"'{key}'") from e
+                if not is_failure:
+                    # Erro do chamador (4xx, validação) ou cancelamento: o upstream respondeu
+                    upstream.breaker.release()
+                    raise
+                # Timeout entra na janela com o próprio valor: o p99 sobe em vez de encolher
+                upstream.latency.add(max(elapsed, call_timeout) if "Timeout" in type(e).__name__ else elapsed)
+                upstream.failures += 1
+                UPSTREAM_EVENTS.inc(key, "timeout" if "Timeout" in type(e).__name__ else "failure")
+                if upstream.breaker.failure():
+                    UPSTREAM_EVENTS.inc(key, "circuit_opened")
+                last = attempt == attempts - 1
+                if not retryable or last or (can_retry is not None and not can_retry()):
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** attempt))
+                if deadline is not None and time.monotonic() + min(delay, policy.backoff_max) >= deadline:
+                    # Não há tempo para outra tentativa: o erro do upstream é o resultado
+                    raise
+                upstream.retries += 1
+                UPSTREAM_EVENTS.inc(key, "retry")
+            else:
+                upstream.latency.add(time.perf_counter() - inicio)
+                upstream.breaker.success()
+                return result
+            finally:
+                upstream.in_flight -= 1
+                upstream.semaphore.release()
+            await asyncio.sleep(min(delay, policy.backoff_max))
+
+    def stats(self) -> Dict[str, Any]:
+        return {key: upstream.stats() for key, upstream in self._upstreams.items()}
+
+
+class GuardedClient:
+    """
+    `request()` de um `httpx.AsyncClient` passando pelas proteções do upstream, para uso
+    por `HttpResponseCache` (acertos do cache nem chegam aqui e não entram na latência).
+    Status passageiros são repetidos; esgotadas as tentativas, a última resposta volta
+    ao chamador como uma resposta comum.
+    """
+
+    def __init__(self, upstreams: UpstreamRegistry, client: httpx.AsyncClient, idempotent: bool = True,
+                 retries: Optional[int] = None, timeout: Optional[float] = None,
+                 deadline: Optional[float] = None):
+        self.upstreams = upstreams
+        self.client = client
+        self.idempotent = idempotent
+        self.retries = retries
+        self.timeout = timeout
+        self.deadline = deadline
+
+    async def request(self, method: str, url: str, read: Optional[Callable[[httpx.Response], Awaitable[bytes]]] = None,
+                      **kwargs: Any) -> httpx.Response:
+        """
+        Com `read`, o corpo de respostas 2xx é lido em streaming por `read(response)` (ex:
+        com limite de tamanho e projeção) dentro da tentativa, e o que ele devolve vira o
+        `content` da resposta.
+        """
+        kwargs.pop("timeout", None)
+
+        async def send(timeout: float) -> httpx.Response:
+            if read is None:
+                return await self.client.request(method, url, timeout=timeout, **kwargs)
+            async with self.client.stream(method, url, timeout=timeout, **kwargs) as response:
+                if not 200 <= response.status_code < 300:
+                    await response.aread()
+                    return response
+                content = await read(response)
+            return httpx.Response(response.status_code, headers=decoded_headers(response.headers),
+                                  content=content, request=response.request)
+
+        async def attempt(timeout: float) -> httpx.Response:
+            response = await asyncio.wait_for(send(timeout), timeout)
+            if response.status_code >= 500 or response.status_code == 429:
+                raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request,
+                                            response=response)
+            return response
+
+        try:
+            return await self.upstreams.call(http_upstream_key(url), attempt, idempotent=self.idempotent,
+                                             retries=self.retries, timeout=self.timeout,
+                                             deadline=self.deadline)
+        except httpx.HTTPStatusError as e:
+            return e.response
+
+
+def http_upstream_key(url: str) -> str:
+    """Bulkhead por host (com porta, se não for a padrão)."""
+    try:
+        return httpx.URL(url).netloc.decode("ascii") or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def llm_upstream_key(llm: Any) -> str:
+    """Provedor + modelo: um brown-out do provedor não consome as vagas de outro."""
+    # Wrappers (ex: cassette.CassetteChatModel) mantêm o upstream do modelo original
+    llm = getattr(llm, "wrapped", llm)
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+    return f"llm:{type(llm).__name__}:{model}".rstrip(":")
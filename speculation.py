@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from telemetry import SPECULATIONS
+
+# Resultados especulativos por sessão (thread_id).
+#
+# Quando uma sessão para num `output`, o engine adianta as ações dos nós seguintes
+# que não dependem da resposta do usuário (ver `flow_plan._prefetch_chains`) e guarda
+# aqui, por nó, a `action_config` renderizada e a task da ação. No resume, o nó só
+# aproveita a task se a `action_config` renderizada com o contexto real for igual:
+# é ela que determina a chamada, então igualdade garante o mesmo resultado.
+
+
+class _Session:
+    __slots__ = ("started_at", "task", "entries")
+
+    def __init__(self, task: Optional[asyncio.Future]):
+        self.started_at = time.monotonic()
+        self.task = task
+        # nó -> (action_config renderizada, task da ação)
+        self.entries: Dict[str, Tuple[Any, asyncio.Future]] = {}
+
+
+class SpeculationStash:
+    """
+    Especulações em andamento/concluídas por sessão, com TTL e teto de sessões (LRU).
+    Sessões que passam do TTL ou saem pelo teto têm as tasks canceladas.
+    """
+
+    def __init__(self, flow_name: str, ttl: float = 300.0, max_sessions: int = 1000):
+        self.flow_name = flow_name
+        self.ttl = float(ttl)
+        self.max_sessions = int(max_sessions)
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+    def _drop(self, thread_id: str, outcome: str):
+        session = self._sessions.pop(thread_id, None)
+        if session is None:
+            return
+        if session.task is not None:
+            session.task.cancel()
+        for node_id, (_, future) in session.entries.items():
+            future.cancel()
+            SPECULATIONS.inc(self.flow_name, node_id, outcome)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._sessions:
+            thread_id, session = next(iter(self._sessions.items()))
+            if now - session.started_at <= self.ttl:
+                break
+            self._drop(thread_id, "expired")
+
+    def start(self, thread_id: str, task: asyncio.Future):
+        """Registra a especulação de uma sessão, descartando a anterior (se houver)."""
+        self._expire()
+        self._drop(thread_id, "abandoned")
+        self._sessions[thread_id] = _Session(task)
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)), "evicted")
+
+    def put(self, thread_id: str, node_id: str, action_config: Any, future: asyncio.Future) -> bool:
+        session = self._sessions.get(thread_id)
+        if session is None:
+            future.cancel()
+            return False
+        session.entries[node_id] = (action_config, future)
+        SPECULATIONS.inc(self.flow_name, node_id, "started")
+        return True
+
+    def take(self, thread_id: str, node_id: str, action_config: Any) -> Optional[asyncio.Future]:
+        """
+        Retira a especulação do nó; devolve a task se a `action_config` bate,
+        senão cancela (entradas mudaram) e devolve None.
+        """
+        session = self._sessions.get(thread_id)
+        if session is None or node_id not in session.entries:
+            return None
+        speculated_config, future = session.entries.pop(node_id)
+        if speculated_config != action_config:
+            future.cancel()
+            SPECULATIONS.inc(self.flow_name, node_id, "discarded")
+            return None
+        return future
+
+    def discard(self, thread_id: str):
+        """Sessão terminou ou seguiu outro caminho: descarta o que sobrou."""
+        self._drop(thread_id, "abandoned")
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,319 @@
+import bisect
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Instrumentação do engine: logger com nível, métricas no formato Prometheus
+# (sem dependência externa) e exportação opcional de spans em JSON lines.
+
+logger = logging.getLogger("flow")
+
+
+def configure_logging(level: Optional[str] = None):
+    """
+    Nível via FLOW_LOG_LEVEL (padrão INFO). Os logs por nó/passo são DEBUG e usam
+    argumentos preguiçosos (`%s`), então com o nível acima disso não há formatação.
+    """
+    level = (level or os.getenv("FLOW_LOG_LEVEL", "INFO")).upper()
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+# --- Métricas ---
+
+# Buckets (segundos) cobrindo de render de template (sub-ms) a chamadas de LLM (s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # As séries são atualizadas no loop de eventos e lidas pelo /metrics;
+        # o lock cobre o caso de threads (to_thread) sem custo relevante
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values: Any, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: Any) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # série -> [contagem por bucket..., soma, total]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, seconds: float, *label_values: Any):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+NODE_PHASE_SECONDS = Histogram(
+    "flow_node_phase_seconds",
+    "Tempo de cada fase da execução de um nó (pre_update, render, action, post_update).",
+    ("flow", "node", "type", "phase"),
+)
+NODE_ERRORS = Counter(
+    "flow_node_errors_total", "Nós que terminaram com exceção.", ("flow", "node", "type"),
+)
+HTTP_RESPONSES = Counter(
+    "flow_http_responses_total",
+    "Respostas de nós api por status HTTP (`error` para falhas de conexão/timeout).",
+    ("flow", "node", "status"),
+)
+LLM_CALLS = Counter(
+    "flow_llm_calls_total",
+    "Chamadas de nós llm por origem da resposta (model, memory, disk, coalesced, bypass).",
+    ("flow", "node", "source"),
+)
+SPECULATIONS = Counter(
+    "flow_speculations_total",
+    "Ações adiantadas enquanto a sessão espera o usuário, por desfecho "
+    "(started, committed, discarded, failed, abandoned, expired, evicted).",
+    ("flow", "node", "outcome"),
+)
+UPSTREAM_EVENTS = Counter(
+    "flow_upstream_events_total",
+    "Eventos das proteções por upstream (retry, timeout, failure, circuit_opened, circuit_open, bulkhead_full).",
+    ("upstream", "event"),
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "flow_admission_wait_seconds",
+    "Espera na admissão das execuções, por etapa (session, global) e desfecho (admitted, rejected).",
+    ("stage", "outcome"),
+)
+ADMISSION_REJECTED = Counter(
+    "flow_admission_rejected_total",
+    "Execuções recusadas pela admissão (session_queue_full, session_timeout, queue_full, queue_timeout).",
+    ("reason",),
+)
+REQUEST_SECONDS = Histogram(
+    "flow_request_seconds", "Duração das requisições de execução de fluxo.", ("flow", "endpoint", "outcome"),
+)
+CHECKPOINT_BYTES = Histogram(
+    "flow_checkpoint_bytes",
+    "Tamanho serializado de cada valor gravado pelo checkpointer (checkpoint, canal ou write), "
+    "por codificação (msgpack, msgpack+zlib).",
+    ("encoding",),
+    buckets=(128, 512, 2048, 8192, 32768, 131072, 524288, 2097152),
+)
+
+REGISTRY: List[_Metric] = [NODE_PHASE_SECONDS, NODE_ERRORS, HTTP_RESPONSES, LLM_CALLS, SPECULATIONS, UPSTREAM_EVENTS,
+                           ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED, REQUEST_SECONDS, CHECKPOINT_BYTES]
+
+
+_INVALID_METRIC_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _stats_gauges(stats: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Contadores do /stats (caches, checkpointer) como gauges `flow_<seção>_<nome>`."""
+    lines = []
+    seen = set()
+    for section, values in stats.items():
+        for name, value in (values or {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            # Chaves do /stats podem ter `-` ou `.`, inválidos num nome de métrica
+            metric = _INVALID_METRIC_CHARS.sub("_", f"flow_{section}_{name}")
+            if metric in seen:
+                continue
+            seen.add(metric)
+            lines.append(f"# HELP {metric} /stats {_escape(section)}.{_escape(name)}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return lines
+
+
+def render_metrics(stats: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """Todas as métricas no formato texto do Prometheus (0.0.4)."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    if stats:
+        lines.extend(_stats_gauges(stats))
+    return "\n".join(lines) + "\n"
+
+
+# --- Spans ---
+
+class SpanExporter:
+    """Grava spans finalizados em um arquivo JSON lines (um objeto por linha)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Dict[str, Any]):
+        line = json.dumps(span, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_exporter: Optional[SpanExporter] = None
+_current_span: contextvars.ContextVar = contextvars.ContextVar("flow_current_span", default=None)
+
+
+def configure_tracing(path: Optional[str] = None) -> Optional[SpanExporter]:
+    """Liga a exportação de spans em `path` (ou FLOW_TRACE_FILE); sem caminho, desliga."""
+    global _exporter
+    path = path if path is not None else os.getenv("FLOW_TRACE_FILE")
+    if _exporter is not None:
+        _exporter.close()
+    _exporter = SpanExporter(path) if path else None
+    return _exporter
+
+
+def tracing_enabled() -> bool:
+    return _exporter is not None
+
+
+def flush_spans():
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def trace_id_for(thread_id: Optional[str]) -> str:
+    """
+    O trace é derivado do thread_id: todas as chamadas de uma sessão (início e cada
+    resume) caem no mesmo trace, sem precisar guardar nada no estado do fluxo.
+    """
+    if not thread_id:
+        return os.urandom(16).hex()
+    return hashlib.sha256(str(thread_id).encode("utf-8")).hexdigest()[:32]
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "attributes")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.attributes = attributes
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def to_dict(self, end: float, status: str) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": end,
+            "duration_ms": (end - self.start) * 1000,
+            "status": status,
+            "attributes": self.attributes,
+        }
+
+
+@contextmanager
+def span(name: str, thread_id: Optional[str] = None, **attributes: Any):
+    """
+    Abre um span filho do span atual (contextvar, propagado para as tasks do LangGraph).
+    Com a exportação desligada não aloca nada e devolve None.
+    """
+    exporter = _exporter
+    if exporter is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent is not None else trace_id_for(thread_id)
+    if thread_id is not None:
+        attributes["thread_id"] = thread_id
+    current = Span(name, trace_id, parent.span_id if parent is not None else None, attributes)
+    token = _current_span.set(current)
+    status = "ok"
+    try:
+        yield current
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        exporter.export(current.to_dict(time.time(), status))
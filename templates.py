@@ -1,19 +1,185 @@
-from jinja2 import Template
-from typing import Any
+import re
+from collections.abc import Mapping
+from functools import lru_cache
+from jinja2 import Environment, Undefined, nodes
+from typing import Any, List
 
-def render_data(data: Any, context: dict) -> Any:
+from telemetry import logger
+
+# Ambiente único compartilhado por todos os fluxos: os templates são compilados
+# uma vez (no carregamento do fluxo) e só renderizados a cada execução de nó.
+env = Environment()
+
+# Marcadores de sintaxe Jinja2. Strings sem nenhum deles são literais e não
+# precisam passar pelo parser.
+_JINJA_MARKERS = ("{{", "{%", "{#")
+# Template que é uma única expressão: "{{ context.x }}" (com ou sem `-` de controle de espaço)
+_SINGLE_EXPRESSION = re.compile(r"^\{\{-?(.*?)-?\}\}$", re.DOTALL)
+
+# Modo nativo (fluxos com `"render": "native"`): um template que é uma única expressão
+# devolve o objeto do contexto (int, lista, dict...), sem virar string nem ser copiado;
+# templates com texto em volta ou várias expressões continuam gerando strings.
+
+
+class CompiledTemplate:
+    """Folha templada já compilada; guarda a string original para fallback."""
+
+    __slots__ = ("source", "template", "expression")
+
+    def __init__(self, source: str, template, expression=None):
+        self.source = source
+        self.template = template
+        # Só no modo nativo: a expressão única do template, avaliada sem passar por string
+        self.expression = expression
+
+    def render(self, context: dict) -> Any:
+        try:
+            if self.expression is not None:
+                return _native_value(self.expression(context=context))
+            # Permite acessar variáveis como {{ context.var }}
+            return self.template.render(context=context)
+        except Exception as e:
+            logger.warning("Erro ao renderizar template %r: %s", self.source, e)
+            return self.source
+
+    def __repr__(self):
+        return f"CompiledTemplate({self.source!r})"
+
+
+def _native_value(value: Any) -> Any:
+    if isinstance(value, Undefined):
+        # Como no modo string, onde uma chave ausente renderiza ""
+        return ""
+    if isinstance(value, Mapping) and not isinstance(value, dict):
+        # Ex: `{{ context }}` devolveria o LayeredContext do nó
+        return dict(value)
+    return value
+
+
+def is_templated(data: str) -> bool:
+    return any(marker in data for marker in _JINJA_MARKERS)
+
+
+def _single_expression(data: str):
+    """Expressão compilada se o template for só "{{ expr }}"; None caso contrário."""
+    body = env.parse(data).body
+    if len(body) != 1 or not isinstance(body[0], nodes.Output) or len(body[0].nodes) != 1 \
+            or isinstance(body[0].nodes[0], nodes.TemplateData):
+        return None
+    match = _SINGLE_EXPRESSION.match(data)
+    if match is None:
+        return None
+    return env.compile_expression(match.group(1), undefined_to_none=False)
+
+
+@lru_cache(maxsize=1024)
+def compile_string(data: str, native: bool = False) -> Any:
+    """Compila uma string; retorna a própria string se ela for literal (ou inválida)."""
+    if not is_templated(data):
+        return data
+    try:
+        return CompiledTemplate(data, env.from_string(data), _single_expression(data) if native else None)
+    except Exception as e:
+        logger.warning("Erro ao compilar template %r: %s", data, e)
+        return data
+
+
+def compile_data(data: Any, native: bool = False) -> Any:
+    """
+    Pré-compila recursivamente strings/dicionários/listas.
+
+    O resultado tem a mesma forma de `data`, com cada folha templada trocada por
+    um `CompiledTemplate`; folhas literais são mantidas como estão.
+    """
+    if isinstance(data, str):
+        return compile_string(data, native)
+    elif isinstance(data, dict):
+        return {k: compile_data(v, native) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [compile_data(item, native) for item in data]
+    return data
+
+
+def render_compiled(plan: Any, context: dict) -> Any:
+    """Renderiza um plano gerado por `compile_data` com o contexto atual."""
+    if isinstance(plan, CompiledTemplate):
+        return plan.render(context)
+    elif isinstance(plan, dict):
+        return {k: render_compiled(v, context) for k, v in plan.items()}
+    elif isinstance(plan, list):
+        return [render_compiled(item, context) for item in plan]
+    return plan
+
+
+def render_data(data: Any, context: dict, native: bool = False) -> Any:
     """
     Renderiza recursivamente strings ou dicionários usando Jinja2 e o contexto atual.
     """
     if isinstance(data, str):
-        try:
-            # Permite acessar variáveis como {{ context.var }}
-            return Template(data).render(context=context)
-        except Exception as e:
-            print(f"Erro ao renderizar template: {e}")
-            return data
+        compiled = compile_string(data, native)
+        if isinstance(compiled, CompiledTemplate):
+            return compiled.render(context)
+        return data
     elif isinstance(data, dict):
-        return {k: render_data(v, context) for k, v in data.items()}
+        return {k: render_data(v, context, native) for k, v in data.items()}
     elif isinstance(data, list):
-        return [render_data(item, context) for item in data]
-    return data
\ No newline at end of file
+        return [render_data(item, context, native) for item in data]
+    return data
+
+
+def _context_chain(node) -> Any:
+    """Chaves de um acesso `context.a["b"][0]`; None se a raiz não for `context`."""
+    keys = []
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        if isinstance(node, nodes.Getattr):
+            keys.append(node.attr)
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, (str, int)):
+            keys.append(node.arg.value)
+        else:
+            # Chave dinâmica: só o trecho constante antes dela é conhecido
+            keys.clear()
+        node = node.node
+    if isinstance(node, nodes.Name) and node.name == "context":
+        return keys[::-1]
+    return None
+
+
+def _collect_references(node, references: list):
+    if isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        chain = _context_chain(node)
+        if chain is not None:
+            references.append(chain)
+            # Chaves dinâmicas podem ler outras partes do contexto
+            while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+                if isinstance(node, nodes.Getitem):
+                    _collect_references(node.arg, references)
+                node = node.node
+            return
+    elif isinstance(node, nodes.Name) and node.name == "context":
+        references.append([])
+        return
+    for child in node.iter_child_nodes():
+        _collect_references(child, references)
+
+
+def _compiled_sources(plan: Any):
+    if isinstance(plan, CompiledTemplate):
+        yield plan.source
+    elif isinstance(plan, dict):
+        for value in plan.values():
+            yield from _compiled_sources(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _compiled_sources(item)
+
+
+def context_references(plan: Any) -> List[list]:
+    """
+    Acessos ao contexto feitos pelos templates de um plano compilado, como listas de
+    chaves a partir de `context` (`context.result.data.name` -> ["result", "data", "name"]).
+    `context` usado inteiro aparece como [].
+    """
+    references: List[list] = []
+    for source in _compiled_sources(plan):
+        _collect_references(env.parse(source), references)
+    return references
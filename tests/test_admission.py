@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_execucoes_da_mesma_sessao_em_ordem_fifo():
+    admission = AdmissionController(max_in_flight=4)
+    ordem = []
+
+    async def execucao(i):
+        async with admission.admit("s"):
+            ordem.append(("inicio", i))
+            await asyncio.sleep(0.005)
+            ordem.append(("fim", i))
+
+    async def main():
+        tasks = []
+        for i in range(4):
+            tasks.append(asyncio.ensure_future(execucao(i)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert ordem == [(etapa, i) for i in range(4) for etapa in ("inicio", "fim")]
+    assert admission.stats()["sessions"] == 0
+
+
+def test_fila_da_sessao_cheia_e_espera_longa_viram_429():
+    admission = AdmissionController(max_session_queue=1, session_timeout=0.02)
+
+    async def main():
+        ticket = await admission.acquire("s")
+        esperando = asyncio.ensure_future(admission.acquire("s"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as cheia:
+            await admission.acquire("s")
+        with pytest.raises(AdmissionRejected) as expirou:
+            await esperando
+        ticket.release()
+        return cheia.value, expirou.value
+
+    cheia, expirou = asyncio.run(main())
+    assert (cheia.status_code, cheia.reason) == (429, "session_queue_full")
+    assert (expirou.status_code, expirou.reason) == (429, "session_timeout")
+    assert cheia.retry_after >= 1 and expirou.retry_after >= 1
+    assert admission.stats()["sessions"] == 0
+
+
+def test_fila_global_cheia_e_espera_longa_viram_503():
+    admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.02)
+
+    async def main():
+        ticket = await admission.acquire("a")
+        esperando = asyncio.ensure_future(admission.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as cheia:
+            await admission.acquire("c")
+        with pytest.raises(AdmissionRejected) as expirou:
+            await esperando
+        ticket.release()
+        # Com a vaga livre, a próxima entra direto
+        (await admission.acquire("d")).release()
+        return cheia.value, expirou.value
+
+    cheia, expirou = asyncio.run(main())
+    assert (cheia.status_code, cheia.reason) == (503, "queue_full")
+    assert (expirou.status_code, expirou.reason) == (503, "queue_timeout")
+    stats = admission.stats()
+    assert (stats["in_flight"], stats["queued"], stats["rejected"], stats["sessions"]) == (0, 0, 2, 0)
+
+
+def test_recusa_sai_com_retry_after_na_api(monkeypatch):
+    admission = AdmissionController(max_in_flight=1, max_queue=0, max_session_queue=0)
+    monkeypatch.setattr(api, "admission", admission)
+
+    async def main():
+        ticket = await admission.acquire("ocupada")
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            async def post(user):
+                return await client.post("/execute/flow_definition", json={"messages": []},
+                                         headers={"x-user-id": user})
+            respostas = await post("ocupada"), await post("outra")
+        ticket.release()
+        return respostas
+
+    sessao, processo = asyncio.run(main())
+    assert sessao.status_code == 429
+    assert processo.status_code == 503
+    assert int(sessao.headers["retry-after"]) >= 1
+    assert int(processo.headers["retry-after"]) >= 1
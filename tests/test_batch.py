@@ -0,0 +1,62 @@
+import asyncio
+
+from batch import BatchItemError, run_batch
+
+
+async def _lines(lines):
+    for line in lines:
+        yield line
+
+
+def _collect(lines, run_item, concurrency):
+    async def main():
+        return [result async for result in run_batch(_lines(lines), run_item, concurrency)]
+    return asyncio.run(main())
+
+
+def test_itens_da_mesma_sessao_rodam_em_sequencia_na_ordem_da_entrada():
+    running, order = set(), []
+
+    async def run_item(user_id, messages, item):
+        # Como a fila da sessão da admissão com tamanho zero: concorrência na sessão é recusada
+        if user_id in running:
+            raise BatchItemError("rejected", "session busy")
+        running.add(user_id)
+        try:
+            await asyncio.sleep(0.01 * (3 - item["n"] % 3))
+            order.append((user_id, item["n"]))
+            return {"status": "completed", "message": str(item["n"])}
+        finally:
+            running.discard(user_id)
+
+    lines = [f'{{"user_id": "{u}", "n": {n}}}' for n in range(6) for u in ("a", "b")]
+    results = _collect(lines, run_item, concurrency=8)
+
+    assert len(results) == 12
+    assert all(r["status"] == "completed" for r in results)
+    for user in ("a", "b"):
+        assert [n for u, n in order if u == user] == list(range(6))
+
+
+def test_sessoes_diferentes_rodam_em_paralelo():
+    active, peak = [0], [0]
+
+    async def run_item(user_id, messages, item):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        return {"status": "completed"}
+
+    _collect([f'{{"user_id": "u{i}"}}' for i in range(8)], run_item, concurrency=4)
+    assert peak[0] == 4
+
+
+def test_itens_invalidos_nao_travam_a_sessao():
+    async def run_item(user_id, messages, item):
+        return {"status": "completed"}
+
+    results = _collect(['{"user_id": "a"}', "nao e json", '{"user_id": "a", "messages": 1}', '{"user_id": "a"}'],
+                       run_item, concurrency=2)
+    assert sorted((r["index"], r["status"]) for r in results) == \
+        [(0, "completed"), (1, "invalid"), (2, "invalid"), (3, "completed")]
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+
+from langgraph.checkpoint.base import empty_checkpoint
+
+from checkpointers import BoundedMemorySaver, CompactSerializer, SqliteSaver, checkpointer_stats
+
+
+def _config(thread_id="t", checkpoint_id=None, ns=""):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ns}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def _checkpoint(value):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"context": value}
+    return checkpoint
+
+
+async def _put(saver, config, value):
+    return await saver.aput(config, _checkpoint(value), {"step": value}, {})
+
+
+def _sqlite(tmp_path, **kwargs):
+    return SqliteSaver(str(tmp_path / "ck.db"), pool_size=2, serde=CompactSerializer(), **kwargs)
+
+
+def test_batch_grava_tudo_numa_transacao(tmp_path):
+    saver = _sqlite(tmp_path)
+
+    async def main():
+        async with saver.batch("t"):
+            config = _config()
+            for step in range(3):
+                config = await _put(saver, config, step)
+            await saver.aput_writes(config, [("context", {"x": 1})], "task1")
+            # Leitura dentro do batch enxerga o que ainda não foi gravado
+            assert (await saver.aget_tuple(_config())).checkpoint["channel_values"]["context"] == 2
+        return config
+
+    config = asyncio.run(main())
+    assert saver.flushes == 1
+    assert len(list(saver.list(_config()))) == 3
+    saved = saver.get_tuple(config)
+    assert saved.pending_writes == [("task1", "context", {"x": 1})]
+
+
+def test_keep_latest_descarta_checkpoints_intermediarios(tmp_path):
+    saver = _sqlite(tmp_path, keep_latest_only=True)
+
+    async def main():
+        config = await _put(saver, _config(), 0)
+        await saver.aput_writes(config, [("context", "velho")], "task0")
+        async with saver.batch("t"):
+            middle = await _put(saver, config, 1)
+            await saver.aput_writes(middle, [("context", "meio")], "task1")
+            last = await _put(saver, middle, 2)
+        return middle, last
+
+    middle, last = asyncio.run(main())
+    assert saver.coalesced_checkpoints == 1
+    assert [t.config["configurable"]["checkpoint_id"] for t in saver.list(_config())] == \
+        [last["configurable"]["checkpoint_id"]]
+    assert saver.get_tuple(middle) is None
+    with saver._reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0] == 0
+
+
+def test_keep_latest_preserva_writes_do_checkpoint_carregado(tmp_path):
+    # Resume: o checkpoint veio do disco e o batch só adiciona writes (ex: ERROR) sobre ele
+    saver = _sqlite(tmp_path, keep_latest_only=True)
+
+    async def main():
+        saved = await _put(saver, _config(), 0)
+        async with saver.batch("t"):
+            await saver.aput_writes(saved, [("__error__", "boom")], "task1")
+        return await saver.aget_tuple(saved)
+
+    restored = asyncio.run(main())
+    assert restored.pending_writes == [("task1", "__error__", "boom")]
+
+
+def test_keep_latest_por_namespace(tmp_path):
+    saver = _sqlite(tmp_path, keep_latest_only=True)
+
+    async def main():
+        parent = await _put(saver, _config(), 0)
+        async with saver.batch("t"):
+            child = await _put(saver, _config(ns="filho:1"), 0)
+            await _put(saver, child, 1)
+            await saver.aput_writes(parent, [("context", "pai")], "task1")
+        return parent
+
+    parent = asyncio.run(main())
+    assert saver.get_tuple(parent).pending_writes == [("task1", "context", "pai")]
+    assert len(list(saver.list(_config(ns="filho:1")))) == 1
+
+
+def test_memory_saver_remove_a_sessao_menos_usada():
+    saver = BoundedMemorySaver(max_sessions=2, serde=CompactSerializer())
+
+    async def main():
+        for thread_id in ("a", "b", "c"):
+            await _put(saver, _config(thread_id), 0)
+
+    asyncio.run(main())
+    assert saver.get_tuple(_config("a")) is None
+    assert saver.get_tuple(_config("b")) is not None
+    assert saver.get_tuple(_config("c")) is not None
+
+
+def test_memory_saver_guarda_so_o_ultimo():
+    saver = BoundedMemorySaver(keep_latest_only=True, serde=CompactSerializer())
+
+    async def main():
+        config = _config("a")
+        for step in range(3):
+            config = await _put(saver, config, step)
+        return config
+
+    config = asyncio.run(main())
+    assert list(saver.storage["a"][""]) == [config["configurable"]["checkpoint_id"]]
+
+
+def test_compact_serializer_comprime_acima_do_limite():
+    serde = CompactSerializer(compress_threshold=64)
+    small = serde.dumps_typed({"a": 1})
+    large = serde.dumps_typed({"texto": "abc " * 500})
+    assert not small[0].endswith("+zlib")
+    assert large[0].endswith("+zlib")
+    assert serde.loads_typed(large) == {"texto": "abc " * 500}
+    assert serde.loads_typed(small) == {"a": 1}
+
+
+def test_sqlite_deixa_a_compressao_com_o_compact_serializer(tmp_path):
+    # Acima do limite do SqliteSaver (1024), abaixo do limite do serializer
+    saver = SqliteSaver(str(tmp_path / "ck.db"), serde=CompactSerializer(compress_threshold=8192))
+    config = asyncio.run(_put(saver, _config(), "abc " * 500))
+    with saver._reader() as conn:
+        (type_,) = conn.execute("SELECT type FROM checkpoints").fetchone()
+    assert not type_.endswith("+zlib")
+    assert saver.get_tuple(config).checkpoint["channel_values"]["context"] == "abc " * 500
+
+
+def test_stats_do_sqlite_fora_do_event_loop(tmp_path):
+    saver = _sqlite(tmp_path)
+    asyncio.run(_put(saver, _config(), 1))
+    threads = []
+    original = saver.stats
+    saver.stats = lambda: threads.append(threading.get_ident()) or original()
+
+    async def main():
+        return threading.get_ident(), await checkpointer_stats(saver)
+
+    loop_thread, stats = asyncio.run(main())
+    assert stats["live_sessions"] == 1
+    assert threads and threads[0] != loop_thread
+    assert asyncio.run(checkpointer_stats(BoundedMemorySaver()))["backend"] == "memory"
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from http_cache import HttpResponseCache
+from llm_cache import LLMResultCache
+from node_api import run_api
+from node_llm import call_llm
+from resilience import DeadlineExceeded, UpstreamRegistry, within_deadline
+
+
+def _deadline(seconds):
+    return time.monotonic() + seconds
+
+
+def test_within_deadline():
+    async def slow(seconds, value="ok"):
+        await asyncio.sleep(seconds)
+        return value
+
+    async def own_timeout():
+        await asyncio.wait_for(asyncio.sleep(1), 0.01)
+
+    async def main():
+        assert await within_deadline(slow(0.01), None) == "ok"
+        assert await within_deadline(slow(0.01), _deadline(1)) == "ok"
+        with pytest.raises(DeadlineExceeded):
+            await within_deadline(slow(1), _deadline(0.05))
+        with pytest.raises(DeadlineExceeded):
+            await within_deadline(slow(0), _deadline(-1))
+        # Timeout da própria chamada antes do deadline não vira DeadlineExceeded
+        with pytest.raises(asyncio.TimeoutError):
+            await within_deadline(own_timeout(), _deadline(5))
+
+    asyncio.run(main())
+
+
+class _Engine(SimpleNamespace):
+    @staticmethod
+    def deadline(config):
+        return (config or {}).get("configurable", {}).get("deadline")
+
+
+def _config(deadline=None):
+    return {"configurable": {"deadline": deadline}} if deadline else {}
+
+
+class SlowLLM:
+    temperature = 0
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(content="resposta")
+
+
+def test_llm_coalescido_nao_herda_o_deadline_de_outra_sessao():
+    llm = SlowLLM(delay=0.2)
+    engine = _Engine(llm=llm, llm_cache=LLMResultCache(), upstreams=UpstreamRegistry(), flow_name="f",
+                     plans={"llm": {"retries": 0, "timeout": 5.0, "llm_cache": {}}})
+
+    async def main():
+        apressada = asyncio.ensure_future(call_llm(engine, "llm", "prompt", _config(_deadline(0.05))))
+        await asyncio.sleep(0)
+        sem_deadline = asyncio.ensure_future(call_llm(engine, "llm", "prompt", _config()))
+        folgada = asyncio.ensure_future(call_llm(engine, "llm", "prompt", _config(_deadline(2))))
+        return await asyncio.gather(apressada, sem_deadline, folgada, return_exceptions=True)
+
+    apressada, sem_deadline, folgada = asyncio.run(main())
+    assert isinstance(apressada, DeadlineExceeded)
+    assert sem_deadline == folgada == "resposta"
+    assert llm.calls == 1
+    assert engine.llm_cache.coalesced == 2
+
+
+def test_api_coalescida_nao_herda_o_deadline_de_outra_sessao():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"name": "snorlax"})
+
+    engine = _Engine(
+        plans={"get": {"extract": None, "max_response_bytes": 10_000, "retries": 0, "timeout": 5.0}},
+        http_caches={"get": HttpResponseCache(ttl=60)}, upstreams=UpstreamRegistry(),
+        nodes_map={"get": {}}, flow_name="f",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    action = {"url": "http://u/p", "method": "GET"}
+
+    async def main():
+        apressada = asyncio.ensure_future(run_api(engine, "get", action, {}, _config(_deadline(0.05))))
+        await asyncio.sleep(0)
+        sem_deadline = asyncio.ensure_future(run_api(engine, "get", action, {}, _config()))
+        results = await asyncio.gather(apressada, sem_deadline, return_exceptions=True)
+        await engine.http_client.aclose()
+        return results
+
+    apressada, sem_deadline = asyncio.run(main())
+    assert isinstance(apressada, DeadlineExceeded)
+    assert sem_deadline == ({"status": 200, "data": {"name": "snorlax"}}, None)
+    assert len(calls) == 1
@@ -0,0 +1,70 @@
+import pytest
+from jinja2 import Environment
+
+from expressions import ExpressionError, compile_expression
+
+CONTEXT = {"a": "1", "b": "2", "n": 3, "m": -4, "s": "Ab", "lista": [1, 2, 3], "vazia": []}
+
+_jinja = Environment()
+
+
+def _jinja_eval(source):
+    return _jinja.compile_expression(source)(context=CONTEXT)
+
+
+@pytest.mark.parametrize("source", [
+    "context.n + context.b | int",
+    "context.n * context.b | int + 1",
+    "context.a | int + context.b | int",
+    "context.n - context.b | int - 1",
+    "context.n + context.b | int * 2 - context.m | abs",
+    "context.b | int * context.n + context.a | int",
+    "(context.a | int + context.n) * 2",
+    "context.n * (context.b | int + 1)",
+    "context.a | int | abs + 1",
+    "-context.m | abs",
+    "context.m | abs // 3",
+    "context.n % context.b | int",
+    "context.b | int == context.n - 1",
+    "context.n + 1 > context.b | int * 2",
+    "not context.vazia | length",
+    "context.lista | length + context.n",
+    "context.x | default(5) + 1",
+    "context.s | lower + 'x'",
+])
+def test_filtro_e_aritmetica_com_a_precedencia_do_jinja(source):
+    assert compile_expression(source).evaluate(CONTEXT) == _jinja_eval(source)
+
+
+def test_filtro_liga_so_ao_operando_da_esquerda():
+    # Antes era ((n + b) | int): str + int estourava em vez de somar
+    assert compile_expression("context.n + context.b | int").evaluate(CONTEXT) == 5
+
+
+def test_forma_com_chaves_e_tipos_nativos():
+    assert compile_expression("{{ context.n > 2 }}").evaluate(CONTEXT) is True
+    assert compile_expression("{{ context.lista[1] }}").evaluate(CONTEXT) == 2
+
+
+@pytest.mark.parametrize("source", ["context.n | (int + 1)", "context.n | nada", "os.system"])
+def test_expressao_invalida(source):
+    with pytest.raises(ExpressionError):
+        compile_expression(source)
+
+
+@pytest.mark.parametrize("source", [
+    "context.s.__class__",
+    "context.s['__class__']",
+    "context.lista[\"__dict__\"]",
+    "context['_x']",
+])
+def test_acesso_privado_rejeitado_na_compilacao(source):
+    with pytest.raises(ExpressionError, match="privado"):
+        compile_expression(source)
+
+
+def test_chave_privada_dinamica_nao_vira_getattr():
+    expression = compile_expression("context.s[context.k] is undefined")
+    assert expression.evaluate({"s": "Ab", "k": "__class__"}) is True
+    # Chave comum continua caindo no atributo, como no Jinja2
+    assert compile_expression("context.s['upper'] is defined").evaluate(CONTEXT) is True
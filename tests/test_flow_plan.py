@@ -0,0 +1,107 @@
+import pytest
+
+from flow_plan import EXIT, FlowValidationError, compile_flow
+
+
+def _node(node_id, node_type="fixed", **fields):
+    return {"id": node_id, "type": node_type, "action_config": fields.pop("action_config", {}), **fields}
+
+
+def _issues(nodes):
+    with pytest.raises(FlowValidationError) as error:
+        compile_flow({"nodes": nodes})
+    return error.value.issues
+
+
+def test_next_para_no_inexistente():
+    issues = _issues([
+        _node("a", next="nada"),
+        _node("b", "if-else", action_config={"condition": "true", "true_node": "a", "false_node": "sumiu"}),
+    ])
+    assert "Nó 'a' aponta para 'nada', que não existe." in issues
+    assert "Nó 'b' aponta para 'sumiu', que não existe." in issues
+
+
+def test_nos_inalcancaveis():
+    issues = _issues([_node("a"), _node("b", next="c"), _node("c")])
+    assert issues == ["Nós inalcançáveis a partir de 'a': b, c."]
+
+
+def test_desvio_templado_nao_marca_inalcancavel():
+    plan = compile_flow({"nodes": [
+        _node("a", "switch-case", action_config={"variable": "context.x", "cases": {"1": "{{ context.destino }}"}}),
+        _node("b"),
+    ]})
+    assert plan.dynamic == {"a"}
+
+
+def test_ciclo_sem_output_e_rejeitado_e_com_output_aceito():
+    issues = _issues([_node("a", next="b"), _node("b", next="a")])
+    assert issues == ["Ciclo sem saída e sem nó output (loop infinito): a, b."]
+    plan = compile_flow({"nodes": [
+        _node("pergunta", "output", action_config={"message": "?"}, next="responde"),
+        _node("responde", next="pergunta"),
+    ]})
+    assert plan.successors["responde"] == ("pergunta",)
+
+
+def test_conjuntos_de_leitura_e_escrita():
+    plan = compile_flow({"inputs": ["base"], "nodes": [
+        _node("a", "api", action_config={"url": "{{ context.base }}/{{ context.id }}"},
+              pre_update={"id": "{{ context.user_id }}"},
+              post_update={"dados": "{{ context.result.data }}", "eco": "{{ context.outro }}"},
+              post_remove=["temp"], on_error="erro", next="pergunta"),
+        _node("erro", "fixed"),
+        _node("pergunta", "output", action_config={"message": "?"}),
+    ]})
+    assert plan.action_reads["a"] == {"base", "id", "user_id"}
+    # `context.result` no post_update é o resultado da ação
+    assert plan.reads["a"] == {"base", "id", "user_id", "outro"}
+    assert plan.writes["a"] == {"id", "dados", "eco", "last_error"}
+    assert plan.removes["a"] == {"temp"}
+    assert plan.writes["pergunta"] == {"user_inputs"}
+    assert plan.successors["a"] == ("pergunta", "erro")
+    assert plan.successors["erro"] == (EXIT,)
+    assert plan.warnings == ("Nó 'a' lê 'context.outro', que nenhum nó escreve.",)
+
+
+def _conversa(*seguintes):
+    return compile_flow({"nodes": [
+        _node("pergunta", "output", action_config={"message": "?"},
+              post_update={"resposta": "{{ context.user_inputs[0] }}"}, next=seguintes[0]["id"]),
+        *seguintes,
+    ]})
+
+
+def test_prefetch_so_do_que_nao_depende_da_resposta():
+    plan = _conversa(
+        _node("catalogo", "api", action_config={"url": "https://x/catalogo"}, next="usa",
+              post_update={"catalogo": "{{ context.result.data }}"}),
+        _node("usa", "api", action_config={"url": "https://x/{{ context.resposta }}"}, next="resumo"),
+        _node("resumo", "llm", action_config={"prompt": "Resuma {{ context.catalogo }}"}),
+    )
+    assert plan.prefetch["pergunta"] == (("catalogo", "run"), ("usa", "skip"), ("resumo", "run"))
+
+
+def test_prefetch_propaga_a_dependencia_e_respeita_o_metodo():
+    plan = _conversa(
+        _node("copia", action_config={}, post_update={"alvo": "{{ context.resposta }}"}, next="post"),
+        _node("post", "api", action_config={"url": "https://x/fixo", "method": "POST"}, next="depende"),
+        _node("depende", "llm", action_config={"prompt": "{{ context.alvo }}"}),
+    )
+    # Nada adiantável: `copia` repassa a resposta, POST não é seguro e `depende` lê `alvo`
+    assert "pergunta" not in plan.prefetch
+
+    plan = _conversa(
+        _node("fixo", action_config={}, post_update={"x": 1}, next="post"),
+        _node("post", "api", action_config={"url": "https://x/fixo", "method": "POST"}, speculate=True),
+    )
+    assert plan.prefetch["pergunta"] == (("fixo", "simulate"), ("post", "run"))
+
+
+def test_prefetch_para_no_desvio():
+    plan = _conversa(
+        _node("desvio", "if-else", action_config={"condition": "true", "true_node": "depois", "false_node": "depois"}),
+        _node("depois", "llm", action_config={"prompt": "oi"}),
+    )
+    assert "pergunta" not in plan.prefetch
@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+import pytest
+
+from flow_registry import FlowRegistry
+from graph_cache import CompiledGraphCache
+
+FLOW = {"start_node": "fim", "nodes": [{"id": "fim", "type": "fixed", "action_config": {"data": {"ok": 1}}}]}
+
+
+def _registry(tmp_path):
+    async def builder(name, config, subflows):
+        return ("graph", name)
+
+    return FlowRegistry(str(tmp_path), CompiledGraphCache(), builder, poll_interval=0)
+
+
+def test_carrega_uma_vez_com_chamadas_simultaneas(tmp_path):
+    (tmp_path / "f.json").write_text(json.dumps(FLOW))
+    registry = _registry(tmp_path)
+
+    async def main():
+        return await asyncio.gather(*(registry.get("f") for _ in range(5)))
+
+    versions = asyncio.run(main())
+    assert all(v is versions[0] for v in versions)
+    assert registry.loads == 1
+    assert registry._load_locks == {} and registry._load_waiters == {}
+
+
+@pytest.mark.parametrize("content", [None, "{nao e json", json.dumps({"nodes": []})])
+def test_fluxo_que_falha_nao_deixa_lock(tmp_path, content):
+    if content is not None:
+        (tmp_path / "f.json").write_text(content)
+    registry = _registry(tmp_path)
+    with pytest.raises(Exception):
+        asyncio.run(registry.get("f"))
+    assert registry._load_locks == {} and registry._load_waiters == {}
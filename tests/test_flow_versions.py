@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import api
+from flow_registry import FlowRegistry
+
+RESPOSTA = [{"type": "text", "content": {"text": "oi"}}]
+
+
+def _flow(tag, ask):
+    return {"nodes": [
+        {"id": ask, "type": "output", "action_config": {"message": f"{tag} {ask}"}, "next": "fim"},
+        {"id": "fim", "type": "fixed", "action_config": {}, "post_update": {"final_message": f"{tag} fim"}},
+    ]}
+
+
+@pytest.fixture
+def flow_dir(tmp_path, monkeypatch):
+    registry = FlowRegistry(str(tmp_path), api.graph_cache, api._build_flow_graph, poll_interval=0)
+    monkeypatch.setattr(api, "flow_registry", registry)
+    return tmp_path
+
+
+def _serve(scenario):
+    async def main():
+        async with api.app.router.lifespan_context(api.app):
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+                async def run(user, messages=None):
+                    response = await client.post("/execute/versionado", json={"messages": messages or []},
+                                                 headers={"x-user-id": user})
+                    return response.status_code, response.json().get("message")
+                return await scenario(run)
+
+    return asyncio.run(main())
+
+
+def test_sessao_pausada_retoma_na_versao_em_que_comecou(flow_dir):
+    path = flow_dir / "versionado.json"
+
+    async def scenario(run):
+        path.write_text(json.dumps(_flow("v1", "ask")))
+        assert await run("pin-1") == (200, "v1 ask")
+        # A versão nova não tem mais o nó em que a sessão parou
+        path.write_text(json.dumps(_flow("v2", "ask2")))
+        await api.flow_registry.refresh()
+        return await run("pin-1", RESPOSTA), await run("pin-2")
+
+    retomada, nova = _serve(scenario)
+    assert retomada == (200, "v1 fim")
+    assert nova == (200, "v2 ask2")
+
+
+def test_fluxo_removido_so_recusa_sessoes_novas(flow_dir):
+    path = flow_dir / "versionado.json"
+
+    async def scenario(run):
+        path.write_text(json.dumps(_flow("v1", "ask")))
+        assert await run("rm-1") == (200, "v1 ask")
+        path.unlink()
+        await api.flow_registry.refresh()
+        return await run("rm-2"), await run("rm-1", RESPOSTA), await run("rm-1")
+
+    nova, pausada, terminada = _serve(scenario)
+    assert nova[0] == 404
+    assert pausada == (200, "v1 fim")
+    assert terminada[0] == 404
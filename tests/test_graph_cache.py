@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from graph_cache import CompiledGraphCache
+
+
+def test_build_compila_uma_vez_por_chave():
+    cache = CompiledGraphCache(maxsize=4)
+    chamadas = []
+
+    async def builder():
+        chamadas.append(1)
+        await asyncio.sleep(0)
+        return object()
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_build("f", "v1", builder) for _ in range(5)))
+
+    graphs = asyncio.run(main())
+    assert len(chamadas) == 1
+    assert all(g is graphs[0] for g in graphs)
+    assert cache._build_locks == {}
+
+
+def test_builder_com_erro_nao_deixa_lock():
+    cache = CompiledGraphCache(maxsize=4)
+
+    async def builder():
+        raise ValueError("fluxo inválido")
+
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get_or_build("f", "v1", builder))
+    assert cache._build_locks == {}
+    assert cache._build_waiters == {}
+    assert len(cache) == 0
+
+
+def test_quem_chega_depois_de_uma_falha_espera_a_nova_tentativa():
+    cache = CompiledGraphCache(maxsize=4)
+    tentativas = []
+
+    async def builder():
+        tentativas.append(1)
+        await asyncio.sleep(0.01)
+        if len(tentativas) == 1:
+            raise ValueError("falha transitória")
+        return object()
+
+    async def main():
+        primeira = asyncio.ensure_future(cache.get_or_build("f", "v1", builder))
+        segunda = asyncio.ensure_future(cache.get_or_build("f", "v1", builder))
+        with pytest.raises(ValueError):
+            await primeira
+        # A segunda já está compilando de novo; a terceira chega agora e deve esperar por ela
+        terceira = asyncio.ensure_future(cache.get_or_build("f", "v1", builder))
+        return await asyncio.gather(segunda, terceira)
+
+    graphs = asyncio.run(main())
+    assert len(tentativas) == 2
+    assert graphs[0] is graphs[1]
+    assert cache._build_locks == {} and cache._build_waiters == {}
@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+
+from http_cache import HttpResponseCache
+
+
+class Upstream:
+    """Transporte falso que conta as chamadas e responde com o cabeçalho pedido."""
+
+    def __init__(self, cache_control="max-age=60", delay=0.0):
+        self.cache_control = cache_control
+        self.delay = delay
+        self.calls = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request)
+        await asyncio.sleep(self.delay)
+        user = request.headers.get("authorization", "anon")
+        return httpx.Response(200, json={"user": user}, headers={"cache-control": self.cache_control})
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+
+def _run(upstream, scenario):
+    async def main():
+        async with upstream.client() as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_hit_depois_do_primeiro_get():
+    upstream, cache = Upstream(), HttpResponseCache(ttl=60)
+
+    async def scenario(client):
+        first = await cache.request(client, "GET", "http://u/x")
+        second = await cache.request(client, "GET", "http://u/x")
+        return first, second
+
+    first, second = _run(upstream, scenario)
+    assert len(upstream.calls) == 1
+    assert first.json() == second.json()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_chamadas_simultaneas_sao_coalescidas():
+    upstream, cache = Upstream(delay=0.05), HttpResponseCache(ttl=60)
+
+    async def scenario(client):
+        return await asyncio.gather(*(cache.request(client, "GET", "http://u/x") for _ in range(10)))
+
+    responses = _run(upstream, scenario)
+    assert len(upstream.calls) == 1
+    assert cache.coalesced == 9
+    assert all(r.json() == {"user": "anon"} for r in responses)
+
+
+def test_credenciais_nao_sao_compartilhadas():
+    upstream, cache = Upstream(delay=0.02), HttpResponseCache(ttl=60)
+
+    async def scenario(client):
+        alice, bob = await asyncio.gather(
+            cache.request(client, "GET", "http://u/me", headers={"Authorization": "Bearer alice"}),
+            cache.request(client, "GET", "http://u/me", headers={"Authorization": "Bearer bob"}),
+        )
+        again = await cache.request(client, "GET", "http://u/me", headers={"Authorization": "Bearer alice"})
+        return alice, bob, again
+
+    alice, bob, again = _run(upstream, scenario)
+    assert alice.json()["user"] == "Bearer alice"
+    assert bob.json()["user"] == "Bearer bob"
+    # Sem `public` a resposta autenticada não é guardada
+    assert again.json()["user"] == "Bearer alice"
+    assert len(upstream.calls) == 3
+    assert cache.stats()["entries"] == 0
+
+
+def test_resposta_public_com_credencial_fica_na_chave_da_credencial():
+    upstream, cache = Upstream(cache_control="public, max-age=60"), HttpResponseCache(ttl=60)
+
+    async def scenario(client):
+        for token in ("alice", "alice", "bob"):
+            await cache.request(client, "GET", "http://u/me", headers={"Cookie": f"s={token}"})
+
+    _run(upstream, scenario)
+    assert len(upstream.calls) == 2
+    assert cache.hits == 1
+
+
+def test_no_store_e_private_nao_sao_guardados():
+    for directive in ("no-store", "private"):
+        upstream, cache = Upstream(cache_control=directive), HttpResponseCache(ttl=60)
+
+        async def scenario(client):
+            await cache.request(client, "GET", "http://u/x")
+            await cache.request(client, "GET", "http://u/x")
+
+        _run(upstream, scenario)
+        assert len(upstream.calls) == 2
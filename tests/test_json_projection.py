@@ -0,0 +1,144 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from http_cache import HttpResponseCache
+from json_projection import ResponseTooLarge, build_trie, parse_path, project, stream_project
+from node_api import run_api
+from resilience import UpstreamRegistry
+
+DOCUMENT = {
+    "name": "snorlax",
+    "weight": 4600,
+    "types": [{"slot": 1, "type": {"name": "normal", "url": "u1"}},
+              {"slot": 2, "type": {"name": "sono", "url": "u2"}}],
+    "stats": [{"base_stat": 160, "stat": {"name": "hp"}}, {"base_stat": 110, "stat": {"name": "attack"}}],
+    "moves": [{"move": {"name": f"m{i}"}} for i in range(5)],
+    "headers": {"x-id": 7, "outro": 1},
+    "sprites": {"front_default": "f.png", "back_default": "b.png"},
+}
+
+
+async def _chunks(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _stream(document, trie, max_bytes=None):
+    return asyncio.run(stream_project(_chunks(json.dumps(document).encode()), trie, max_bytes))
+
+
+def test_parse_path():
+    assert parse_path("$.sprites.front_default") == ["sprites", "front_default"]
+    assert parse_path("types[*].type.name") == ["types", "*", "type", "name"]
+    assert parse_path("stats[0].base_stat") == ["stats", 0, "base_stat"]
+    assert parse_path('headers["x-id"]') == ["headers", "x-id"]
+
+
+@pytest.mark.parametrize("paths, expected", [
+    (["name"], {"name": "snorlax"}),
+    (["types[*].type.name"], {"types": [{"type": {"name": "normal"}}, {"type": {"name": "sono"}}]}),
+    (["stats[1].base_stat"], {"stats": [None, {"base_stat": 110}]}),
+    (["moves[3].move.name"], {"moves": [None, None, None, {"move": {"name": "m3"}}]}),
+    # Curinga + índice explícito: o índice recebe também o que o curinga pede
+    (["stats[*].stat.name", "stats[1].base_stat"],
+     {"stats": [{"stat": {"name": "hp"}}, {"base_stat": 110, "stat": {"name": "attack"}}]}),
+    (['headers["x-id"]', "$.sprites.front_default"], {"headers": {"x-id": 7}, "sprites": {"front_default": "f.png"}}),
+    (["nao_existe.campo"], {}),
+    ([""], DOCUMENT),
+])
+def test_projecao_em_memoria_e_em_streaming(paths, expected):
+    trie = build_trie(paths)
+    assert project(DOCUMENT, trie) == expected
+    assert _stream(DOCUMENT, trie) == expected
+
+
+def test_projecao_e_idempotente():
+    trie = build_trie(["moves[3].move.name", "stats[*].stat.name"])
+    once = project(DOCUMENT, trie)
+    assert project(once, trie) == once
+
+
+def test_streaming_para_quando_os_campos_ja_foram_lidos():
+    # O lixo depois de "name" nunca é lido: a projeção termina antes
+    data = b'{"name": "x", "resto": ' + b"[1," * 1000
+
+    async def main():
+        return await stream_project(_chunks(data), build_trie(["name"]))
+
+    assert asyncio.run(main()) == {"name": "x"}
+
+
+def test_streaming_respeita_o_limite():
+    with pytest.raises(ResponseTooLarge):
+        _stream({"blob": "x" * 5000, "name": "y"}, build_trie(["name"]), max_bytes=1000)
+
+
+class _Engine(SimpleNamespace):
+    @staticmethod
+    def deadline(config):
+        return None
+
+
+def _engine(handler, **plan):
+    node_id = "get"
+    plan = {"extract": build_trie(["name", "types[*].type.name"]), "max_response_bytes": 10_000,
+            "retries": 0, "timeout": 5.0, **plan}
+    cache = HttpResponseCache(ttl=60)
+    engine = _Engine(plans={node_id: plan}, http_caches={node_id: cache}, upstreams=UpstreamRegistry(),
+                     nodes_map={node_id: {}}, flow_name="f",
+                     http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return engine, cache
+
+
+def _run_api(engine, times=1):
+    async def main():
+        results = [await run_api(engine, "get", {"url": "http://u/p", "method": "GET"}, {}, None)
+                   for _ in range(times)]
+        await engine.http_client.aclose()
+        return results
+    return asyncio.run(main())
+
+
+def test_api_com_cache_guarda_so_o_projetado():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=DOCUMENT, headers={"cache-control": "max-age=60"})
+
+    engine, cache = _engine(handler)
+    results = _run_api(engine, times=2)
+    expected = {"name": "snorlax", "types": [{"type": {"name": "normal"}}, {"type": {"name": "sono"}}]}
+    assert [r for r, _ in results] == [{"status": 200, "data": expected}] * 2
+    assert len(calls) == 1
+    (entry,) = cache._entries.values()
+    assert json.loads(entry.content) == expected
+
+
+def test_api_com_cache_aborta_corpo_grande_sem_content_length():
+    def handler(request):
+        body = json.dumps({"blob": "x" * 50_000, "name": "y"}).encode()
+        return httpx.Response(200, stream=httpx.ByteStream(body), headers={"content-type": "application/json"})
+
+    engine, cache = _engine(handler, max_response_bytes=1000)
+    ((result, _),) = _run_api(engine)
+    assert result["status"] == 200
+    assert result["error"].startswith("Response Too Large")
+    assert cache.stats()["entries"] == 0
+
+
+def test_api_com_cache_e_corpo_gzip():
+    import gzip
+
+    def handler(request):
+        return httpx.Response(200, content=gzip.compress(json.dumps(DOCUMENT).encode()),
+                              headers={"content-type": "application/json", "content-encoding": "gzip"})
+
+    engine, _ = _engine(handler)
+    ((first, _), (second, _)) = _run_api(engine, times=2)
+    assert first == second
+    assert first["data"]["name"] == "snorlax"
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+from engine import FlowEngine
+from layered_context import DELTA_KEY, LayeredContext, changes, context_delta, materialize, merge_context
+
+
+def test_camadas_sobre_a_mesma_base_nao_se_enxergam():
+    base = {"x": 1, "lista": [1], "apagar": True}
+    a, b = LayeredContext(base), LayeredContext(base)
+    a["x"] = 2
+    del a["apagar"]
+    b["y"] = 3
+
+    assert (b["x"], "apagar" in b, "y" in a) == (1, True, False)
+    assert base == {"x": 1, "lista": [1], "apagar": True}
+    assert changes(a) == ({"x": 2}, ["apagar"])
+    assert changes(b) == ({"y": 3}, [])
+    assert materialize(a) == {"x": 2, "lista": [1]}
+
+    # Reescrever uma chave removida tira a remoção do delta
+    a["apagar"] = False
+    assert changes(a) == ({"x": 2, "apagar": False}, [])
+
+
+def test_merge_context_aplica_delta_ou_substitui():
+    context = LayeredContext({"x": 1, "y": 2})
+    context["x"] = 10
+    del context["y"]
+    current = {"x": 1, "y": 2, "z": 3}
+    assert merge_context(current, context_delta(context)) == {"x": 10, "z": 3}
+    # O contexto anterior (checkpoint) não é alterado
+    assert current == {"x": 1, "y": 2, "z": 3}
+    assert merge_context(current, {"novo": 1}) == {"novo": 1}
+    assert DELTA_KEY not in merge_context(None, context_delta(context))
+
+
+def _parallel_flow(conflict=None, b_writes="{{ context.visto_por_b }}"):
+    join_config = {} if conflict is None else {"conflict": conflict}
+    return {"render": "native", "nodes": [
+        {"id": "inicio", "type": "fixed", "pre_update": {"x": 0, "tags": ["base"], "temp": 1}, "next": "fan"},
+        {"id": "fan", "type": "parallel", "action_config": {"branches": ["a", "b"]}, "next": "junta"},
+        {"id": "a", "type": "fixed", "pre_update": {"x": 1, "tags": ["a"]}, "post_remove": ["temp"]},
+        # `b` lê o contexto de antes do fan-out, sem as escritas de `a` (mesmo superstep)
+        {"id": "b", "type": "fixed", "pre_update": {"visto_por_b": "{{ context.x }}", "tags": ["b"]},
+         "post_update": {"x": b_writes}},
+        {"id": "junta", "type": "join", "action_config": join_config,
+         "post_update": {"ramos": "{{ context.result.branches }}"}},
+    ]}
+
+
+def _run(flow):
+    async def main():
+        engine = FlowEngine(flow, InMemorySaver(), flow_name="par")
+        app = await engine.build_graph()
+        values = await app.ainvoke({"context": {}, "current_node": "inicio"}, {"configurable": {"thread_id": "p"}})
+        return values["context"]
+
+    return asyncio.run(main())
+
+
+def test_ramos_paralelos_isolados_e_deltas_aplicados_no_join():
+    context = _run(_parallel_flow(conflict="merge"))
+    assert context["visto_por_b"] == 0
+    # Conflitos em `x` e `tags` resolvidos com `merge` (listas concatenadas, na ordem dos ramos)
+    assert context["x"] == 0
+    assert context["tags"] == ["a", "b"]
+    assert "temp" not in context
+    assert context["ramos"] == ["a", "b"]
+
+
+@pytest.mark.parametrize("conflict, x, tags", [("first", 1, ["a"]), ("last", 0, ["b"])])
+def test_regra_de_conflito_do_join(conflict, x, tags):
+    context = _run(_parallel_flow(conflict=conflict))
+    assert (context["x"], context["tags"]) == (x, tags)
+
+
+def test_conflito_sem_regra_derruba_o_join():
+    with pytest.raises(ValueError, match="Conflito no join 'junta'"):
+        _run(_parallel_flow())
+
+
+def test_mesmo_valor_nos_dois_ramos_nao_e_conflito():
+    flow = _parallel_flow(b_writes=1)
+    for node in flow["nodes"]:
+        if node["id"] == "b":
+            node["pre_update"]["tags"] = ["a"]
+    context = _run(flow)
+    assert (context["x"], context["tags"]) == (1, ["a"])
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+from node_core import merge_branches, select_case
+
+
+def _engine(action_config):
+    return SimpleNamespace(
+        nodes_map={"join": {"type": "join", "action_config": action_config}},
+        join_branches={"join": ["a", "b"]},
+    )
+
+
+def test_select_case_compara_como_as_chaves_do_json():
+    cases = {"1": "um", "true": "sim", "x": "xis"}
+    assert select_case(cases, 1) == "um"
+    assert select_case(cases, True) == "sim"
+    assert select_case(cases, "x") == "xis"
+    assert select_case(cases, [1]) is None
+
+
+def test_merge_branches_aplica_os_deltas_na_ordem_do_parallel():
+    context = {"manter": 1, "apagar": 2}
+    results = {
+        "b": {"updates": {"lista": [2], "dados": {"y": 2}}, "removed": []},
+        "a": {"updates": {"lista": [1], "dados": {"x": 1}}, "removed": ["apagar"]},
+    }
+    summary = merge_branches(_engine({"conflict": "merge"}), "join", context, results)
+    assert context == {"manter": 1, "lista": [1, 2], "dados": {"x": 1, "y": 2}}
+    assert summary == {"branches": ["a", "b"], "errors": {}}
+
+
+def test_merge_branches_conflito_e_erros_de_ramo():
+    results = {
+        "a": {"updates": {"k": 1}, "removed": []},
+        "b": {"updates": {"k": 2}, "removed": []},
+    }
+    with pytest.raises(ValueError, match="Conflito no join 'join'"):
+        merge_branches(_engine({}), "join", {}, results)
+
+    context = {}
+    summary = merge_branches(_engine({"conflicts": {"k": "first"}}), "join", context,
+                             {**results, "b": {"error": "Timeout após 1s"}})
+    assert context == {"k": 1}
+    assert summary["errors"] == {"b": "Timeout após 1s"}
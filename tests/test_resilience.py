@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import resilience
+from resilience import BulkheadFullError, CircuitOpenError, DeadlineExceeded, UpstreamRegistry
+
+FAST = {"backoff_base": 0.001, "backoff_max": 0.002, "min_samples": 1000}
+
+
+class FakeUpstream:
+    """`fn(timeout)` que segue um roteiro: exceções são levantadas, o resto é devolvido."""
+
+    def __init__(self, *script, delay=0.0):
+        self.script = list(script)
+        self.timeouts = []
+        self.delay = delay
+
+    async def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        outcome = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def _status_error(status, headers=None):
+    request = httpx.Request("GET", "http://up/x")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def _call(registry, fn, **kwargs):
+    return asyncio.run(registry.call("up", fn, **kwargs))
+
+
+def test_falhas_passageiras_sao_repetidas():
+    registry = UpstreamRegistry(FAST)
+    fn = FakeUpstream(httpx.ConnectError("recusou"), _status_error(503), "ok")
+    assert _call(registry, fn) == "ok"
+    stats = registry.stats()["up"]
+    assert (stats["calls"], stats["failures"], stats["retries"], stats["state"]) == (3, 2, 2, "closed")
+
+
+def test_sem_repeticao_para_nao_idempotente_e_erro_do_chamador():
+    registry = UpstreamRegistry(FAST)
+    fn = FakeUpstream(httpx.ConnectError("recusou"), "ok")
+    with pytest.raises(httpx.ConnectError):
+        _call(registry, fn, idempotent=False)
+    assert len(fn.timeouts) == 1
+
+    # 4xx (exceto 429) é resposta do upstream: nem repete nem conta como falha
+    fn = FakeUpstream(_status_error(404), "ok")
+    with pytest.raises(httpx.HTTPStatusError):
+        _call(registry, fn)
+    assert len(fn.timeouts) == 1
+    assert registry.stats()["up"]["failures"] == 1
+
+
+def test_backoff_com_jitter_limitado_e_retry_after(monkeypatch):
+    limits = []
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: limits.append((low, high)) or 0.0)
+    registry = UpstreamRegistry({**FAST, "backoff_base": 0.001, "backoff_max": 0.003, "failure_threshold": 100})
+    with pytest.raises(httpx.ConnectError):
+        _call(registry, FakeUpstream(httpx.ConnectError("recusou")), retries=3)
+    # Full jitter: sorteio em [0, min(máx, base * 2^tentativa)]
+    assert limits == [(0, 0.001), (0, 0.002), (0, 0.003)]
+
+    limits.clear()
+    assert _call(registry, FakeUpstream(_status_error(429, {"retry-after": "0"}), "ok")) == "ok"
+    assert limits == []
+
+
+def test_circuito_abre_e_testa_uma_chamada_no_meio_aberto():
+    registry = UpstreamRegistry({**FAST, "failure_threshold": 2, "reset_timeout": 0.05, "retries": 0})
+    failing = FakeUpstream(httpx.ConnectError("recusou"))
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await registry.call("up", failing)
+        upstream = registry.get("up")
+        assert upstream.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await registry.call("up", failing)
+        assert len(failing.timeouts) == 2
+
+        await asyncio.sleep(0.06)
+        # Meio-aberto: só a chamada de teste sai; a concorrente é recusada
+        probe = asyncio.ensure_future(registry.call("up", FakeUpstream("ok", delay=0.02)))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await registry.call("up", FakeUpstream("ok"))
+        assert await probe == "ok"
+        assert upstream.breaker.state == "closed"
+
+        # Teste que falha reabre o circuito
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await registry.call("up", failing)
+        await asyncio.sleep(0.06)
+        with pytest.raises(httpx.ConnectError):
+            await registry.call("up", failing)
+        return upstream.breaker.state
+
+    assert asyncio.run(main()) == "open"
+
+
+def test_bulkhead_recusa_quem_espera_demais():
+    registry = UpstreamRegistry({**FAST, "max_concurrency": 1, "queue_timeout": 0.02})
+
+    async def main():
+        busy = asyncio.ensure_future(registry.call("up", FakeUpstream("ok", delay=0.1)))
+        await asyncio.sleep(0)
+        with pytest.raises(BulkheadFullError):
+            await registry.call("up", FakeUpstream("ok"))
+        return await busy
+
+    assert asyncio.run(main()) == "ok"
+    stats = registry.stats()["up"]
+    assert (stats["rejected"], stats["in_flight"], stats["state"]) == (1, 0, "closed")
+
+
+def test_deadline_limita_o_timeout_e_nao_conta_como_falha():
+    registry = UpstreamRegistry(FAST)
+    fn = FakeUpstream("ok")
+    assert _call(registry, fn, timeout=10, deadline=time.monotonic() + 0.05) == "ok"
+    assert fn.timeouts[0] <= 0.05
+
+    async def hangs(timeout):
+        await asyncio.wait_for(asyncio.sleep(1), timeout)
+
+    with pytest.raises(DeadlineExceeded):
+        _call(registry, hangs, timeout=10, deadline=time.monotonic() + 0.02)
+    assert registry.stats()["up"]["failures"] == 0
+
+    fn = FakeUpstream("ok")
+    with pytest.raises(DeadlineExceeded):
+        _call(registry, fn, deadline=time.monotonic() - 1)
+    assert fn.timeouts == []
@@ -0,0 +1,117 @@
+import asyncio
+
+import httpx
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+
+from engine import FlowEngine
+from speculation import SpeculationStash
+
+FLOW = {"speculation": True, "nodes": [
+    {"id": "setup", "type": "fixed", "pre_update": {"base": "catalogo"}, "next": "ask"},
+    {"id": "ask", "type": "output", "action_config": {"message": "nome?"},
+     "post_update": {"nome": "{{ context.user_inputs[0] }}"}, "next": "catalog"},
+    {"id": "catalog", "type": "api", "action_config": {"url": "http://up/{{ context.base }}"},
+     "post_update": {"final_message": "{{ context.result.data.path }} {{ context.nome }}"}},
+]}
+
+
+def _future():
+    return asyncio.get_running_loop().create_future()
+
+
+def test_take_devolve_a_task_se_a_config_for_igual():
+    async def main():
+        stash = SpeculationStash("f")
+        stash.start("s", None)
+        future = _future()
+        assert stash.put("s", "n", {"url": "/a"}, future)
+        return stash.take("s", "n", {"url": "/a"}) is future, future.cancelled()
+
+    assert asyncio.run(main()) == (True, False)
+
+
+def test_take_cancela_se_a_config_mudou():
+    async def main():
+        stash = SpeculationStash("f")
+        stash.start("s", None)
+        future = _future()
+        stash.put("s", "n", {"url": "/a"}, future)
+        taken = stash.take("s", "n", {"url": "/b"})
+        # Já retirada: uma segunda tentativa não acha nada
+        return taken, future.cancelled(), stash.take("s", "n", {"url": "/a"})
+
+    assert asyncio.run(main()) == (None, True, None)
+
+
+def test_sessao_expirada_e_cancelada():
+    async def main():
+        stash = SpeculationStash("f", ttl=0.01)
+        stash.start("velha", None)
+        future = _future()
+        stash.put("velha", "n", {}, future)
+        await asyncio.sleep(0.02)
+        stash.start("nova", None)
+        return future.cancelled(), stash.take("velha", "n", {}), len(stash)
+
+    assert asyncio.run(main()) == (True, None, 1)
+
+
+def test_teto_de_sessoes_descarta_a_mais_antiga():
+    async def main():
+        stash = SpeculationStash("f", max_sessions=2)
+        futures = {}
+        for thread_id in ("a", "b", "c"):
+            task = _future()
+            stash.start(thread_id, task)
+            futures[thread_id] = task
+        # Sessão fora do stash não recebe especulações novas
+        late = _future()
+        return {t: f.cancelled() for t, f in futures.items()}, stash.put("a", "n", {}, late), late.cancelled()
+
+    cancelled, put, late_cancelled = asyncio.run(main())
+    assert cancelled == {"a": True, "b": False, "c": False}
+    assert (put, late_cancelled) == (False, True)
+
+
+def _run_flow(between_turns=None):
+    calls = []
+
+    async def upstream(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"path": request.url.path})
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            engine = FlowEngine(FLOW, InMemorySaver(), http_client=client, flow_name="spec")
+            app = await engine.build_graph()
+            config = {"configurable": {"thread_id": "s1"}}
+            await app.ainvoke({"context": {"user_id": "s1"}, "current_node": "setup"}, config)
+            # A sessão está parada no `ask`; o `catalog` já foi disparado
+            await asyncio.sleep(0.05)
+            assert calls == ["/catalogo"]
+            if between_turns is not None:
+                await between_turns(app, config)
+            values = await app.ainvoke(Command(resume=["ana"]), config)
+            return values["context"]["final_message"], len(engine.speculation)
+
+    final_message, sessions = asyncio.run(main())
+    return final_message, calls, sessions
+
+
+def test_resume_aproveita_a_acao_adiantada():
+    final_message, calls, sessions = _run_flow()
+    assert final_message == "/catalogo ana"
+    assert calls == ["/catalogo"]
+    # Fim do fluxo descarta o que sobrou da sessão
+    assert sessions == 0
+
+
+def test_resume_descarta_se_as_entradas_mudaram():
+    async def muda_a_base(app, config):
+        await app.aupdate_state(config, {"context": {"base": "outro"}})
+
+    final_message, calls, _ = _run_flow(muda_a_base)
+    assert final_message == "/outro ana"
+    assert calls == ["/catalogo", "/outro"]
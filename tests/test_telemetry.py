@@ -0,0 +1,19 @@
+import re
+
+import telemetry
+
+_SAMPLE = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*(\{.*\})? \S+$")
+
+
+def test_gauges_do_stats_tem_tipo_e_nome_valido():
+    text = telemetry.render_metrics({
+        "graph_cache": {"hits": 3, "hit_rate": 0.5, "current": {"f": "abc"}},
+        "llm-cache": {"disk.hits": 2, "enabled": True},
+    })
+    lines = text.splitlines()
+    assert "# TYPE flow_graph_cache_hits gauge" in lines
+    assert "flow_llm_cache_disk_hits 2" in lines
+    assert "# TYPE flow_llm_cache_disk_hits gauge" in lines
+    assert not any("enabled" in line or "current" in line for line in lines)
+    for line in lines:
+        assert line.startswith("# ") or _SAMPLE.match(line), line